@@ -1,7 +1,10 @@
-import socket
-import threading
+import time
 import cv2
 
+from frame_preview import PreviewProcess, PREVIEW_MODES
+from stk_protocol import CommandSender, SOURCE_QR
+from timer_service import default_service
+
 
 class QRDetector:
     """
@@ -18,19 +21,24 @@ class QRDetector:
         - "LOOKBACK" : Active le regard en arrière
     """
 
-    def __init__(self, _server_address='localhost', _server_port=6007):
+    def __init__(self, _server_address='localhost', _server_port=6007, sender=None, preview='window'):
+        """preview: 'window' (annotated in the loop), 'process' (frame_preview.PreviewProcess) or None (headless)"""
+        if preview not in PREVIEW_MODES:
+            raise ValueError("Unknown preview mode " + str(preview))
 
         self.camera_id = 0
         self.delay = 1
         self.window_name = 'QR Code Detector'
 
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_address = (_server_address, _server_port)
+        # UDP sender, or command_bus.BusSender when running with the server
+        self.sender = CommandSender(self.server_address, SOURCE_QR) if sender is None else sender
 
         self.qcd = cv2.QRCodeDetector()
         self.cap = cv2.VideoCapture(self.camera_id)
 
         self.release_delay = 0.1
+        self.timers = default_service()
 
         self.is_nitroing = False
         self.frame_since_nitro = 0
@@ -47,6 +55,14 @@ class QRDetector:
         self.has_fired = False
         self.has_rescued = False
 
+        # Monotonic time (ns) at which the frame being processed was read, used to stamp the commands
+        self.frame_stamp = None
+
+        self.preview = preview
+        self.preview_process = None
+        self.shapes = None  # QR codes of the frame for the preview process, None when no preview is due
+        self.running = False
+
     def recognize_qr_code(self, frame):
 
         view_nitro = False
@@ -80,7 +96,10 @@ class QRDetector:
                     color = (0, 255, 0)
                 else:
                     color = (0, 0, 255)
-                frame = cv2.polylines(frame, [p.astype(int)], True, color, 8)
+                if self.preview == 'window':
+                    frame = cv2.polylines(frame, [p.astype(int)], True, color, 8)
+                elif self.shapes is not None:
+                    self.shapes.append((p.astype(int), color))
 
         # Handle the commands
         self.handle_nitro(view_nitro)
@@ -95,8 +114,7 @@ class QRDetector:
 
             # If the nitro is not already activated we send the command to the server
             if not self.is_nitroing:
-                data = b'P_NITRO'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'P_NITRO', stamp=self.frame_stamp)
                 self.is_nitroing = True
 
         # If the QR wasn't seen this frame, we increase the nitro counter
@@ -106,8 +124,7 @@ class QRDetector:
         # stop the nitro
         if self.frame_since_nitro >= self.max_frame_without_turbo:
             if self.is_nitroing:
-                data = b'R_NITRO'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'R_NITRO', stamp=self.frame_stamp)
             self.is_nitroing = False
 
     def handle_skidding(self, view_skidding):
@@ -118,8 +135,7 @@ class QRDetector:
 
             # If the skidding is not already activated we send the command to the server
             if not self.is_skidding:
-                data = b'P_SKIDDING'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'P_SKIDDING', stamp=self.frame_stamp)
                 self.is_skidding = True
 
         # If the QR wasn't seen this frame, we increase the skidding counter
@@ -129,8 +145,7 @@ class QRDetector:
         # to stop the skidding
         if self.frame_since_skidding >= self.max_frame_without_skidding:
             if self.is_skidding:
-                data = b'R_SKIDDING'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'R_SKIDDING', stamp=self.frame_stamp)
             self.is_skidding = False
 
     def handle_lookback(self, view_lookback):
@@ -141,8 +156,7 @@ class QRDetector:
 
             # If the lookback is not already activated we send the command to the server
             if not self.is_lookbacking:
-                data = b'P_LOOKBACK'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'P_LOOKBACK', stamp=self.frame_stamp)
                 self.is_lookbacking = True
 
         # If the QR wasn't seen this frame, we increase the lookback counter
@@ -152,44 +166,61 @@ class QRDetector:
         # to stop the lookback
         if self.frame_since_lookback >= self.max_frame_without_lookback:
             if self.is_lookbacking:
-                data = b'R_LOOKBACK'
-                self.client_socket.sendto(data, self.server_address)
+                self.sender.send(b'R_LOOKBACK', stamp=self.frame_stamp)
             self.is_lookbacking = False
 
     def send_instant_commande(self, command):
         if command == "P_RESCUE":
-            data = b'P_RESCUE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'P_RESCUE', stamp=self.frame_stamp)
             # Programme un envoie de la commande R_RESCUE dans 2 secondes
-            timer = threading.Timer(self.release_delay, self.send_instant_commande, ["R_RESCUE"])
-            timer.start()
+            self.timers.schedule(self.release_delay, self.send_instant_commande, "R_RESCUE")
 
         elif command == "P_FIRE":
-            data = b'P_FIRE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'P_FIRE', stamp=self.frame_stamp)
             # Programme un envoie de la commande R_FIRE dans 2 secondes
-            timer = threading.Timer(self.release_delay, self.send_instant_commande, ["R_FIRE"])
-            timer.start()
+            self.timers.schedule(self.release_delay, self.send_instant_commande, "R_FIRE")
 
         elif command == "R_RESCUE":
-            data = b'R_RESCUE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'R_RESCUE')
             self.has_rescued = False
 
         elif command == "R_FIRE":
-            data = b'R_FIRE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'R_FIRE')
             self.has_fired = False
 
     def run(self):
-        while True:
-            ret, frame = self.cap.read()
-
-            if ret:
-                self.recognize_qr_code(frame)
-                cv2.imshow(self.window_name, frame)
-
-            if cv2.waitKey(self.delay) & 0xFF == ord('q'):
-                break
-
-        cv2.destroyWindow(self.window_name)
+        self.running = True
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                self.frame_stamp = time.monotonic_ns()
+
+                if ret:
+                    if self.preview == 'process' and self.preview_process is None:
+                        self.preview_process = PreviewProcess(self.window_name, frame.shape).start()
+                    preview_due = self.preview_process is not None and self.preview_process.due()
+                    self.shapes = [] if preview_due else None
+                    self.recognize_qr_code(frame)
+                    if self.preview == 'window':
+                        cv2.imshow(self.window_name, frame)
+                    elif preview_due:
+                        self.preview_process.publish(frame, self.shapes)
+                elif self.preview != 'window':
+                    # No frame: wait as waitKey does for the window instead of spinning on read()
+                    time.sleep(self.delay / 1000)
+
+                if self.preview == 'window':
+                    if cv2.waitKey(self.delay) & 0xFF == ord('q'):
+                        break
+                elif self.preview_process is not None and self.preview_process.quit_requested():
+                    break
+        finally:
+            if self.preview == 'window':
+                cv2.destroyWindow(self.window_name)
+            elif self.preview_process is not None:
+                self.preview_process.close()
+                self.preview_process = None
+
+    def stop(self):
+        """Stop run from another thread, for the headless runs."""
+        self.running = False
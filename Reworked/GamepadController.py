@@ -2,33 +2,48 @@
 """
 This script aims to provide a class that will recieve input from differents scripts and trigger gamepag inputs.
 """
-import time
-
 import vgamepad
 
-import threading
+from timer_service import default_service
 
 
 
 class GamepadController:
-    def __init__(self, debug = False):
+    def __init__(self, debug = False, metrics = None, timers = None):
         self.debug = debug
         self.vg = vgamepad.VX360Gamepad()
+        # Delayed releases of the instant commands, one pending release per button
+        self.timers = default_service() if timers is None else timers
+        self.release_timers = {}
+        # Optional latency_metrics.MetricsRegistry recording the latency of the stamped commands
+        self.metrics = metrics
         print("GamepadController initialized")
 
-    def send_instant_command(self,command):
+    def record_latency(self, source, command, stamp):
+        """stamp is the monotonic capture time (ns) of the sensor sample behind the command"""
+        if stamp and self.metrics is not None:
+            self.metrics.record_latency(source, command, stamp)
+
+    def send_instant_command(self,command, stamp = None, source = "gamepad"):
         if command == "FIRE":
             self.press_button("B")
-            timer = threading.Timer(0.2, self.release_button, ["B"])
-            timer.start()
+            self.release_later("B", 0.2)
         elif command == "RESCUE":
             self.press_button("BACK")
-            timer = threading.Timer(0.2, self.release_button, ["BACK"])
-            timer.start()
+            self.release_later("BACK", 0.2)
         else:
             raise ValueError("Command "+str(command)+" not recognized")
+        self.record_latency(source, command, stamp)
+
+    def release_later(self, button, delay):
+        # A new instant command on a button already waiting for its release pushes the release back
+        handle = self.release_timers.get(button)
+        if handle is None:
+            self.release_timers[button] = self.timers.schedule(delay, self.release_button, button)
+        else:
+            handle.reschedule(delay)
 
-    def send_command(self,command, update = True):
+    def send_command(self,command, update = True, stamp = None, source = "gamepad"):
         if command == "P_UP":
             self.press_button("Y", update)
         elif command == "R_UP":
@@ -57,6 +72,8 @@ class GamepadController:
         else :
             raise ValueError("Command "+str(command)+" not recognized")
 
+        self.record_latency(source, command, stamp)
+
 
 
     def press_button(self, button, update = True):
@@ -86,6 +103,8 @@ class GamepadController:
             self.vg.left_trigger(255)
         elif button == "BACK":
             self.vg.press_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_BACK)
+        elif button == "START":
+            self.vg.press_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START)
         if update : self.vg.update()
 
 
@@ -109,6 +128,8 @@ class GamepadController:
             self.vg.left_trigger(0)
         elif button == "BACK":
             self.vg.release_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_BACK)
+        elif button == "START":
+            self.vg.release_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START)
 
         if update : self.vg.update()
 
@@ -116,17 +137,15 @@ class GamepadController:
     def signal(self):
         if self.debug:
             print("Signal")
-        self.vg.press_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START)
-        self.vg.update()
-        time.sleep(1)
-        self.vg.release_button(vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START)
-        self.vg.update()
+        self.press_button("START")
+        self.release_later("START", 1)
 
-    def steer(self, x):
+    def steer(self, x, stamp = None, source = "gamepad"):
         if self.debug:
             # print("Steer : ", x)
             pass
         # Used to steer
         self.vg.left_joystick_float(x, 0)
         self.vg.update()
+        self.record_latency(source, "STEER", stamp)
 
@@ -4,19 +4,25 @@ from Reworked.GamepadController import GamepadController
 from Reworked.OSCServerReworked import OSCServerReworked
 from Reworked.QrCodeReworked import QRDetectorReworked
 from Reworked.voiceActionReworked import VoiceActionReworked
+from latency_metrics import MetricsRegistry, MetricsServer
+from timer_service import default_service
+
 
 if __name__ == "__main__":
-    gamepadController = GamepadController(True)
+    metrics = MetricsRegistry(prefix="gamepad")
+    metrics_server = MetricsServer(metrics, 9109).start()
+    timers = default_service()
+
+    gamepadController = GamepadController(True, metrics=metrics)
 
     osc_server_reworked = OSCServerReworked(gamepadController, True)
 
     qr_code_reworked = QRDetectorReworked(gamepadController)
-    timer_qr = threading.Timer(1, qr_code_reworked.run, [])
-    timer_qr.start()
+    # The detection loops run forever, they get their own thread once launched
+    timers.schedule(1, threading.Thread(target=qr_code_reworked.run).start)
 
     voice_action_reworked = VoiceActionReworked(gamepadController)
-    timer_voice = threading.Timer(1, voice_action_reworked.run, [])
-    timer_voice.start()
+    timers.schedule(1, threading.Thread(target=voice_action_reworked.run).start)
 
 
     while True:
@@ -24,8 +30,8 @@ if __name__ == "__main__":
         if inp == "q":
             break
         else:
-            timer = threading.Timer(3, gamepadController.signal, [])
-            timer.start()
+            timers.schedule(3, gamepadController.signal)
             print("Signal sent")
 
-    osc_server_reworked.osc.stop()
\ No newline at end of file
+    osc_server_reworked.osc.stop()
+    metrics_server.stop()
\ No newline at end of file
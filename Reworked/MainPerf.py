@@ -5,17 +5,24 @@ import threading
 from Reworked.GamepadController import GamepadController
 from Reworked.OSCServerReworked import OSCServerReworked
 from Reworked.arduino_reworked import ArduinoReworked
+from latency_metrics import MetricsRegistry, MetricsServer
+from timer_service import default_service
+
 
 if __name__ == "__main__":
-    gamepadController = GamepadController()
+    metrics = MetricsRegistry(prefix="gamepad")
+    metrics_server = MetricsServer(metrics, 9109).start()
+    timers = default_service()
+
+    gamepadController = GamepadController(metrics=metrics)
 
     osc_server_reworked = OSCServerReworked(gamepadController, False)
 
     arduino_reworked = ArduinoReworked(gamepadController)
 
     port = "COM6"
-    timer_arduino = threading.Timer(1, arduino_reworked.read_ultrasound_data, [port])
-    timer_arduino.start()
+    # The reading loop runs forever, it gets its own thread once launched
+    timers.schedule(1, threading.Thread(target=arduino_reworked.read_ultrasound_data, args=(port,)).start)
 
 
     while True:
@@ -23,8 +30,8 @@ if __name__ == "__main__":
         if inp == "q":
             break
         else:
-            timer = threading.Timer(3, gamepadController.signal, [])
-            timer.start()
+            timers.schedule(3, gamepadController.signal)
             print("Signal sent")
 
-    osc_server_reworked.osc.stop()
\ No newline at end of file
+    osc_server_reworked.osc.stop()
+    metrics_server.stop()
\ No newline at end of file
@@ -1,17 +1,45 @@
 from oscpy.server import OSCThreadServer
+from osc_frames import OSCFrameServer
+from osc_fastpath import FastPathServer
 import time
 
 from Reworked.GamepadController import GamepadController
+from signal_filters import OneEuroFilter, ShakeDetector
+
+# One-Euro filter of the orientation angles (degrees)
+ANGLE_MIN_CUTOFF = 1.0  # Hz, smoothing at rest
+ANGLE_BETA = 0.05  # Cutoff increase per degree per second, to follow the fast turns
+
+# Shake detection (rescue)
+DERIVATIVE_THRESHOLD = 3  # The amount of acceleration change required to detect a shake
+SHAKE_DURATION = 1.0  # Time window to detect shakes
+SHAKE_MIN_SAMPLES = 50  # Samples needed in the window
+LAST_RESCUE_TIME = 1.0  # Minimum time between rescue commands
 
 
 class OSCServerReworked:
 
-    def __init__(self, gamepad_controller: GamepadController, is_collab: bool):
+    def __init__(self, gamepad_controller: GamepadController, is_collab: bool, receiver: str = 'oscpy'):
         self.gc = gamepad_controller
 
-        self.osc = OSCThreadServer(default_handler=self.dump)
-        self.sock = self.osc.listen(address='0.0.0.0', port=8001,
-                                    default=True)
+        # Filters, created before the callbacks are bound
+        self.shake_detector = ShakeDetector(DERIVATIVE_THRESHOLD, SHAKE_DURATION, SHAKE_MIN_SAMPLES, LAST_RESCUE_TIME)
+        self.roll_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
+        self.pitch_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
+        self.yaw_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
+
+        if receiver == 'frames':
+            # Bundles grouped in sensor frames, stamped with the timetags of the phone
+            self.osc = OSCFrameServer(port=8001)
+            self.sock = self.osc.sock
+        elif receiver == 'fastpath':
+            # Float addresses decoded in place, the rest by oscpy
+            self.osc = FastPathServer(port=8001)
+            self.sock = self.osc.sock
+        else:
+            self.osc = OSCThreadServer(default_handler=self.dump)
+            self.sock = self.osc.listen(address='0.0.0.0', port=8001,
+                                        default=True)
 
         if is_collab:
             self.bind_callbacks_collab()
@@ -26,10 +54,6 @@ class OSCServerReworked:
         self.is_left_double_tap = False
         self.actionned = False
 
-        self.last_rescue_time = 0
-        self.previous_y_accel = None
-        self.accel_buffer = []
-
         print("OSC Server started")
 
     def bind_callbacks_collab(self):
@@ -54,9 +78,10 @@ class OSCServerReworked:
             )
         ))"""
 
-    def callback_roll_right_left(self, *values):
+    def callback_roll_right_left(self, *values, stamp=None):
         # Used in  collab to turn right or left
-        roll = values[0]
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        roll = self.roll_filter.update(stamp / 1e9, values[0])
 
         # Angle at which the steer is at its maximum
         max_angle = 30
@@ -67,24 +92,26 @@ class OSCServerReworked:
         # Map the roll value to -1,1
         roll = roll / max_angle
 
-        self.gc.steer(-roll)
+        self.gc.steer(-roll, stamp=stamp, source="osc")
 
-    def callback_pitch_acc(self, *values):
+    def callback_pitch_acc(self, *values, stamp=None):
         # Used in collab to accelerate
-        pitch = values[0]
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        pitch = self.pitch_filter.update(stamp / 1e9, values[0])
 
         # If angle is less than a value, we accelerate
 
         Accel_angle = -10
 
         if pitch < Accel_angle:
-            self.gc.send_command("P_UP")
+            self.gc.send_command("P_UP", stamp=stamp, source="osc")
         else:
-            self.gc.send_command("R_UP")
+            self.gc.send_command("R_UP", stamp=stamp, source="osc")
 
-    def callback_yaw_right_left(self, *values):
+    def callback_yaw_right_left(self, *values, stamp=None):
         # Used in perf to turn right or left
-        yaw = values[0]
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        yaw = self.yaw_filter.update(stamp / 1e9, values[0])
 
         # Angle at which the steer is at its maximum
         max_angle = 20
@@ -95,9 +122,9 @@ class OSCServerReworked:
         # Map the yaw value to -1,1
         yaw = - yaw / max_angle
 
-        self.gc.steer(yaw)
+        self.gc.steer(yaw, stamp=stamp, source="osc")
 
-    def callback_x_touchpad(self, *values):
+    def callback_x_touchpad(self, *values, stamp=None):
         # Used in perf to : Fire, Skid, Nitro and rescue
         # We can only get a single point on the touchPad
         # On the right of the screen :
@@ -110,6 +137,8 @@ class OSCServerReworked:
         if self.actionned:
             return
 
+        stamp = time.monotonic_ns() if stamp is None else stamp
+
         time_to_double_tap_right = 0.2
         time_to_double_tap_left = 0.2
 
@@ -125,7 +154,7 @@ class OSCServerReworked:
                     # We double tapped
                     # print("Double tap right")
                     self.actionned = True
-                    self.gc.send_command("P_SKIDDING")
+                    self.gc.send_command("P_SKIDDING", stamp=stamp, source="osc")
 
                 else:
                     # We pressed right, we have to wait until we are sure it's not a double tap
@@ -138,7 +167,7 @@ class OSCServerReworked:
                     # print("Simple Tap right")
                     # We have simple pressed and hold right, we trigger the nitro
                     self.actionned = True
-                    self.gc.send_command("P_NITRO")
+                    self.gc.send_command("P_NITRO", stamp=stamp, source="osc")
 
             self.is_right_pressed = True
 
@@ -152,7 +181,7 @@ class OSCServerReworked:
                     # We double tapped so we look back
                     # print("Double tap left")
                     self.actionned = True
-                    self.gc.send_command("P_LOOKBACK")
+                    self.gc.send_command("P_LOOKBACK", stamp=stamp, source="osc")
 
                 else:
                     # We pressed left, we have to wait until we are sure it's not a double tap
@@ -165,11 +194,11 @@ class OSCServerReworked:
                     # print("Simple Tap left")
                     # We have simple pressed right so we fire
                     self.actionned = True
-                    self.gc.send_instant_command("FIRE")
+                    self.gc.send_instant_command("FIRE", stamp=stamp, source="osc")
 
             self.is_left_pressed = True
 
-    def callback_touchup(self, *values):
+    def callback_touchup(self, *values, stamp=None):
         # Release every button when we release the touchpad
         self.gc.send_command("R_SKIDDING", True)
         self.gc.send_command("R_NITRO", True)
@@ -178,42 +207,12 @@ class OSCServerReworked:
         self.is_right_pressed = False
         self.is_left_pressed = False
 
-    def callback_acceleration_shaker_rescue(self, *values):
+    def callback_acceleration_shaker_rescue(self, *values, stamp=None):
         """Handle acceleration from the smartphone to detect shakes and send rescue command."""
-        DERIVATIVE_THRESHOLD = 3  # The amount of acceleration change required to detect a shake
-        SHAKE_DURATION = 1.0  # Time window to detect shakes
-
-        LAST_RESCUE_TIME = 1.0  # Minimum time between rescue commands
-
-        y_accel = values[0]
-
-        if self.previous_y_accel is not None:
-            # Calculate the change (derivative) in acceleration
-            accel_derivative = abs(y_accel - self.previous_y_accel)
-        else:
-            accel_derivative = 0.0
-
-        self.previous_y_accel = y_accel
-
-        current_time = time.time()
-
-        # Add current derivative and timestamp to the buffer
-        self.accel_buffer.append((current_time, accel_derivative))
-
-        # Remove old values beyond the shake duration
-        self.accel_buffer = [(t, d) for t, d in self.accel_buffer if t >= current_time - SHAKE_DURATION]
-
-        # print("Accel : ",str(len(self.accel_buffer))," ",str([round(a,3) for _, a in self.accel_buffer]))
-        # Check for consistent shaking (mean value above the threshold)
-
-        mean_derivative = sum(a for _, a in self.accel_buffer) / len(self.accel_buffer)
-
-        if len(self.accel_buffer) >= 50 and mean_derivative > DERIVATIVE_THRESHOLD:
-            # Check if last rescue command was sent more than LAST_RESCUE_TIME
-            if current_time - self.last_rescue_time > LAST_RESCUE_TIME:
-                self.last_rescue_time = current_time
-                print("Shake detected!")
-                self.gc.send_instant_command("RESCUE")
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        if self.shake_detector.update(stamp / 1e9, values[0]):
+            print("Shake detected!")
+            self.gc.send_instant_command("RESCUE", stamp=stamp, source="osc")
 
     def stop(self):
         self.osc.close()
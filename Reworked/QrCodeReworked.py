@@ -1,7 +1,9 @@
-import threading
+import time
 import cv2
 
 from Reworked import GamepadController
+from frame_preview import PreviewProcess, PREVIEW_MODES
+from timer_service import default_service
 
 
 class QRDetectorReworked:
@@ -19,7 +21,10 @@ class QRDetectorReworked:
         - "LOOKBACK" : Active le regard en arrière
     """
 
-    def __init__(self, gamepad_controller : GamepadController):
+    def __init__(self, gamepad_controller : GamepadController, preview='window'):
+        """preview: 'window' (annotated in the loop), 'process' (frame_preview.PreviewProcess) or None (headless)"""
+        if preview not in PREVIEW_MODES:
+            raise ValueError("Unknown preview mode " + str(preview))
 
         self.camera_id = 0
         self.delay = 1
@@ -31,6 +36,7 @@ class QRDetectorReworked:
         self.cap = cv2.VideoCapture(self.camera_id)
 
         self.release_delay = 0.5
+        self.timers = default_service()
 
         self.is_nitroing = False
         self.frame_since_nitro = 0
@@ -47,6 +53,14 @@ class QRDetectorReworked:
         self.has_fired = False
         self.has_rescued = False
 
+        # Monotonic time (ns) at which the frame being processed was read, used to stamp the commands
+        self.frame_stamp = None
+
+        self.preview = preview
+        self.preview_process = None
+        self.shapes = None  # QR codes of the frame for the preview process, None when no preview is due
+        self.running = False
+
     def recognize_qr_code(self, frame):
 
         view_nitro = False
@@ -80,7 +94,10 @@ class QRDetectorReworked:
                     color = (0, 255, 0)
                 else:
                     color = (0, 0, 255)
-                frame = cv2.polylines(frame, [p.astype(int)], True, color, 8)
+                if self.preview == 'window':
+                    frame = cv2.polylines(frame, [p.astype(int)], True, color, 8)
+                elif self.shapes is not None:
+                    self.shapes.append((p.astype(int), color))
 
         # Handle the commands
         self.handle_nitro(view_nitro)
@@ -95,7 +112,7 @@ class QRDetectorReworked:
 
             # If the nitro is not already activated we send the command to the server
             if not self.is_nitroing:
-                self.gc.send_command("P_NITRO")
+                self.gc.send_command("P_NITRO", stamp=self.frame_stamp, source="qr")
                 self.is_nitroing = True
 
         # If the QR wasn't seen this frame, we increase the nitro counter
@@ -105,7 +122,7 @@ class QRDetectorReworked:
         # stop the nitro
         if self.frame_since_nitro >= self.max_frame_without_turbo:
             if self.is_nitroing:
-                self.gc.send_command("R_NITRO")
+                self.gc.send_command("R_NITRO", stamp=self.frame_stamp, source="qr")
             self.is_nitroing = False
 
     def handle_skidding(self, view_skidding):
@@ -116,7 +133,7 @@ class QRDetectorReworked:
 
             # If the skidding is not already activated we send the command to the server
             if not self.is_skidding:
-                self.gc.send_command("P_SKIDDING")
+                self.gc.send_command("P_SKIDDING", stamp=self.frame_stamp, source="qr")
                 self.is_skidding = True
 
         # If the QR wasn't seen this frame, we increase the skidding counter
@@ -126,7 +143,7 @@ class QRDetectorReworked:
         # to stop the skidding
         if self.frame_since_skidding >= self.max_frame_without_skidding:
             if self.is_skidding:
-                self.gc.send_command("R_SKIDDING")
+                self.gc.send_command("R_SKIDDING", stamp=self.frame_stamp, source="qr")
             self.is_skidding = False
 
     def handle_lookback(self, view_lookback):
@@ -137,7 +154,7 @@ class QRDetectorReworked:
 
             # If the lookback is not already activated we send the command to the server
             if not self.is_lookbacking:
-                self.gc.send_command("P_LOOKBACK")
+                self.gc.send_command("P_LOOKBACK", stamp=self.frame_stamp, source="qr")
                 self.is_lookbacking = True
 
         # If the QR wasn't seen this frame, we increase the lookback counter
@@ -147,21 +164,19 @@ class QRDetectorReworked:
         # to stop the lookback
         if self.frame_since_lookback >= self.max_frame_without_lookback:
             if self.is_lookbacking:
-                self.gc.send_command("R_LOOKBACK")
+                self.gc.send_command("R_LOOKBACK", stamp=self.frame_stamp, source="qr")
             self.is_lookbacking = False
 
     def send_instant_commande(self, command):
         if command == "P_RESCUE":
-            self.gc.send_instant_command("RESCUE")
+            self.gc.send_instant_command("RESCUE", stamp=self.frame_stamp, source="qr")
             # Programme un envoie de la commande R_RESCUE dans 2 secondes
-            timer = threading.Timer(self.release_delay, self.send_instant_commande, ["R_RESCUE"])
-            timer.start()
+            self.timers.schedule(self.release_delay, self.send_instant_commande, "R_RESCUE")
 
         elif command == "P_FIRE":
-            self.gc.send_instant_command("FIRE")
+            self.gc.send_instant_command("FIRE", stamp=self.frame_stamp, source="qr")
             # Programme un envoie de la commande R_FIRE dans 2 secondes
-            timer = threading.Timer(self.release_delay, self.send_instant_commande, ["R_FIRE"])
-            timer.start()
+            self.timers.schedule(self.release_delay, self.send_instant_commande, "R_FIRE")
 
         elif command == "R_RESCUE":
             self.has_rescued = False
@@ -170,17 +185,41 @@ class QRDetectorReworked:
             self.has_fired = False
 
     def run(self):
-        while True:
-            ret, frame = self.cap.read()
-
-            if ret:
-                self.recognize_qr_code(frame)
-                cv2.imshow(self.window_name, frame)
-
-            if cv2.waitKey(self.delay) & 0xFF == ord('q'):
-                break
-
-        cv2.destroyWindow(self.window_name)
+        self.running = True
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                self.frame_stamp = time.monotonic_ns()
+
+                if ret:
+                    if self.preview == 'process' and self.preview_process is None:
+                        self.preview_process = PreviewProcess(self.window_name, frame.shape).start()
+                    preview_due = self.preview_process is not None and self.preview_process.due()
+                    self.shapes = [] if preview_due else None
+                    self.recognize_qr_code(frame)
+                    if self.preview == 'window':
+                        cv2.imshow(self.window_name, frame)
+                    elif preview_due:
+                        self.preview_process.publish(frame, self.shapes)
+                elif self.preview != 'window':
+                    # No frame: wait as waitKey does for the window instead of spinning on read()
+                    time.sleep(self.delay / 1000)
+
+                if self.preview == 'window':
+                    if cv2.waitKey(self.delay) & 0xFF == ord('q'):
+                        break
+                elif self.preview_process is not None and self.preview_process.quit_requested():
+                    break
+        finally:
+            if self.preview == 'window':
+                cv2.destroyWindow(self.window_name)
+            elif self.preview_process is not None:
+                self.preview_process.close()
+                self.preview_process = None
+
+    def stop(self):
+        """Stop run from another thread, for the headless runs."""
+        self.running = False
 
 
 
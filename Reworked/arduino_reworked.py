@@ -21,50 +21,51 @@ class ArduinoReworked:
 
         self.pedal_threshold = 3  # TODO Change this
 
-    def process_pedal_data(self, is_accel_pressed, is_brake_pressed):
+    def process_pedal_data(self, is_accel_pressed, is_brake_pressed, stamp=None):
         # If both pedal are pressed, we skid
+        # stamp is the monotonic time (ns) at which the serial line was read
 
         if is_accel_pressed and is_brake_pressed and self.current_state != PedalState.SKID:
             if self.current_state == PedalState.BRAKE:
-                self.gc.send_command("R_DOWN")
+                self.gc.send_command("R_DOWN", stamp=stamp, source="arduino")
 
             self.current_state = PedalState.SKID
 
-            self.gc.send_command("P_SKIDDING")
+            self.gc.send_command("P_SKIDDING", stamp=stamp, source="arduino")
 
         elif is_accel_pressed and not is_brake_pressed and self.current_state != PedalState.ACCEL:
-            self.release_state()
+            self.release_state(stamp)
             self.current_state = PedalState.ACCEL
             # print("Accelerate")
-            self.gc.send_command("P_UP")
+            self.gc.send_command("P_UP", stamp=stamp, source="arduino")
 
         elif not is_accel_pressed and is_brake_pressed and self.current_state != PedalState.BRAKE:
-            self.release_state()
+            self.release_state(stamp)
             self.current_state = PedalState.BRAKE
             # print("Brake")
-            self.gc.send_command("P_DOWN")
+            self.gc.send_command("P_DOWN", stamp=stamp, source="arduino")
 
         elif not is_accel_pressed and not is_brake_pressed and self.current_state != PedalState.NEUTRAL:
             if self.current_state == PedalState.ACCEL:
-                self.gc.send_command("R_UP")
+                self.gc.send_command("R_UP", stamp=stamp, source="arduino")
                 self.current_state = PedalState.NEUTRAL
             elif self.current_state == PedalState.BRAKE:
-                self.gc.send_command("R_DOWN")
+                self.gc.send_command("R_DOWN", stamp=stamp, source="arduino")
                 self.current_state = PedalState.NEUTRAL
             elif self.current_state == PedalState.SKID:
-                self.gc.send_command("R_SKIDDING")
-                self.gc.send_command("R_UP")
+                self.gc.send_command("R_SKIDDING", stamp=stamp, source="arduino")
+                self.gc.send_command("R_UP", stamp=stamp, source="arduino")
                 self.current_state = PedalState.NEUTRAL
             print("Neutral")
 
-    def release_state(self):
+    def release_state(self, stamp=None):
 
         if self.current_state == PedalState.ACCEL:
-            self.gc.send_command("R_UP")
+            self.gc.send_command("R_UP", stamp=stamp, source="arduino")
         elif self.current_state == PedalState.BRAKE:
-            self.gc.send_command("R_DOWN")
+            self.gc.send_command("R_DOWN", stamp=stamp, source="arduino")
         elif self.current_state == PedalState.SKID:
-            self.gc.send_command("R_SKIDDING")
+            self.gc.send_command("R_SKIDDING", stamp=stamp, source="arduino")
 
     def read_ultrasound_data(self, port, baud_rate=9600):
 
@@ -79,6 +80,7 @@ class ArduinoReworked:
                     # Lecture des données envoyées par l'Arduino
                     if ser.in_waiting > 0:
                         line = ser.readline().decode('utf-8').strip()
+                        stamp = time.monotonic_ns()
                         if '#' in line:
                             # Séparer les données des deux capteurs
                             accel_data, brake_data = line.split('#')
@@ -90,7 +92,7 @@ class ArduinoReworked:
                             is_accel_pressed = int(accel_data) < self.pedal_threshold
                             is_brake_pressed = int(brake_data) < self.pedal_threshold
 
-                            self.process_pedal_data(is_accel_pressed, is_brake_pressed)
+                            self.process_pedal_data(is_accel_pressed, is_brake_pressed, stamp)
 
                     time.sleep(0.1)
 
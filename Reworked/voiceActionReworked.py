@@ -31,20 +31,21 @@ class VoiceActionReworked:
         """Callback function for audio stream"""
         if status:
             print(f"Audio stream error: {status}", file=sys.stderr)
-        self.audio_queue.put(bytes(indata))
+        # Keep the time at which the block was captured to stamp the commands it triggers
+        self.audio_queue.put((time.monotonic_ns(), bytes(indata)))
 
     def process_audio(self):
         """Process audio data from the queue"""
         try:
-            data = self.audio_queue.get(timeout=1)
+            stamp, data = self.audio_queue.get(timeout=1)
             if self.recognizer.AcceptWaveform(data):
                 result = json.loads(self.recognizer.Result())
                 if 'text' in result and result['text']:
-                    self.check_for_target_word(result['text'], is_partial=False)
+                    self.check_for_target_word(result['text'], is_partial=False, stamp=stamp)
             else:
                 partial = json.loads(self.recognizer.PartialResult())
                 if 'partial' in partial and partial['partial']:
-                    self.check_for_target_word(partial['partial'], is_partial=True)
+                    self.check_for_target_word(partial['partial'], is_partial=True, stamp=stamp)
         except queue.Empty:
             pass
         except json.JSONDecodeError:
@@ -52,7 +53,7 @@ class VoiceActionReworked:
         except Exception as e:
             print(f"Error processing audio: {str(e)}", file=sys.stderr)
 
-    def check_for_target_word(self, text, is_partial):
+    def check_for_target_word(self, text, is_partial, stamp=None):
         """Check if target word is in the recognized text"""
         current_time = time.time()
         if self.target_word in text.lower():
@@ -62,13 +63,13 @@ class VoiceActionReworked:
                 print(f"Recognized text: {text}")
 
                 # Send command to server immediately
-                self.send_fire_command()
+                self.send_fire_command(stamp)
                 self.last_detection_time = current_time
 
-    def send_fire_command(self):
+    def send_fire_command(self, stamp=None):
         """Send the 'FIRE' command to the server"""
         try:
-            self.gc.send_instant_command("FIRE")
+            self.gc.send_instant_command("FIRE", stamp=stamp, source="voice")
         except Exception as e:
             print(f"Failed to send command: {str(e)}", file=sys.stderr)
 
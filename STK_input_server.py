@@ -4,10 +4,19 @@
 ###############################################################################
 ## Global libs
 import sys
+import time
 import socket
-import keyboard
+import selectors
 import threading
 
+import stk_protocol
+from key_state import KeyStateTable
+from latency_metrics import MetricsRegistry, MetricsServer
+from command_log import CommandLogWriter
+from output_backends import KeyboardBackend, create_backend
+from rate_limit import CommandScheduler
+from command_bus import BusSender, CommandBus
+
 ###############################################################################
 ## Global vars
 GREEN       = '\033[92m'
@@ -16,7 +25,6 @@ BLUE        = '\033[94m'
 YELLOW      = '\033[93m'
 RED         = '\033[91m'
 
-stop        = False
 DEBUG       = True
 
 address1    = ('0.0.0.0', 6006) # Port used for OSC Controller
@@ -25,111 +33,492 @@ address3    = ('0.0.0.0', 6008) # Port used by the Voice Action
 address4    = ('0.0.0.0', 6009) # Port used by arduino
 address5    = ('0.0.0.0', 60010) # Port used by Face Tracking
 
+addresses   = [address1, address2, address3, address4, address5]
+
+# Source id of the producer behind each address, used for the legacy text commands
+sources     = [stk_protocol.SOURCE_OSC, stk_protocol.SOURCE_QR, stk_protocol.SOURCE_VOICE,
+               stk_protocol.SOURCE_ARDUINO, stk_protocol.SOURCE_FACE]
 
-sock1       = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock1.bind(address1)
-
-sock2       = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock2.bind(address2)
-
-sock3       = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock3.bind(address3)
-
-sock4       = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock4.bind(address4)
-
-sock5       = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock5.bind(address5)
-
-#list of tuples: (received command, keyboard key, keyboard func )
-bindings    = [ ['UP', 'up', keyboard.press_and_release],
-                ['DOWN', 'down', keyboard.press_and_release],
-                ['LEFT', 'left', keyboard.press_and_release],
-                ['RIGHT', 'right', keyboard.press_and_release],
-                ['SELECT', 'enter', keyboard.press_and_release],
-                ['CANCEL', 'backspace', keyboard.press_and_release],
-                ['BACK', 'backspace', keyboard.press_and_release],
-                ['FIRE', 'space', keyboard.press_and_release],
-                ['P_FIRE', 'space', keyboard.press],
-                ['R_FIRE', 'space', keyboard.release],
-                ['NITRO', 'n', keyboard.press_and_release],
-                ['P_NITRO', 'n', keyboard.press],
-                ['R_NITRO', 'n', keyboard.release],
-                ['P_SKIDDING', 'v', keyboard.press],
-                ['R_SKIDDING', 'v', keyboard.release],
-                ['P_LOOKBACK', 'b', keyboard.press],
-                ['R_LOOKBACK', 'b', keyboard.release],
-                ['RESCUE', 'backspace', keyboard.press_and_release],
-                ['P_RESCUE', 'backspace', keyboard.press],
-                ['R_RESCUE', 'backspace', keyboard.release],
-                ['PAUSE', 'escape', keyboard.press_and_release],
-                ['P_UP', 'up', keyboard.press],
-                ['R_UP', 'up', keyboard.release],
-                ['P_DOWN', 'down', keyboard.press],
-                ['R_DOWN', 'down', keyboard.release],
-                ['P_LEFT', 'left', keyboard.press],
-                ['R_LEFT', 'left', keyboard.release],
-                ['P_RIGHT', 'right', keyboard.press],
-                ['R_RIGHT', 'right', keyboard.release],
-                ['P_ACCELERATE', 'up', keyboard.press],
-                ['R_ACCELERATE', 'up', keyboard.release],
-                ['P_BRAKE', 'down', keyboard.press],
-                ['R_BRAKE', 'down', keyboard.release],
+RCVBUF_SIZE = 1 << 20   # SO_RCVBUF asked for each socket (bytes), 0 keeps the OS default
+RECV_BATCH  = 64        # Max datagrams read from one socket per wakeup
+POLL_TIMEOUT = 0.5      # Seconds between two checks of the stop flag when idle
+FLUSH_WINDOW = 0.002    # Seconds during which the changes buffered by the output backend are batched
+RATE_LIMIT  = 400       # Commands per second allowed for each source (0 to disable the rate limiting)
+RATE_BURST  = 100       # Commands a source can send at once above its rate
+METRICS_PORT = 9108     # Local HTTP port of the metrics (0 to disable)
+
+#list of tuples: (received command, keyboard key)
+#P_ commands press the key, R_ commands release it and the others press and release it
+bindings    = [ ['UP', 'up'],
+                ['DOWN', 'down'],
+                ['LEFT', 'left'],
+                ['RIGHT', 'right'],
+                ['SELECT', 'enter'],
+                ['CANCEL', 'backspace'],
+                ['BACK', 'backspace'],
+                ['FIRE', 'space'],
+                ['P_FIRE', 'space'],
+                ['R_FIRE', 'space'],
+                ['NITRO', 'n'],
+                ['P_NITRO', 'n'],
+                ['R_NITRO', 'n'],
+                ['P_SKIDDING', 'v'],
+                ['R_SKIDDING', 'v'],
+                ['P_LOOKBACK', 'b'],
+                ['R_LOOKBACK', 'b'],
+                ['RESCUE', 'backspace'],
+                ['P_RESCUE', 'backspace'],
+                ['R_RESCUE', 'backspace'],
+                ['PAUSE', 'escape'],
+                ['P_UP', 'up'],
+                ['R_UP', 'up'],
+                ['P_DOWN', 'down'],
+                ['R_DOWN', 'down'],
+                ['P_LEFT', 'left'],
+                ['R_LEFT', 'left'],
+                ['P_RIGHT', 'right'],
+                ['R_RIGHT', 'right'],
+                ['P_ACCELERATE', 'up'],
+                ['R_ACCELERATE', 'up'],
+                ['P_BRAKE', 'down'],
+                ['R_BRAKE', 'down'],
                 ]
 
 commands = [b[0] for b in bindings]
 
+
+def build_dispatch_table():
+    """Binding of every (opcode, flags) pair, indexed by opcode << 2 | flags (None for unbound pairs)."""
+    table = [None] * (len(stk_protocol.ACTIONS) << 2)
+    for b in bindings:
+        opcode, flags = stk_protocol.parse_command(b[0])
+        table[opcode << 2 | flags] = b
+    return table
+
+
+dispatch_table = build_dispatch_table()
+# OS key of every (opcode, flags) pair, for the scheduler to keep the order of the commands of a key
+key_table = [b[1] if b is not None else None for b in dispatch_table]
+legacy_commands = stk_protocol.legacy_table()
+
+
 ###############################################################################
-## Main
-def handle_socket(sock):
-    global stop
-    while not stop:
-        data, addr = sock.recvfrom(1024)
-        if type(data) is bytes:
-            data = data.decode("utf-8").replace(',', '')
-
-        if data == 'STOPSERVEUR':
-            stop = True
+## Server
+class STKInputServer:
+    """
+    Receives the commands of every producer (OSC, QR code, voice, arduino, face tracking) on one UDP socket per
+    producer and turns them into key events of an output backend (keyboard by default, see output_backends). Both the
+    binary frames of stk_protocol and the legacy text commands are accepted, and both are dispatched through the same
+    precomputed table.
+
+    A key driven by several producers is reference counted (see key_state): only the first press and the last release
+    reach the OS. The backends that buffer their changes (virtual gamepad) are flushed once per flush window, so
+    all the commands received during the window are applied as one batch.
+
+    With a CommandScheduler (see rate_limit), each source has a token bucket and the commands of a wakeup are
+    dispatched by priority class: the releases of the pedals and of the steering go first, and a flooding source gets
+    its presses and taps shed instead of delaying the others.
+
+    When a MetricsRegistry is given, the server counts the datagrams of each source and records the latency between
+    the capture stamp of each binary command and its key event. When a CommandLogWriter is given, every datagram is
+    recorded with its arrival time and port before being handled (see command_log for the replay).
+
+    By default a single selector loop serves all the sockets: each wakeup drains up to `recv_batch` datagrams per
+    readable socket, so a busy producer can't starve the others. The legacy mode (one blocking thread per socket) is
+    still available with `serve_threaded`.
+
+    With a CommandBus (see command_bus), the producers running in the same process publish their records directly to
+    the server, which consumes them in the same loop as the UDP sockets (see start_in_process).
+    """
+
+    def __init__(self, _addresses=None, rcvbuf_size=RCVBUF_SIZE, recv_batch=RECV_BATCH, _sources=None,
+                 key_backend=None, metrics=None, recorder=None, flush_window=FLUSH_WINDOW, scheduler=None, bus=None):
+        self.addresses = addresses if _addresses is None else _addresses
+        self.sources = sources if _sources is None else _sources
+        self.recv_batch = recv_batch
+        self.stop_event = threading.Event()
+        self.backend = KeyboardBackend() if key_backend is None else key_backend
+        self.key_states = KeyStateTable(self.backend)
+        self.flush_window = flush_window
+        self.scheduler = scheduler
+        self.bus = bus
+        self.metrics = metrics
+        self.recorder = recorder
+        self.invalid = 0  # Records with an unknown opcode or unknown flags, dropped
+
+        self.sockets = []
+        for address in self.addresses:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if rcvbuf_size:
+                # Bigger kernel buffer so that bursts are queued instead of dropped
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf_size)
+            try:
+                sock.bind(address)
+            except OSError:
+                # Port already bound, by another server most likely
+                sock.close()
+                for bound in self.sockets:
+                    bound.close()
+                raise
+            self.sockets.append(sock)
+
+        if self.metrics is not None:
+            self.metrics.watch_udp_ports(sock.getsockname()[1] for sock in self.sockets)
+            self.metrics.add_collector(self.collect_key_stats)
+            if self.scheduler is not None:
+                self.metrics.add_collector(self.collect_scheduler_stats)
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.key_states.release_all()
+        self.backend.flush()
+        self.backend.close()
+        for sock in self.sockets:
+            sock.close()
+        if self.bus is not None:
+            self.bus.close()
+
+    def print_key_stats(self):
+        for key, counters in sorted(self.key_states.stats().items()):
+            print(BLUE + '\t' + key + WHITE + ' ' + ', '.join(name + '=' + str(value)
+                                                             for name, value in counters.items()))
+        if self.invalid:
+            print(BLUE + '\tinvalid' + WHITE + ' ' + str(self.invalid))
+        if self.scheduler is not None:
+            for source, counters in sorted(self.scheduler.stats().items()):
+                print(BLUE + '\t' + stk_protocol.SOURCE_NAMES.get(source, 'unknown') + WHITE + ' '
+                      + ', '.join(name + '=' + str(value) for name, value in counters.items()))
+
+    def collect_key_stats(self):
+        lines = ['# HELP stk_key_events_total Commands received and forwarded to the OS per key.',
+                 '# TYPE stk_key_events_total counter']
+        for key, counters in sorted(self.key_states.stats().items()):
+            for name, value in counters.items():
+                lines.append('stk_key_events_total{key="' + key + '",event="' + name + '"} ' + str(value))
+        lines += ['# HELP stk_invalid_commands_total Records with an unknown opcode or unknown flags, dropped.',
+                  '# TYPE stk_invalid_commands_total counter',
+                  'stk_invalid_commands_total ' + str(self.invalid)]
+        return lines
+
+    def collect_scheduler_stats(self):
+        lines = ['# HELP stk_scheduler_commands_total Commands accepted, over the rate limit and shed per source.',
+                 '# TYPE stk_scheduler_commands_total counter']
+        for source, counters in sorted(self.scheduler.stats().items()):
+            for name, value in counters.items():
+                lines.append('stk_scheduler_commands_total{source="' + stk_protocol.SOURCE_NAMES.get(source, 'unknown')
+                             + '",state="' + name + '"} ' + str(value))
+        return lines
+
+    def source_of(self, sock):
+        try:
+            return self.sources[self.sockets.index(sock)]
+        except (ValueError, IndexError):
+            return stk_protocol.SOURCE_UNKNOWN
+
+    def handle_data(self, data, source=stk_protocol.SOURCE_UNKNOWN):
+        """Apply a datagram, source being the producer of the port it was received on."""
+        if data and data[0] == stk_protocol.MAGIC:
+            try:
+                declared, sequence, records = stk_protocol.decode(data)
+            except ValueError as e:
+                if DEBUG: print(RED + '\t' + str(e) + WHITE)
+                return
+            # The port decides the source, so that a producer can't pick the token bucket of another one: the source
+            # declared by the frame is only used when the port is not known
+            if source == stk_protocol.SOURCE_UNKNOWN:
+                source = declared
+            elif declared != source:
+                if DEBUG: print(RED + '\tFrame of source ' + str(declared) + ' received on the port of '
+                                + stk_protocol.SOURCE_NAMES.get(source, 'unknown') + WHITE)
+            self.handle_records(source, records)
+            return
+
+        if self.metrics is not None:
+            self.metrics.count_packet(stk_protocol.SOURCE_NAMES.get(source, 'unknown'))
+
+        # Legacy text command
+        if b',' in data:
+            data = data.replace(b',', b'')
+
+        if data == b'STOPSERVEUR':
+            self.stop()
         else:
-            if data in commands:
-                if DEBUG: print(YELLOW + '\t' + data + WHITE)
-                b = bindings[commands.index(data)]
-                b[2](b[1])
+            command = legacy_commands.get(data)
+            if command is not None:
+                self.submit(command[0], command[1], source)
             else:
-                if DEBUG: print(RED + '\t' + data + WHITE + ' (Unknown)')
+                if DEBUG: print(RED + '\t' + data.decode("utf-8", "replace") + WHITE + ' (Unknown)')
+
+    def handle_records(self, source, records):
+        """Apply the (opcode, flags, stamp_ns) records of a frame or of a bus publication."""
+        if self.metrics is not None:
+            self.metrics.count_packet(stk_protocol.SOURCE_NAMES.get(source, 'unknown'))
+        for opcode, flags, stamp in records:
+            self.submit(opcode, flags, source, stamp)
+
+    def drain_bus(self):
+        """Apply everything the local producers published on the bus."""
+        for source, records in self.bus.drain():
+            if self.recorder is not None:
+                self.recorder.write(self.port_of(source), stk_protocol.encode(records, source, 0))
+            self.handle_records(source, records)
+            if self.stopped:
+                return
+
+    def port_of(self, source):
+        """UDP port of a source, used to record the bus publications as if they came from the network."""
+        try:
+            return self.sockets[self.sources.index(source)].getsockname()[1]
+        except (ValueError, IndexError):
+            return 0
+
+    def submit(self, opcode, flags, source, stamp=0):
+        """Dispatch a command now, or queue it in the scheduler until the end of the wakeup."""
+        if not stk_protocol.is_valid(opcode, flags):
+            # Unknown flags would index the slot of another opcode in the dispatch table
+            self.invalid += 1
+            if DEBUG: print(RED + '\t' + stk_protocol.command_name(opcode, flags) + WHITE + ' (Invalid)')
+        elif self.scheduler is None:
+            self.dispatch(opcode, flags, source, stamp)
+        elif not self.scheduler.submit(opcode, flags, source, stamp):
+            if DEBUG: print(RED + '\t' + stk_protocol.command_name(opcode, flags) + WHITE + ' (Shed)')
+
+    def run_scheduled(self):
+        """Dispatch the commands queued in the scheduler, by priority."""
+        if self.scheduler is not None:
+            for command in self.scheduler.drain():
+                self.dispatch(*command)
+
+    def dispatch(self, opcode, flags, source, stamp=0):
+        """Apply a command checked by stk_protocol.is_valid."""
+        b = dispatch_table[opcode << 2 | flags]
+        if b is None:
+            if DEBUG: print(RED + '\t' + stk_protocol.command_name(opcode, flags) + WHITE + ' (Unknown)')
+            return
+        forwarded = self.key_states.apply(b[1], flags, (source, opcode))
+        if stamp and self.metrics is not None:
+            self.metrics.record_latency(stk_protocol.SOURCE_NAMES.get(source, 'unknown'), b[0], stamp)
+        if DEBUG: print(YELLOW + '\t' + b[0] + WHITE + ('' if forwarded else BLUE + ' (no change)' + WHITE))
+
+    def serve_forever(self):
+        """Serve every socket from a single selector loop until STOPSERVEUR is received or stop() is called."""
+        selector = selectors.DefaultSelector()
+        for sock in self.sockets:
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+        bus = self.bus
+        if bus is not None:
+            selector.register(bus.reader, selectors.EVENT_READ)
+
+        flush_deadline = None
+        try:
+            while not self.stopped:
+                timeout = POLL_TIMEOUT
+                if flush_deadline is not None:
+                    timeout = max(0.0, flush_deadline - time.monotonic())
+                if bus is not None and bus.arm():
+                    timeout = 0.0
+
+                for key, _ in selector.select(timeout):
+                    if bus is not None and key.fileobj is bus.reader:
+                        bus.clear_wakeup()
+                    else:
+                        self.drain_socket(key.fileobj)
+                    if self.stopped:
+                        break
+                if bus is not None:
+                    bus.waiting = False
+                    self.drain_bus()
+                self.run_scheduled()
+
+                if self.backend.pending():
+                    now = time.monotonic()
+                    if flush_deadline is None:
+                        flush_deadline = now + self.flush_window
+                    if now >= flush_deadline:
+                        self.backend.flush()
+                        flush_deadline = None
+        finally:
+            selector.close()
+
+    def drain_socket(self, sock):
+        """Read at most recv_batch datagrams waiting on a non blocking socket."""
+        source = self.source_of(sock)
+        port = sock.getsockname()[1]
+        for _ in range(self.recv_batch):
+            try:
+                data = sock.recv(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable on UDP sockets, nothing to read
+                continue
+            if self.recorder is not None:
+                self.recorder.write(port, data)
+            self.handle_data(data, source)
+            if self.stopped:
+                return
+
+    def handle_socket(self, sock):
+        """Legacy loop of the threaded mode: blocking reads with a timeout so that the stop flag is seen."""
+        sock.settimeout(POLL_TIMEOUT)
+        source = self.source_of(sock)
+        port = sock.getsockname()[1]
+        while not self.stopped:
+            try:
+                data, addr = sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except ConnectionResetError:
+                continue
+            if self.recorder is not None:
+                self.recorder.write(port, data)
+            self.handle_data(data, source)
+            self.run_scheduled()
+            if self.backend.pending():
+                self.backend.flush()
+
+    def handle_bus(self):
+        """Loop of the threaded mode consuming the bus."""
+        while not self.stopped:
+            if self.bus.wait(POLL_TIMEOUT):
+                self.drain_bus()
+                self.run_scheduled()
+                if self.backend.pending():
+                    self.backend.flush()
+
+    def serve_threaded(self):
+        """Create one thread per socket (the historical behaviour of the server)."""
+        threads = [threading.Thread(target=self.handle_socket, args=(sock,)) for sock in self.sockets]
+        if self.bus is not None:
+            threads.append(threading.Thread(target=self.handle_bus))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def start_in_process(**kwargs):
+    """
+    Start an STKInputServer in a thread of the current process, for the single host deployments: the producers of the
+    process send their commands with command_bus.BusSender(server.bus, source), without socket, and the UDP ports stay
+    open for the remote ones. kwargs are given to STKInputServer. Stop it with stop_in_process(server).
+    """
+    bus = CommandBus()
+    try:
+        server = STKInputServer(bus=bus, **kwargs)
+    except OSError:
+        bus.close()
+        raise
+    server.thread = threading.Thread(target=server.serve_forever, name='stk-input-server', daemon=True)
+    server.thread.start()
+    return server
+
+
+def stop_in_process(server):
+    server.stop()
+    server.thread.join()
+    server.close()
+
+
+def start_local(*sources, **kwargs):
+    """
+    -local option of the launchers: start_in_process and a BusSender for each of the sources. Only one process can
+    bind the ports of the server: when they are already bound (another launcher runs with -local, or
+    STK_input_server.py runs), return None and no sender, the producers then send their commands over localhost UDP to
+    that server. Returns (server or None, [sender or None per source]).
+    """
+    try:
+        server = start_in_process(**kwargs)
+    except OSError as e:
+        print(RED + 'STK_input_server ports already bound (' + str(e) + '): the commands of this process are sent over'
+              ' UDP to the server running there' + WHITE)
+        return None, [None] * len(sources)
+    return server, [BusSender(server.bus, source) for source in sources]
+
 
 ###############################################################################
 ## Main
-if len(sys.argv) > 1:
-    # Reading command line
-    for i in range(1, len(sys.argv)):
-        if sys.argv[i] == '-d':
-            DEBUG = True
-
-print()
-print('STK input server started ', end='')
-if DEBUG:
-    print(GREEN + '(Debug mode)' + WHITE)
-else:
+if __name__ == '__main__':
+    threaded = False
+    rcvbuf_size = RCVBUF_SIZE
+    recv_batch = RECV_BATCH
+    metrics_port = METRICS_PORT
+    record_path = None
+    backend_name = 'keyboard'
+    flush_window = FLUSH_WINDOW
+    rate_limit = RATE_LIMIT
+    rate_burst = RATE_BURST
+
+    if len(sys.argv) > 1:
+        # Reading command line
+        i = 1
+        while i < len(sys.argv):
+            if sys.argv[i] == '-d':
+                DEBUG = True
+            elif sys.argv[i] == '-t':
+                threaded = True
+            elif sys.argv[i] == '-rcvbuf' and i + 1 < len(sys.argv):
+                i += 1
+                rcvbuf_size = int(sys.argv[i])
+            elif sys.argv[i] == '-batch' and i + 1 < len(sys.argv):
+                i += 1
+                recv_batch = int(sys.argv[i])
+            elif sys.argv[i] == '-metrics' and i + 1 < len(sys.argv):
+                i += 1
+                metrics_port = int(sys.argv[i])
+            elif sys.argv[i] == '-record' and i + 1 < len(sys.argv):
+                i += 1
+                record_path = sys.argv[i]
+            elif sys.argv[i] == '-backend' and i + 1 < len(sys.argv):
+                i += 1
+                backend_name = sys.argv[i]
+            elif sys.argv[i] == '-flush' and i + 1 < len(sys.argv):
+                i += 1
+                flush_window = float(sys.argv[i])
+            elif sys.argv[i] == '-rate' and i + 1 < len(sys.argv):
+                i += 1
+                rate_limit = float(sys.argv[i])
+            elif sys.argv[i] == '-burst' and i + 1 < len(sys.argv):
+                i += 1
+                rate_burst = int(sys.argv[i])
+            i += 1
+
+    metrics = MetricsRegistry() if metrics_port else None
+    recorder = CommandLogWriter(record_path) if record_path else None
+    server = STKInputServer(addresses, rcvbuf_size, recv_batch, key_backend=create_backend(backend_name),
+                            metrics=metrics, recorder=recorder, flush_window=flush_window,
+                            scheduler=CommandScheduler(rate_limit, rate_burst, keys=key_table) if rate_limit else None)
+    metrics_server = MetricsServer(metrics, metrics_port).start() if metrics_port else None
+
     print()
+    print('STK input server started ', end='')
+    if DEBUG:
+        print(GREEN + '(Debug mode)' + WHITE)
+    else:
+        print()
+
+    try:
+        if threaded:
+            server.serve_threaded()
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+    finally:
+        server.close()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if recorder is not None:
+            recorder.close()
+            print(str(recorder.count) + ' datagrams recorded in ' + record_path)
 
-# Create threads to handle each socket
-thread1 = threading.Thread(target=handle_socket, args=(sock1,))
-thread2 = threading.Thread(target=handle_socket, args=(sock2,))
-thread3 = threading.Thread(target=handle_socket, args=(sock3,))
-thread4 = threading.Thread(target=handle_socket, args=(sock4,))
-thread5 = threading.Thread(target=handle_socket, args=(sock5,))
-
-thread1.start()
-thread2.start()
-thread3.start()
-thread4.start()
-thread5.start()
-
-thread1.join()
-thread2.join()
-thread3.join()
-thread4.join()
-thread5.join()
-
-print('STK input server stopped')
+    print('STK input server stopped')
+    if DEBUG:
+        server.print_key_stats()
@@ -1,9 +1,9 @@
-import socket
-
 import serial
 import time
 import enum
 
+from stk_protocol import CommandSender, SOURCE_ARDUINO
+
 
 class PedalState(enum.Enum):
     NEUTRAL = 0
@@ -14,58 +14,60 @@ class PedalState(enum.Enum):
 
 class ArduinoUltrasoundReader:
 
-    def __init__(self, _server_address='localhost', _arduino_port=6009):
+    def __init__(self, _server_address='localhost', _arduino_port=6009, sender=None):
         self.server_address = (_server_address, _arduino_port)
 
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # UDP sender, or command_bus.BusSender when running with the server
+        self.sender = CommandSender(self.server_address, SOURCE_ARDUINO) if sender is None else sender
 
         self.current_state = PedalState.NEUTRAL
 
         self.pedal_threshold = 10  # TODO Change this
 
-    def process_pedal_data(self, is_accel_pressed, is_brake_pressed):
+    def process_pedal_data(self, is_accel_pressed, is_brake_pressed, stamp=None):
         # If both pedal are pressed, we skid
+        # stamp is the monotonic time (ns) at which the serial line was read
 
-        data = b""
+        # Commands sent in a single frame, so that a release and the following press are applied together
+        data = []
 
         if is_accel_pressed and is_brake_pressed and self.current_state != PedalState.SKID:
             if self.current_state == PedalState.BRAKE:
-                data = b'R_DOWN'
-                self.send_data(data)
+                data.append(b'R_DOWN')
 
             self.current_state = PedalState.SKID
             print("Skid")
-            data = b'P_SKIDDING'
+            data.append(b'P_SKIDDING')
 
         elif is_accel_pressed and not is_brake_pressed and self.current_state != PedalState.ACCEL:
-            self.release_state()
+            data.append(self.release_state())
             self.current_state = PedalState.ACCEL
             print("Accelerate")
-            data = b'P_UP'
+            data.append(b'P_UP')
 
         elif not is_accel_pressed and is_brake_pressed and self.current_state != PedalState.BRAKE:
-            self.release_state()
+            data.append(self.release_state())
             self.current_state = PedalState.BRAKE
             print("Brake")
-            data = b'P_DOWN'
+            data.append(b'P_DOWN')
 
         elif not is_accel_pressed and not is_brake_pressed and self.current_state != PedalState.NEUTRAL:
             if self.current_state == PedalState.ACCEL:
-                data = b'R_UP'
+                data.append(b'R_UP')
                 self.current_state = PedalState.NEUTRAL
             elif self.current_state == PedalState.BRAKE:
-                data = b'R_DOWN'
+                data.append(b'R_DOWN')
                 self.current_state = PedalState.NEUTRAL
             elif self.current_state == PedalState.SKID:
-                data = b'R_SKIDDING'
-                self.send_data(data)
-                data = b"R_UP"
+                data.append(b'R_SKIDDING')
+                data.append(b"R_UP")
                 self.current_state = PedalState.NEUTRAL
             print("Neutral")
 
-        self.send_data(data)
+        self.send_data(*data, stamp=stamp)
 
     def release_state(self):
+        """Return the command releasing the current state (empty if nothing is pressed)."""
         data = b""
         if self.current_state == PedalState.ACCEL:
             data = b'R_UP'
@@ -73,11 +75,10 @@ class ArduinoUltrasoundReader:
             data = b'R_DOWN'
         elif self.current_state == PedalState.SKID:
             data = b'R_SKIDDING'
-        self.send_data(data)
+        return data
 
-    def send_data(self, data):
-        if len(data) > 0:
-            self.client_socket.sendto(data, self.server_address)
+    def send_data(self, *data, stamp=None):
+        self.sender.send(*data, stamp=stamp)
 
     def read_ultrasound_data(self, port, baud_rate=9600):
 
@@ -90,6 +91,7 @@ class ArduinoUltrasoundReader:
                     # Lecture des données envoyées par l'Arduino
                     if ser.in_waiting > 0:
                         line = ser.readline().decode('utf-8').strip()
+                        stamp = time.monotonic_ns()
                         if '#' in line:
                             # Séparer les données des deux capteurs
                             accel_data, brake_data = line.split('#')
@@ -101,7 +103,7 @@ class ArduinoUltrasoundReader:
                             is_accel_pressed = int(accel_data) < self.pedal_threshold
                             is_brake_pressed = int(brake_data) < self.pedal_threshold
 
-                            self.process_pedal_data(is_accel_pressed, is_brake_pressed)
+                            self.process_pedal_data(is_accel_pressed, is_brake_pressed, stamp)
 
                     time.sleep(0.1)
 
@@ -0,0 +1,268 @@
+"""
+Offline benchmark of the FaceTracking pipeline, without webcam nor window.
+
+The pipeline runs headless (preview=None) on an injected capture source (camera_capture.CameraCapture):
+    - a video file, read at its own frame rate or at -rate frames per second,
+    - or SyntheticFaces, a cartoon face drawn on every frame that BlazeFace detects: it moves left and right across
+      the LOOKBACK threshold and leans in across the BRAKE distance, so the commands are exercised too. With -players,
+      one face per player is drawn side by side, smaller, for the collaboration mode (face_players).
+The sources deliver the frames at the pace of a camera: the frames the pipeline is too slow to take are dropped by the
+capture slot, as with a real camera.
+
+Each run reports the time of each stage of the loop (capture: age of the frame when taken, preprocess: flip and
+conversions, submit, detect: detect_async to result, pose, command: sending one command, display), the frames
+processed per second, the age of the detection results when used and the latency from the capture of a frame to the
+commands it triggered. The detector runs on the CPU with the bundled blaze_face_short_range.tflite.
+
+Run from the root of the project:
+    python -m benchmarks.bench_face_tracking
+    python -m benchmarks.bench_face_tracking -tracking full roi -detection live video -filter none kalman
+    python -m benchmarks.bench_face_tracking -video session.mp4 -rate 30
+    python -m benchmarks.bench_face_tracking -players 1 2 3
+
+Results are written as JSON (benchmarks/results/ by default) to compare the runs over time.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import threading
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from benchmarks.bench_input_server import git_revision
+from face_tracking import DETECTION_MODES, TRACKING_MODES, FaceTracking
+from head_pose import POSE_FILTERS
+from latency_metrics import LatencyHistogram
+
+FRAMES = 300
+RATE = 30.0  # Frames per second of the synthetic camera
+WIDTH = 640
+HEIGHT = 480
+
+
+def draw_face(frame, center_x, center_y, scale):
+    """Draw a cartoon face detected by BlazeFace, its eyes 56 * scale pixels apart."""
+    center = (int(center_x), int(center_y))
+
+    def at(dx, dy):
+        return int(center_x + dx * scale), int(center_y + dy * scale)
+
+    def size(width, height):
+        return int(width * scale), int(height * scale)
+
+    thickness = max(1, int(4 * scale))
+    cv2.ellipse(frame, center, size(70, 90), 0, 0, 360, (140, 170, 220), -1)  # Skin
+    cv2.ellipse(frame, at(0, -70), size(75, 40), 0, 180, 360, (30, 30, 40), -1)  # Hair
+    for dx in (-28, 28):
+        cv2.ellipse(frame, at(dx, -15), size(14, 7), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(frame, at(dx, -15), int(6 * scale), (40, 30, 20), -1)
+        cv2.line(frame, at(dx - 14, -32), at(dx + 14, -32), (30, 30, 40), thickness)  # Eyebrow
+    cv2.line(frame, at(0, -5), at(-6, 25), (100, 120, 180), max(1, int(3 * scale)))  # Nose
+    cv2.ellipse(frame, at(0, 45), size(25, 10), 0, 0, 180, (60, 60, 160), thickness)  # Mouth
+    return frame
+
+
+class PacedSource:
+    """Capture source delivering the frames of read_frame(index) at rate frames per second, like a camera."""
+
+    def __init__(self, frames, rate, width, height):
+        self.frames = frames
+        self.interval = 1e9 / rate if rate else 0
+        self.width = width
+        self.height = height
+        self.index = 0
+        self.next_time = None
+
+    def read_frame(self, index):
+        raise NotImplementedError
+
+    def read(self):
+        if self.index >= self.frames:
+            return False, None
+        now = time.monotonic_ns()
+        if self.next_time is None:
+            self.next_time = now
+        elif now < self.next_time:
+            time.sleep((self.next_time - now) / 1e9)
+        self.next_time += self.interval
+        frame = self.read_frame(self.index)
+        self.index += 1
+        return frame is not None, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return 0
+
+    def release(self):
+        pass
+
+
+class SyntheticFaces(PacedSource):
+    """Faces moving left and right over 4 s and leaning in and out over 6 s, each one in its own column."""
+
+    def __init__(self, frames=FRAMES, rate=RATE, faces=1, width=WIDTH, height=HEIGHT):
+        super().__init__(frames, rate, width, height)
+        self.faces = faces
+
+    def read_frame(self, index):
+        t = index / 30.0  # The motion doesn't depend on the rate
+        # A new array per frame, as a camera driver does
+        frame = np.empty((self.height, self.width, 3), np.uint8)
+        frame[:] = (90, 110, 100)
+        column = self.width / self.faces
+        for face in range(self.faces):
+            phase = 2 * math.pi * face / self.faces
+            lean = 0.5 - 0.5 * math.cos(2 * math.pi * t / 6 + phase)
+            if self.faces == 1:
+                scale = 1.0 + 1.4 * lean  # Eyes 56 to 134 pixels apart, across the BRAKE distance
+            else:
+                scale = 0.8 + 0.5 * lean  # Side by side without overlapping
+            center_x = column * (face + 0.5) + 0.25 * column * math.sin(2 * math.pi * t / 4 + phase)
+            center_y = self.height / 2 + 20 * math.sin(2 * math.pi * t / 3 + phase)
+            draw_face(frame, center_x, center_y, scale)
+        return frame
+
+
+class VideoSource(PacedSource):
+    """Frames of a video file, at rate frames per second (the rate of the file by default)."""
+
+    def __init__(self, path, frames=None, rate=None):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise OSError("Cannot open " + path)
+        count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or FRAMES
+        super().__init__(min(frames, count) if frames else count, rate or self.cap.get(cv2.CAP_PROP_FPS) or RATE,
+                         int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read_frame(self, index):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class RecordingSender:
+    """Sender of FaceTracking counting the commands and their latency from the capture of their frame."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.latency = LatencyHistogram()  # Microseconds
+
+    def send(self, command, stamp=None):
+        now = time.monotonic_ns()
+        with self.lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+            if stamp is not None:
+                self.latency.record((now - stamp) // 1000)
+
+
+def run(make_source, tracking, detection, pose_filter, players=1, verbose=False):
+    sender = RecordingSender()
+    source = make_source(players)
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            # The pipeline prints every command and every frame without face
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        tracker = FaceTracking(sender=sender, preview=None, tracking=tracking, pose_filter=pose_filter,
+                               detection=detection, source=source, players=players, senders=[sender] * players)
+        start = time.monotonic()
+        tracker.runtracking()
+        duration = time.monotonic() - start
+
+    stages = tracker.timings.report()
+    processed = stages['pose']['count']
+    capture = tracker.capture.stats()
+    result = {
+        'tracking': tracking,
+        'detection': detection,
+        'filter': pose_filter,
+        'players': players,
+        'source': type(source).__name__,
+        'frames': source.frames,
+        'captured': capture['frames'],
+        'dropped': capture['dropped'],
+        'processed': processed,
+        'duration_s': duration,
+        'fps': processed / duration if duration > 0 else 0.0,
+        'stages': stages,
+        'results': tracker.res.stats(),
+        'commands': sender.commands,
+        'command_latency_p50_us': sender.latency.quantile(0.5),
+        'command_latency_p99_us': sender.latency.quantile(0.99),
+        'command_latency_max_us': sender.latency.max,
+    }
+    if tracker.roi_tracker is not None:
+        result['roi'] = tracker.roi_tracker.stats()
+    if tracker.pose_filter is not None:
+        result['pose_filter'] = tracker.pose_filter.stats()
+    if tracker.assigner is not None:
+        result['assigner'] = tracker.assigner.stats()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline benchmark of the face tracking pipeline")
+    parser.add_argument('-video', default=None, help="video file (synthetic faces by default)")
+    parser.add_argument('-frames', type=int, default=FRAMES, help="frames per run")
+    parser.add_argument('-rate', type=float, default=None, help="frames per second of the source")
+    parser.add_argument('-tracking', nargs='+', default=['full'], choices=TRACKING_MODES)
+    parser.add_argument('-detection', nargs='+', default=['live'], choices=DETECTION_MODES)
+    parser.add_argument('-filter', nargs='+', default=['none'], choices=[str(f).lower() for f in POSE_FILTERS])
+    parser.add_argument('-players', type=int, nargs='+', default=[1], help="faces, one player each (full tracking)")
+    parser.add_argument('-verbose', action='store_true', help="keep the prints of the pipeline")
+    parser.add_argument('-o', dest='output', default=None, help="JSON file of the results")
+    args = parser.parse_args()
+
+    if args.video:
+        def make_source(players):
+            return VideoSource(args.video, args.frames, args.rate)
+    else:
+        def make_source(players):
+            return SyntheticFaces(args.frames, args.rate or RATE, players)
+
+    results = []
+    print(f"{'tracking':9} {'detection':9} {'filter':8} {'players':>7} {'fps':>6} {'dropped':>7} {'preproc us':>10} "
+          f"{'detect us':>9} {'pose us':>8} {'age p50 ms':>10} {'cmd p50 ms':>10} {'commands':>8}")
+    for tracking in args.tracking:
+        for detection in args.detection:
+            for pose_filter in args.filter:
+                for players in args.players:
+                    if players > 1 and tracking != 'full':
+                        continue  # The ROI follows one face
+                    r = run(make_source, tracking, detection, None if pose_filter == 'none' else pose_filter,
+                            players, args.verbose)
+                    results.append(r)
+                    stages = r['stages']
+                    print(f"{tracking:9} {detection:9} {pose_filter:8} {players:7} {r['fps']:6.1f} {r['dropped']:7} "
+                          f"{stages['preprocess']['mean_us']:10.0f} {stages['detect']['mean_us']:9.0f} "
+                          f"{stages['pose']['mean_us']:8.0f} {r['results']['age_p50_us'] / 1000:10.1f} "
+                          f"{r['command_latency_p50_us'] / 1000:10.1f} {sum(r['commands'].values()):8}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join('benchmarks', 'results'), exist_ok=True)
+        output = os.path.join('benchmarks', 'results', 'face_tracking_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({
+            'benchmark': 'face_tracking',
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'mediapipe': mp.__version__,
+            'video': args.video,
+            'results': results,
+        }, f, indent=2)
+    print("Results written in " + output)
@@ -0,0 +1,218 @@
+"""
+Throughput benchmark of the STK_input_server.
+
+The server runs in its own process with a null key backend that only timestamps the key events, and one sender process
+per producer port floods it with a command mix at a given rate. For each configuration the benchmark reports:
+    - the sustained throughput (commands dispatched per second),
+    - the drop rate (datagrams sent but never received by the server),
+    - the queueing delay (send stamp -> the server starts dispatching the command),
+    - the dispatch latency (send stamp -> the key state table is done with the command), p50 and p99.
+
+Run from the root of the project:
+    python -m benchmarks.bench_input_server
+    python -m benchmarks.bench_input_server -rates 60 1000 10000 -mixes pwm buttons -duration 5
+
+Results are written as JSON (benchmarks/results/ by default) to compare the runs over time.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+
+import STK_input_server
+import stk_protocol
+from latency_metrics import LatencyHistogram
+from output_backends import NullBackend
+
+SOURCES = (stk_protocol.SOURCE_OSC, stk_protocol.SOURCE_QR, stk_protocol.SOURCE_VOICE, stk_protocol.SOURCE_ARDUINO,
+           stk_protocol.SOURCE_FACE)
+
+# Command mixes, each one a function returning the commands of the next datagram of a sender
+MIXES = {
+    # PWM of the OSC control loop: press and release of the steering and throttle keys
+    'pwm': lambda rng, i: (('P_LEFT', 'P_UP', 'R_LEFT', 'R_UP')[i % 4],),
+    # Buttons of every modality, pressed and released in a random order
+    'buttons': lambda rng, i: (rng.choice(('P_', 'R_')) + rng.choice(('FIRE', 'NITRO', 'SKIDDING', 'LOOKBACK',
+                                                                       'RESCUE', 'UP', 'DOWN')),),
+    # Several commands per frame, like the arduino releasing a pedal and pressing the other one
+    'frames': lambda rng, i: (('R_UP', 'P_DOWN'), ('R_DOWN', 'P_SKIDDING', 'P_UP'), ('R_SKIDDING', 'R_UP'))[i % 3],
+    # Legacy text datagrams
+    'legacy': lambda rng, i: (('P_NITRO', 'R_NITRO', 'FIRE')[i % 3],),
+}
+
+
+class BenchServer(STK_input_server.STKInputServer):
+    """Input server measuring the queueing delay and the dispatch latency of every stamped command."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.packets = 0
+        self.commands = 0
+        self.queueing = LatencyHistogram()
+        self.dispatching = LatencyHistogram()
+        self.first = None
+        self.last = None
+
+    def handle_data(self, data, source=stk_protocol.SOURCE_UNKNOWN):
+        self.packets += 1
+        super().handle_data(data, source)
+
+    def dispatch(self, opcode, flags, source, stamp=0):
+        start = time.monotonic_ns()
+        super().dispatch(opcode, flags, source, stamp)
+        self.last = time.monotonic_ns()
+        if self.first is None:
+            self.first = start
+        self.commands += 1
+        if stamp:
+            self.queueing.record((start - stamp) // 1000)
+            self.dispatching.record((self.last - stamp) // 1000)
+
+
+def run_server(conn, rcvbuf_size, recv_batch):
+    STK_input_server.DEBUG = False
+    backend = NullBackend()
+    server = BenchServer([('127.0.0.1', 0)] * len(SOURCES), rcvbuf_size, recv_batch, list(SOURCES),
+                         key_backend=backend)
+    conn.send([sock.getsockname() for sock in server.sockets])
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    conn.recv()  # The senders are done
+    # Let the server drain its sockets before stopping it
+    idle_since = time.monotonic()
+    last = server.packets
+    while time.monotonic() - idle_since < 0.2:
+        time.sleep(0.05)
+        if server.packets != last:
+            last = server.packets
+            idle_since = time.monotonic()
+    server.stop()
+    thread.join()
+
+    elapsed = (server.last - server.first) / 1e9 if server.commands > 1 else 0.0
+    conn.send({
+        'packets': server.packets,
+        'commands': server.commands,
+        'key_events': backend.events,
+        'queueing': server.queueing,
+        'dispatching': server.dispatching,
+        'dispatch_window_s': elapsed,
+    })
+    server.close()
+
+
+def run_sender(address, source, mix, rate, duration, seed, conn):
+    rng = random.Random(seed)
+    sender = stk_protocol.CommandSender(address, source, binary=(mix != 'legacy'))
+    make = MIXES[mix]
+    period = 1e9 / rate
+    start = time.monotonic_ns()
+    end = start + int(duration * 1e9)
+    sent = 0
+    while True:
+        deadline = start + int(sent * period)
+        if deadline >= end:
+            break
+        wait = deadline - time.monotonic_ns()
+        if wait > 1000000:
+            time.sleep((wait - 500000) / 1e9)
+        while time.monotonic_ns() < deadline:
+            pass
+        sender.send(*make(rng, sent))
+        sent += 1
+    sender.close()
+    conn.send(sent)
+
+
+def run_configuration(mix, rate, duration, rcvbuf_size=STK_input_server.RCVBUF_SIZE,
+                      recv_batch=STK_input_server.RECV_BATCH):
+    server_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server, args=(child_conn, rcvbuf_size, recv_batch))
+    server.start()
+    addresses = server_conn.recv()
+
+    senders = []
+    for i, (address, source) in enumerate(zip(addresses, SOURCES)):
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_sender,
+                                          args=(address, source, mix, rate / len(SOURCES), duration, i, child))
+        process.start()
+        senders.append((process, parent))
+    sent = 0
+    for process, conn in senders:
+        sent += conn.recv()
+        process.join()
+
+    server_conn.send('done')
+    stats = server_conn.recv()
+    server.join()
+
+    window = stats['dispatch_window_s'] or duration
+    return {
+        'mix': mix,
+        'target_rate': rate,
+        'duration_s': duration,
+        'sent': sent,
+        'received': stats['packets'],
+        'drop_rate': (sent - stats['packets']) / sent if sent else 0.0,
+        'commands': stats['commands'],
+        'key_events': stats['key_events'],
+        'throughput_per_s': stats['commands'] / window,
+        'queueing_p50_us': stats['queueing'].quantile(0.5),
+        'queueing_p99_us': stats['queueing'].quantile(0.99),
+        'dispatch_p50_us': stats['dispatching'].quantile(0.5),
+        'dispatch_p99_us': stats['dispatching'].quantile(0.99),
+        'dispatch_max_us': stats['dispatching'].max,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the STK input server")
+    parser.add_argument('-rates', type=int, nargs='+', default=[60, 600, 2000, 5000, 10000],
+                        help="total messages per second sent to the server")
+    parser.add_argument('-mixes', nargs='+', default=['pwm', 'buttons', 'frames'], choices=sorted(MIXES))
+    parser.add_argument('-duration', type=float, default=3.0, help="seconds per configuration")
+    parser.add_argument('-rcvbuf', type=int, default=STK_input_server.RCVBUF_SIZE)
+    parser.add_argument('-batch', type=int, default=STK_input_server.RECV_BATCH)
+    parser.add_argument('-o', dest='output', default=None, help="JSON file of the results")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'mix':8} {'rate':>6} {'sent':>7} {'drop%':>6} {'thr/s':>8} {'q p99':>8} {'d p50':>8} {'d p99':>8}")
+    for mix in args.mixes:
+        for rate in args.rates:
+            r = run_configuration(mix, rate, args.duration, args.rcvbuf, args.batch)
+            results.append(r)
+            print(f"{mix:8} {rate:6} {r['sent']:7} {100 * r['drop_rate']:6.2f} {r['throughput_per_s']:8.0f} "
+                  f"{r['queueing_p99_us']:6}us {r['dispatch_p50_us']:6}us {r['dispatch_p99_us']:6}us")
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join('benchmarks', 'results'), exist_ok=True)
+        output = os.path.join('benchmarks', 'results', 'input_server_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({
+            'benchmark': 'input_server',
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'rcvbuf': args.rcvbuf,
+            'batch': args.batch,
+            'results': results,
+        }, f, indent=2)
+    print("Results written in " + output)
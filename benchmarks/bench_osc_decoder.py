@@ -0,0 +1,190 @@
+"""
+OSC receive path benchmark: oscpy OSCThreadServer against osc_fastpath.FastPathServer.
+
+Two measures for each receiver:
+    - decode: cost per message of decoding a prepared packet and calling its callback, without the socket (the
+      unbound addresses go to a no-op default handler with oscpy, they are dropped unparsed by the fast path),
+    - receive: a sender process streams phone like messages (orientation, accelerometer, pad) at a given rate over
+      UDP for a few seconds, the benchmark reports the messages delivered to the callbacks and the drop rate.
+
+Run from the root of the project:
+    python -m benchmarks.bench_osc_decoder
+    python -m benchmarks.bench_osc_decoder -rates 1000 20000 -duration 2
+
+Results are written as JSON (benchmarks/results/ by default) to compare the runs over time.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import time
+
+from oscpy.parser import format_bundle, format_message, read_packet
+from oscpy.server import OSCThreadServer
+
+from benchmarks.bench_input_server import git_revision
+from osc_fastpath import FastPathServer
+
+ADDRESSES = (b'/multisense/orientation/yaw', b'/multisense/orientation/pitch', b'/multisense/orientation/roll',
+             b'/multisense/accelerometer/y', b'/multisense/pad/x')
+UNBOUND = b'/multisense/gyroscope/x'  # Sent by the phone but never bound
+
+PACKETS = {
+    'float': [format_message(address, [0.25 * i])[0] for i, address in enumerate(ADDRESSES)],
+    'unbound': [format_message(UNBOUND, [1.0])[0]],
+    'bundle': [format_bundle([(address, [0.5]) for address in ADDRESSES])[0]],
+}
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *values, stamp=None):
+        self.count += 1
+
+
+def oscpy_decode(packets, repeat):
+    """Decode and dispatch like OSCThreadServer does, without its socket."""
+    counter = Counter()
+    callbacks = {address: counter for address in ADDRESSES}
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        for packet in packets:
+            for address, tags, values, offset in read_packet(packet):
+                callback = callbacks.get(address)
+                if callback is not None:
+                    callback(*values)
+    return time.perf_counter_ns() - start
+
+
+def fastpath_decode(packets, repeat):
+    server = FastPathServer('127.0.0.1', 0)
+    counter = Counter()
+    for address in ADDRESSES:
+        server.bind(address, counter)
+    buffers = [(bytearray(packet), len(packet)) for packet in packets]
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        for buffer, size in buffers:
+            server.handle_packet(buffer, 0, size, 0)
+    elapsed = time.perf_counter_ns() - start
+    server.stop()
+    return elapsed
+
+
+def measure_decode(kind, repeat):
+    packets = PACKETS[kind]
+    messages = repeat * len(packets) * (len(ADDRESSES) if kind == 'bundle' else 1)
+    return {
+        'packets': kind,
+        'messages': messages,
+        'oscpy_ns_per_message': oscpy_decode(packets, repeat) / messages,
+        'fastpath_ns_per_message': fastpath_decode(packets, repeat) / messages,
+    }
+
+
+def run_sender(port, rate, duration):
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = PACKETS['float']
+    period = 1e9 / rate
+    start = time.monotonic_ns()
+    end = start + int(duration * 1e9)
+    sent = 0
+    while True:
+        deadline = start + int(sent * period)
+        if deadline >= end:
+            break
+        while time.monotonic_ns() < deadline:
+            pass
+        sock.sendto(packets[sent % len(packets)], ('127.0.0.1', port))
+        sent += 1
+    sock.close()
+    return sent
+
+
+def sender_process(port, rate, duration, conn):
+    conn.send(run_sender(port, rate, duration))
+
+
+def measure_receive(receiver, rate, duration):
+    counter = Counter()
+    if receiver == 'oscpy':
+        server = OSCThreadServer(default_handler=lambda address, *values: None)
+        sock = server.listen(address='127.0.0.1', port=0, default=True)
+        for address in ADDRESSES:
+            server.bind(address, counter)
+        port = sock.getsockname()[1]
+    else:
+        server = FastPathServer('127.0.0.1', 0)
+        for address in ADDRESSES:
+            server.bind(address, counter)
+        port = server.sock.getsockname()[1]
+
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=sender_process, args=(port, rate, duration, child))
+    cpu = time.process_time()
+    process.start()
+    sent = parent.recv()
+    process.join()
+    # Let the receiver drain its socket
+    last = -1
+    while counter.count != last:
+        last = counter.count
+        time.sleep(0.1)
+    cpu = time.process_time() - cpu
+    if receiver == 'oscpy':
+        server.terminate_server()
+        server.join_server()
+    else:
+        server.stop()
+    return {
+        'receiver': receiver,
+        'target_rate': rate,
+        'sent': sent,
+        'delivered': counter.count,
+        'drop_rate': (sent - counter.count) / sent if sent else 0.0,
+        'receiver_cpu_s': cpu,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OSC receive path benchmark")
+    parser.add_argument('-rates', type=int, nargs='+', default=[1000, 10000, 50000], help="messages per second")
+    parser.add_argument('-duration', type=float, default=3.0, help="seconds per receive measure")
+    parser.add_argument('-repeat', type=int, default=20000, help="packets decoded per decode measure")
+    parser.add_argument('-o', dest='output', default=None, help="JSON file of the results")
+    args = parser.parse_args()
+
+    decode = []
+    print(f"{'packets':8} {'oscpy ns':>9} {'fast ns':>9}")
+    for kind in PACKETS:
+        r = measure_decode(kind, args.repeat)
+        decode.append(r)
+        print(f"{kind:8} {r['oscpy_ns_per_message']:9.0f} {r['fastpath_ns_per_message']:9.0f}")
+
+    receive = []
+    print(f"{'receiver':9} {'rate':>6} {'sent':>7} {'drop%':>6} {'cpu s':>6}")
+    for rate in args.rates:
+        for receiver in ('oscpy', 'fastpath'):
+            r = measure_receive(receiver, rate, args.duration)
+            receive.append(r)
+            print(f"{receiver:9} {rate:6} {r['sent']:7} {100 * r['drop_rate']:6.2f} {r['receiver_cpu_s']:6.2f}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join('benchmarks', 'results'), exist_ok=True)
+        output = os.path.join('benchmarks', 'results', 'osc_decoder_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({
+            'benchmark': 'osc_decoder',
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'decode': decode,
+            'receive': receive,
+        }, f, indent=2)
+    print("Results written in " + output)
@@ -0,0 +1,119 @@
+"""
+Cost per sample of the streaming filters of signal_filters.
+
+Each filter is fed with a noisy signal at several sample rates, the window of the time windowed ones being 1 s, so the
+number of samples held grows with the rate. The cost per sample of the signal_filters primitives must stay flat, while
+the list based shake detection they replace (append, rebuild the list, sum it) grows with the window.
+
+Run from the root of the project:
+    python -m benchmarks.bench_signal_filters
+    python -m benchmarks.bench_signal_filters -rates 100 1000 -samples 20000
+
+Results are written as JSON (benchmarks/results/ by default) to compare the runs over time.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import time
+
+from benchmarks.bench_input_server import git_revision
+from signal_filters import Derivative, EmaFilter, KalmanFilter, MedianFilter, OneEuroFilter, ShakeDetector, TimeWindow
+
+WINDOW = 1.0  # Seconds
+
+
+class ListShakeDetector:
+    """The shake detection of the OSC servers before signal_filters, kept as a baseline."""
+
+    def __init__(self):
+        self.previous = None
+        self.buffer = []
+
+    def update(self, t, value):
+        derivative = abs(value - self.previous) if self.previous is not None else 0.0
+        self.previous = value
+        self.buffer.append((t, derivative))
+        self.buffer = [(s, d) for s, d in self.buffer if s >= t - WINDOW]
+        mean = sum(d for _, d in self.buffer) / len(self.buffer)
+        return len(self.buffer) >= 50 and mean > 3
+
+
+def time_window_update(window):
+    return lambda t, value: window.push(t, value)
+
+
+FILTERS = {
+    'time_window': lambda: time_window_update(TimeWindow(WINDOW)),
+    'ema': lambda: EmaFilter(0.05).update,
+    'derivative': lambda: Derivative(0.05).update,
+    'median5': lambda: MedianFilter(5).update,
+    'one_euro': lambda: OneEuroFilter(1.0, 0.05).update,
+    'kalman': lambda: KalmanFilter(1.0, 1.0).update,
+    'shake': lambda: ShakeDetector(window=WINDOW).update,
+    'shake_list': lambda: ListShakeDetector().update,
+}
+
+
+def measure(name, rate, samples, seed=0):
+    """Return the mean and the worst cost per sample (ns) of a filter, once its window is full."""
+    rng = random.Random(seed)
+    signal = [rng.gauss(0.0, 4.0) for _ in range(samples)]
+    update = FILTERS[name]()
+    dt = 1.0 / rate
+    warmup = min(samples // 2, int(rate * WINDOW))
+    for i in range(warmup):
+        update(i * dt, signal[i])
+
+    worst = 0
+    clock = time.perf_counter_ns
+    start = clock()
+    for i in range(warmup, samples):
+        before = clock()
+        update(i * dt, signal[i])
+        elapsed = clock() - before
+        if elapsed > worst:
+            worst = elapsed
+    total = clock() - start
+    return {
+        'filter': name,
+        'rate': rate,
+        'window_samples': int(rate * WINDOW),
+        'samples': samples - warmup,
+        'mean_ns': total / (samples - warmup),
+        'max_ns': worst,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cost per sample of the signal filters")
+    parser.add_argument('-rates', type=int, nargs='+', default=[100, 1000, 10000], help="samples per second")
+    parser.add_argument('-filters', nargs='+', default=sorted(FILTERS), choices=sorted(FILTERS))
+    parser.add_argument('-samples', type=int, default=30000, help="samples per measure, window included")
+    parser.add_argument('-o', dest='output', default=None, help="JSON file of the results")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'filter':12} {'rate':>6} {'window':>7} {'mean ns':>9} {'max ns':>9}")
+    for name in args.filters:
+        for rate in args.rates:
+            r = measure(name, rate, args.samples)
+            results.append(r)
+            print(f"{name:12} {rate:6} {r['window_samples']:7} {r['mean_ns']:9.0f} {r['max_ns']:9}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join('benchmarks', 'results'), exist_ok=True)
+        output = os.path.join('benchmarks', 'results', 'signal_filters_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({
+            'benchmark': 'signal_filters',
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'window_s': WINDOW,
+            'results': results,
+        }, f, indent=2)
+    print("Results written in " + output)
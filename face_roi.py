@@ -0,0 +1,184 @@
+"""
+Face tracking between detections, on a region of interest (ROI) around the last face.
+
+The head of the player barely moves from one frame to the next, so running BlazeFace on the whole frame every frame is
+mostly wasted. In 'roi' mode, FaceTracking uses a RoiTracker:
+    - the eyes are followed from frame to frame with a pyramidal Lucas-Kanade optical flow on the grayscale frame,
+      which costs a fraction of a detection,
+    - every roi_period frames, the detector runs on a square crop around the last face, downsampled to roi_size
+      pixels (the input size of the short range model, so MediaPipe has nothing left to resize),
+    - every full_period frames, and as soon as the face is lost (no face in the ROI, optical flow failed or the eyes
+      moved apart or together too much), the detector runs on the whole frame.
+
+Detections are asynchronous (LIVE_STREAM): submitted() keeps the grayscale frame and the crop of every frame given to
+the detector, so that apply_detection() can map the keypoints of a result back to frame pixels and update() flow them
+from the frame they were detected on to the current one.
+
+    tracker = RoiTracker(width, height)
+    if new_result:
+        tracker.apply_detection(result, timestamp_ms)
+    eyes = tracker.update(gray)  # ((x, y) right eye, (x, y) left eye) or None
+    request = tracker.detection_request(frame_bgr)  # (rgb image, transform) or None, valid until the next call
+    if request is not None:
+        tracker.submitted(timestamp_ms, gray, request[1])
+        detector.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data=request[0]), timestamp_ms)
+"""
+import cv2
+import numpy as np
+
+ROI_SIZE = 128  # Pixels, input size of blaze_face_short_range
+ROI_MARGIN = 0.5  # Margin around the face box, in face sizes
+ROI_DETECTION_PERIOD = 3  # Frames between two ROI detections, tracked by optical flow in between
+FULL_DETECTION_PERIOD = 30  # Frames between two full frame detections
+FLOW_MAX_ERROR = 30.0  # Lucas-Kanade error above which an eye is lost
+IPD_MAX_CHANGE = 1.5  # Ratio of the distance between the eyes to the detected one above which the track is lost
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=2, criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def biggest_detection(detections):
+    return max(detections, key=lambda d: d.bounding_box.width * d.bounding_box.height) if detections else None
+
+
+class RoiTracker:
+
+    def __init__(self, width, height, roi_period=ROI_DETECTION_PERIOD, full_period=FULL_DETECTION_PERIOD,
+                 roi_size=ROI_SIZE, margin=ROI_MARGIN):
+        self.width = width
+        self.height = height
+        self.roi_period = roi_period
+        self.full_period = full_period
+        self.roi_size = roi_size
+        self.margin = margin
+
+        self.eyes = None  # float32 (2, 1, 2): right and left eye in pixels of self.gray, None when lost
+        self.box = None  # (x, y, width, height) of the face in pixels of self.gray
+        self.gray = None
+        self.ipd = 0.0  # Distance between the eyes at the last detection
+        self.since_detection = 0  # Frames since the last submitted detection
+        self.since_full = 0  # Frames since the last submitted full frame detection
+        self.pending = {}  # timestamp_ms -> (grayscale frame, transform) of the frames in the detector
+        self.crop_bgr = np.empty((roi_size, roi_size, 3), np.uint8)  # ROI given to the detector, reused every time
+        self.crop_rgb = np.empty((roi_size, roi_size, 3), np.uint8)
+
+        self.full_detections = 0
+        self.roi_detections = 0
+        self.flows = 0
+        self.losses = 0
+
+    def wants_detection(self):
+        """True when the next frame will be given to the detector."""
+        return (self.eyes is None or self.since_detection + 1 >= self.roi_period
+                or self.since_full + 1 >= self.full_period)
+
+    def detection_request(self, frame_bgr, rgb=None):
+        """
+        Image to give to the detector for this frame as (contiguous RGB image, transform), None if not needed. The
+        transform (x, y, width, height, scale) is the area of the frame given to the detector and its pixel size.
+        rgb is the buffer of the whole frame converted to RGB, a new array by default. The images are only valid
+        until the next call: give them to the detector right away (mp.Image copies them).
+        """
+        self.since_detection += 1
+        self.since_full += 1
+        if self.eyes is None or self.since_full >= self.full_period:
+            self.since_detection = self.since_full = 0
+            self.full_detections += 1
+            return cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB, dst=rgb), (0, 0, self.width, self.height, 1.0)
+        if self.since_detection >= self.roi_period:
+            self.since_detection = 0
+            self.roi_detections += 1
+            x, y, width, height = self.roi()
+            cv2.resize(frame_bgr[y:y + height, x:x + width], (self.roi_size, self.roi_size), dst=self.crop_bgr,
+                       interpolation=cv2.INTER_AREA)
+            return cv2.cvtColor(self.crop_bgr, cv2.COLOR_BGR2RGB, dst=self.crop_rgb), \
+                (x, y, width, height, width / self.roi_size)
+        return None
+
+    def roi(self):
+        """Square around the last face box, with its margin, inside the frame."""
+        x, y, width, height = self.box
+        side = int(max(width, height) * (1 + 2 * self.margin))
+        side = min(side, self.width, self.height)
+        center_x = x + width / 2
+        center_y = y + height / 2
+        left = int(min(max(center_x - side / 2, 0), self.width - side))
+        top = int(min(max(center_y - side / 2, 0), self.height - side))
+        return left, top, side, side
+
+    def submitted(self, timestamp_ms, gray, transform):
+        self.pending[timestamp_ms] = (gray, transform)
+
+    def lose(self):
+        if self.eyes is not None:
+            self.losses += 1
+        self.eyes = None
+        self.box = None
+
+    def apply_detection(self, result, timestamp_ms):
+        """Move the track to the detection made on the frame of timestamp_ms."""
+        if timestamp_ms not in self.pending:
+            return  # Not a frame submitted by this tracker
+        gray, transform = self.pending.pop(timestamp_ms)
+        for older in [t for t in self.pending if t < timestamp_ms]:
+            del self.pending[older]  # Dropped by the detector
+        face = biggest_detection(result.detections if result is not None else None)
+        if face is None or len(face.keypoints) < 2:
+            self.lose()
+            return
+        x0, y0, width, height, scale = transform
+        right_eye, left_eye = face.keypoints[0], face.keypoints[1]
+        self.eyes = np.array([[[x0 + right_eye.x * width, y0 + right_eye.y * height]],
+                              [[x0 + left_eye.x * width, y0 + left_eye.y * height]]], np.float32)
+        bbox = face.bounding_box
+        self.box = (x0 + bbox.origin_x * scale, y0 + bbox.origin_y * scale, bbox.width * scale, bbox.height * scale)
+        self.ipd = float(np.linalg.norm(self.eyes[0, 0] - self.eyes[1, 0]))
+        self.gray = gray
+
+    def update(self, gray):
+        """Eyes in gray as ((x, y) right eye, (x, y) left eye) in pixels, None when no face is tracked."""
+        if self.eyes is None:
+            return None
+
+        if self.gray is not gray:
+            # Flow on the ROI only, the pyramids of the whole frame would cost more than the flow itself
+            x, y, width, height = self.roi()
+            offset = np.array([x, y], np.float32)
+            eyes, status, error = cv2.calcOpticalFlowPyrLK(self.gray[y:y + height, x:x + width],
+                                                           gray[y:y + height, x:x + width], self.eyes - offset, None,
+                                                           **LK_PARAMS)
+            self.flows += 1
+            if eyes is None or not status.all() or float(error.max()) > FLOW_MAX_ERROR:
+                self.lose()
+                return None
+            eyes += offset
+            ipd = float(np.linalg.norm(eyes[0, 0] - eyes[1, 0]))
+            if not self.ipd / IPD_MAX_CHANGE < ipd < self.ipd * IPD_MAX_CHANGE:
+                self.lose()
+                return None
+            dx, dy = (eyes - self.eyes).reshape(2, 2).mean(axis=0)
+            x, y, width, height = self.box
+            self.box = (x + float(dx), y + float(dy), width, height)
+            self.eyes = eyes
+            self.gray = gray
+
+        return (float(self.eyes[0, 0, 0]), float(self.eyes[0, 0, 1])), \
+            (float(self.eyes[1, 0, 0]), float(self.eyes[1, 0, 1]))
+
+    def overlay(self):
+        """ROI and eyes, as the shapes of frame_preview.PreviewProcess.publish (BGR colors)."""
+        if self.eyes is None:
+            return [], []
+        x, y, width, height = self.roi()
+        box_x, box_y, box_width, box_height = (int(v) for v in self.box)
+        polygons = [([(x, y), (x + width, y), (x + width, y + height), (x, y + height)], (255, 0, 0)),
+                    ([(box_x, box_y), (box_x + box_width, box_y), (box_x + box_width, box_y + box_height),
+                      (box_x, box_y + box_height)], (0, 0, 255))]
+        return polygons, [tuple(int(v) for v in eye[0]) for eye in self.eyes]
+
+    def stats(self):
+        return {
+            'full_detections': self.full_detections,
+            'roi_detections': self.roi_detections,
+            'flows': self.flows,
+            'losses': self.losses,
+        }
@@ -14,14 +14,25 @@
 ######################################################################################
 
 # import necessary modules
-import socket
 import sys
 import time
+import functools
 import math
 import threading
 import numpy as np
 from typing import Tuple, Union
 
+from stk_protocol import CommandSender, SOURCE_FACE
+from multiplayer_server import BASE_PORT, player_address
+from camera_capture import CameraCapture, StageTimings
+from latency_metrics import LatencyHistogram
+from frame_preview import PreviewProcess, PREVIEW_MODES, box_corners, draw_shapes
+from face_roi import RoiTracker, biggest_detection
+from face_players import PlayerAssigner, face_positions
+from frame_preprocess import FramePreprocessor
+from head_pose import HeadCommands, HeadPoseFilter, OUTPUT_RATE, POSE_FILTERS
+from tick_scheduler import TickScheduler
+
 # import oscpy for OSC streaming (https://pypi.org/project/ocspy/)
 from oscpy.client import OSCClient
 
@@ -33,15 +44,48 @@ import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
+MAX_IN_FLIGHT = 1  # Frames given to detect_async whose result has not arrived yet
+IN_FLIGHT_TIMEOUT = 0.5  # Seconds after which a frame without result is considered lost by MediaPipe
+REPORT_PERIOD = 10.0  # Seconds between two prints of the stage timings
+STAGES = ('capture', 'preprocess', 'submit', 'detect', 'pose', 'command', 'display')
+TRACKING_MODES = ('full', 'roi')  # Detection on every full frame, or on a ROI with optical flow (face_roi)
+DETECTION_MODES = ('live', 'video')  # Asynchronous detect_async (LIVE_STREAM) or synchronous detect_for_video (VIDEO)
+RESULT_MAX_AGE = 0.25  # Seconds between the capture of a frame and the use of its result beyond which it is dropped
+
 
 class FaceTracking:
-    def __init__(self, _server_address='localhost', _server_port=6006):
+    def __init__(self, _server_address='localhost', _server_port=6006, sender=None, max_in_flight=MAX_IN_FLIGHT,
+                 preview='window', tracking='full', pose_filter=None, detection='live', max_age=RESULT_MAX_AGE,
+                 source=0, players=1, base_port=BASE_PORT, senders=None):
+        """
+        source: camera index, video file or capture object (see camera_capture.CameraCapture)
+        players: faces followed, each one driving its own player (face_players), with full tracking only. The
+            commands of player i go to senders[i], by default to player_address(i, SOURCE_FACE, base_port) on
+            _server_address (multiplayer_server layout)
+        preview: 'window' (annotated in the loop), 'process' (frame_preview.PreviewProcess) or None (headless)
+        tracking: 'full' (detection on every frame) or 'roi' (face_roi.RoiTracker)
+        pose_filter: None (commands from the pose of each frame), 'kalman' or 'one_euro' (commands from the pose
+            predicted at OUTPUT_RATE by head_pose.HeadPoseFilter)
+        detection: 'live' (asynchronous, the loop goes on while the detector runs) or 'video' (synchronous, the loop
+            waits for the result of each frame, for comparison)
+        max_age: seconds after the capture of a frame beyond which its result is dropped, None to keep them all
+        """
+        if preview not in PREVIEW_MODES:
+            raise ValueError("Unknown preview mode " + str(preview))
+        if tracking not in TRACKING_MODES:
+            raise ValueError("Unknown tracking mode " + str(tracking))
+        if pose_filter not in POSE_FILTERS:
+            raise ValueError("Unknown pose filter " + str(pose_filter))
+        if detection not in DETECTION_MODES:
+            raise ValueError("Unknown detection mode " + str(detection))
+        if players > 1 and tracking != 'full':
+            raise ValueError("Several players need the full tracking, the ROI follows one face")
         self.fl = 590
         self.screen_heigth = 21.6
         self.REAL_IPD = 6.3
         self.user_ipd = self.REAL_IPD
 
-        if len(sys.argv) >= 2:
+        if len(sys.argv) >= 2 and sys.argv[1].replace('.', '', 1).isdigit():
             self.user_ipd = float(sys.argv[1])
 
         print(f"Tracking initialized with an interpupillary distance of {self.user_ipd} cm")
@@ -49,23 +93,63 @@ class FaceTracking:
         self.server_address = _server_address
         self.server_port = _server_port
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Create a UDP socket
+        # UDP sender, or command_bus.BusSender when running with the server
+        self.players = players
+        if players > 1:
+            # One sender per player, to the face tracking port of each player of the multiplayer_server
+            self.senders = senders if senders is not None else [
+                CommandSender(player_address(player, SOURCE_FACE, base_port, self.server_address), SOURCE_FACE)
+                for player in range(players)]
+            self.sender = self.senders[0]
+        else:
+            self.sender = CommandSender((self.server_address, self.server_port), SOURCE_FACE) if sender is None \
+                else sender
+            self.senders = [self.sender]
         print("OSC connection established to " + self.server_address + " on port " + str(self.server_port) + "!")
 
-        self.cap = cv2.VideoCapture(0)
-        self.first_time = time.time() * 1000.0
+        # The camera is read in its own thread, the loop takes the newest frame
+        self.capture = CameraCapture(source)
+        self.cap = self.capture.cap
 
-        self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))  # Width of the video frame
-        self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))  # Height of the video frame
+        self.frame_width = self.capture.width  # Width of the video frame
+        self.frame_height = self.capture.height  # Height of the video frame
         print(f"Video size: {self.frame_width} x {self.frame_height}")
-        self.res = TrackingResults()  # Create an instance of TrackingResults
-        # Create a face detector instance with the live stream mode:
+        # Time spent in each stage of the loop, the detect stage going from detect_async to the result callback and the
+        # command stage timing each command sent (inside the pose stage, or on the output thread of the pose filter)
+        self.timings = StageTimings(STAGES)
+        self.res = TrackingResults(self.timings, max_in_flight)  # Create an instance of TrackingResults
+        self.detection = Detection()  # Newest result taken from self.res by the loop
+        self.detection_mode = detection
+        self.max_age = max_age
+        self.preview = preview
+        self.preview_process = None
+        self.tracking = tracking
+        self.roi_tracker = RoiTracker(self.frame_width, self.frame_height) if tracking == 'roi' else None
+        # Buffers reused by every frame. Headless, the pixels are not mirrored, the eyes are. The optical flow keeps the
+        # previous grayscale frame and those in the detector, hence the ring of max_in_flight + 3 grayscale buffers.
+        self.preprocess = FramePreprocessor(self.frame_width, self.frame_height, mirror=preview is not None,
+                                            grays=max_in_flight + 3 if tracking == 'roi' else 0)
+        # Commands with hysteresis, from the pose of each frame or from the predicted pose on the output thread
+        self.player_commands = [HeadCommands(functools.partial(self.send_udp_command, player=player))
+                                for player in range(players)]
+        self.pose_filters = [HeadPoseFilter(pose_filter) for _ in range(players)] if pose_filter is not None else []
+        self.commands = self.player_commands[0]
+        self.pose_filter = self.pose_filters[0] if self.pose_filters else None
+        self.assigner = PlayerAssigner(players) if players > 1 else None
+        self.output_scheduler = TickScheduler(OUTPUT_RATE)
+        self.output_thread = None
+        self.last_timestamp_ms = -1
+        self.running = False
+        # Create a face detector instance with the live stream mode (or the video mode, without callback):
         base_options = python.BaseOptions(model_asset_path="blaze_face_short_range.tflite")
-        options = vision.FaceDetectorOptions(
-            base_options=base_options,
-            running_mode=vision.RunningMode.LIVE_STREAM,
-            result_callback=self.res.get_result,  # Set the callback function to handle detection results
-        )
+        if detection == 'live':
+            options = vision.FaceDetectorOptions(
+                base_options=base_options,
+                running_mode=vision.RunningMode.LIVE_STREAM,
+                result_callback=self.res.get_result,  # Set the callback function to handle detection results
+            )
+        else:
+            options = vision.FaceDetectorOptions(base_options=base_options, running_mode=vision.RunningMode.VIDEO)
         self.detector = vision.FaceDetector.create_from_options(options)  # Create the face detector
         self.MARGIN = 10  # pixels
         self.ROW_SIZE = 10  # pixels
@@ -83,20 +167,27 @@ class FaceTracking:
 
         return (x, y, z)
 
-    def send_udp_command(self, command):
-        # Send a command via UDP
-        print(f"Sending command: {command}")
-        self.sock.sendto(command.encode(), (self.server_address, self.server_port))
+    def send_udp_command(self, command, stamp=None, player=0):
+        # Send a command via UDP, stamp being the monotonic time (ns) of the frame it comes from
+        start = time.monotonic_ns()
+        print(f"Sending command: {command}" if self.players == 1 else f"Sending command of player {player}: {command}")
+        self.senders[player].send(command, stamp=stamp)
+        self.timings.record('command', start)
 
-    def visualize(self, image, detection_result) -> np.ndarray:
+    def visualize(self, image, detection_result, out=None) -> np.ndarray:
         """Draws bounding boxes and keypoints on the input image and return it.
         Args:
           image: The input RGB image.
           detection_result: The list of all "Detection" entities to be visualize.
+          out: Buffer of the shape of image receiving the annotated copy, a new array by default.
         Returns:
           Image with bounding boxes.
         """
-        annotated_image = image.copy()
+        if out is None:
+            annotated_image = image.copy()
+        else:
+            np.copyto(out, image)
+            annotated_image = out
         height, width, _ = image.shape
 
         if detection_result is None or not detection_result.detections:
@@ -167,57 +258,182 @@ class FaceTracking:
 
         return annotated_image
 
+    def face_eyes(self, detection_result):
+        """Pixels of the right and left eyes of the biggest face, None without face."""
+        if not detection_result or not detection_result.detections:
+            return None
+        # Get the biggest face
+        biggest_face = biggest_detection(detection_result.detections)
+        # Get the position of the two eyes in pixels
+        right_eye = biggest_face.keypoints[0]  # Get right eye keypoint
+        left_eye = biggest_face.keypoints[1]  # Get left eye keypoint
+        right_eye_px = _normalized_to_pixel_coordinates(
+            right_eye.x, right_eye.y, self.frame_width, self.frame_height
+        )
+        left_eye_px = _normalized_to_pixel_coordinates(
+            left_eye.x, left_eye.y, self.frame_width, self.frame_height
+        )
+        return right_eye_px, left_eye_px
+
+    def detection_overlay(self, detection_result):
+        """Boxes and keypoints of the detections, as the shapes of PreviewProcess.publish (BGR colors)."""
+        polygons = []
+        points = []
+        if detection_result is not None:
+            for detection in detection_result.detections:
+                bbox = detection.bounding_box
+                polygons.append((box_corners(bbox.origin_x, bbox.origin_y, bbox.width, bbox.height), (0, 0, 255)))
+                for keypoint in detection.keypoints:
+                    keypoint_px = _normalized_to_pixel_coordinates(
+                        keypoint.x, keypoint.y, self.frame_width, self.frame_height
+                    )
+                    if keypoint_px is not None:
+                        points.append(keypoint_px)
+        return polygons, points
+
+    def detection_timestamp(self, frame_stamp):
+        """Timestamp (ms) of a frame for the detector: its capture time, strictly increasing as MediaPipe requires."""
+        self.last_timestamp_ms = max(frame_stamp // 1000000, self.last_timestamp_ms + 1)
+        return self.last_timestamp_ms
+
+    def detect(self, image_rgb, timestamp_ms, frame_stamp, sequence):
+        """Give a frame to the detector as timestamp_ms, its result reaching self.res when done."""
+        self.res.submitted(timestamp_ms, frame_stamp, sequence)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image_rgb)
+        if self.detection_mode == 'live':
+            self.detector.detect_async(mp_image, timestamp_ms)  # Perform asynchronous face detection
+        else:
+            self.res.get_result(self.detector.detect_for_video(mp_image, timestamp_ms), mp_image, timestamp_ms)
+
+    def output_tick(self, tick, deadline):
+        # Commands from the pose predicted at the deadline, stamped with the capture time of the last frame measured.
+        # The keys of a player whose face is lost are released here, the only thread using the commands.
+        for pose_filter, commands in zip(self.pose_filters, self.player_commands):
+            position = pose_filter.predict(deadline)
+            if position is not None:
+                commands.update(position, pose_filter.stamp)
+            else:
+                commands.release()
+
+    def update_players(self, detection_result, stamp):
+        """Commands of every player from all the faces of a detection."""
+        detections = detection_result.detections if detection_result is not None else []
+        positions = face_positions(detections, self.frame_width, self.frame_height, self.user_ipd, self.fl,
+                                   mirror=not self.preprocess.mirror)
+        players, released = self.assigner.assign(positions)
+        for player in released:
+            if self.pose_filters:
+                self.pose_filters[player].reset()  # The output thread releases the keys once nothing is predicted
+            else:
+                self.player_commands[player].release(stamp)
+        for position, player in zip(positions, players):
+            if player < 0:
+                continue
+            if self.pose_filters:
+                self.pose_filters[player].measure(stamp, position)
+            else:
+                self.player_commands[player].update(position, stamp)
+
     def runtracking(self):
         print("\nTracking started !!!")
-        print("Hit ESC key to quit...")
-        # Variables to track the previous head state
-        previous_left = False
-        previous_right = False
-        previous_accelerate = False
-        previous_brake = False
-        # infinite loop for processing the video stream
-        while True:
-            # add to delay to avoid that the loop run too fast
-            time.sleep(0.05)
-
-            # read one frame from a camera and get the frame timestamp
-            ret, img_bgr = self.cap.read()
-            frame_timestamp_ms = int(time.time() * 1000 - self.first_time)
-
-            #! we added on purpose this flip, to remove the mirror effect
-            img_bgr = cv2.flip(img_bgr, 1)
-            # Convert the opencv image to RGB
-            img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-
-            # Convert the frame received from OpenCV to a MediaPipe’s Image object.
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=img_rgb)
-
-            # Send live image data to perform face detection.
-            # The results are accessible via the `result_callback` provided in
-            # the `FaceDetectorOptions` object.
-            # The face detector must be created with the live stream mode.
-            self.detector.detect_async(
-                mp_image, int(time.time() * 1000)
-            )  # Perform asynchronous face detection
-
-            if self.res.tracking_results and self.res.tracking_results.detections:
-                # If a face is detected
-                # Get the biggest face
-                biggest_face = max(
-                    self.res.tracking_results.detections,
-                    key=lambda d: d.bounding_box.width * d.bounding_box.height,
-                )
-                # Get the position of the two eyes in pixels
-                right_eye = biggest_face.keypoints[0]  # Get right eye keypoint
-                left_eye = biggest_face.keypoints[1]  # Get left eye keypoint
+        if self.preview is None:
+            print("Headless, hit Ctrl+C to quit...")
+        else:
+            print("Hit ESC key to quit...")
+        if self.preview == 'process':
+            self.preview_process = PreviewProcess('img', (self.frame_height, self.frame_width, 3)).start()
+        self.running = True
+        self.capture.start()
+        if self.pose_filter is not None:
+            self.output_thread = threading.Thread(target=self.output_scheduler.run, args=(self.output_tick,),
+                                                  name='head-pose-output', daemon=True)
+            self.output_thread.start()
+        try:
+            self.track()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # stop the capture thread and release the video stream from the camera
+            self.capture.stop()
+            if self.output_thread is not None:
+                self.output_scheduler.stop()
+                self.output_thread.join()
+            for commands in self.player_commands:
+                commands.release()
+            self.detector.close()
+            # close the associated window
+            if self.preview == 'window':
+                cv2.destroyAllWindows()
+            elif self.preview_process is not None:
+                self.preview_process.close()
+            self.print_stats()
+
+    def stop(self):
+        """Stop runtracking from another thread, for the headless runs."""
+        self.running = False
+
+    def track(self):
+        last_report = time.monotonic()
+        # loop processing the video stream until stop() or Esc
+        while self.running:
+            # Backpressure: wait until a detection slot is free before taking the frame, so that the frame given to
+            # the detector is the newest one. The frames captured in the meantime are dropped by the capture slot.
+            if self.roi_tracker is None or self.roi_tracker.wants_detection():
+                self.res.wait_slot(IN_FLIGHT_TIMEOUT)
+
+            # take the newest frame from the capture thread, with the time at which it was read
+            item = self.capture.slot.take(timeout=1.0)
+            if item is None:
+                if self.capture.ended:
+                    print("End of the video stream.")
+                    break
+                continue
+            img_bgr, frame_stamp, sequence = item
+            start = self.timings.record('capture', frame_stamp)  # Age of the frame when the loop takes it
+
+            #! we added on purpose this flip, to remove the mirror effect (on the eyes only when headless)
+            img_bgr = self.preprocess.bgr_frame(img_bgr)
+
+            if self.roi_tracker is None:
+                # Convert the opencv image to RGB
+                img_rgb = self.preprocess.rgb_frame(img_bgr)
+
+                start = self.timings.record('preprocess', start)
+
+                # Send live image data to perform face detection.
+                # The results are accessible via the `result_callback` provided in
+                # the `FaceDetectorOptions` object.
+                self.detect(img_rgb, self.detection_timestamp(frame_stamp), frame_stamp, sequence)
+                start = self.timings.record('submit', start)
+                # The pose of the newest detection, once, with the capture time of the frame it was detected on
+                fresh = self.res.take(self.detection, self.max_age)
+                eyes = self.face_eyes(self.detection.result) if fresh and self.players == 1 else None
+                pose_stamp = self.detection.stamp
+            else:
+                # Follow the eyes from the last detection with the optical flow, then give the ROI (or the whole
+                # frame when the face is lost) to the detector on the frames where a detection is due
+                gray = self.preprocess.gray_frame(img_bgr)
+                if self.res.take(self.detection, self.max_age):
+                    self.roi_tracker.apply_detection(self.detection.result, self.detection.timestamp_ms)
+                eyes = self.roi_tracker.update(gray)
+                fresh = True
+                pose_stamp = frame_stamp  # The eyes are flowed onto this frame
+                request = self.roi_tracker.detection_request(img_bgr, self.preprocess.rgb)
+                start = self.timings.record('preprocess', start)
+                if request is not None:
+                    image_rgb, transform = request
+                    timestamp_ms = self.detection_timestamp(frame_stamp)
+                    self.roi_tracker.submitted(timestamp_ms, gray, transform)
+                    self.detect(image_rgb, timestamp_ms, frame_stamp, sequence)
+                    start = self.timings.record('submit', start)
+
+            if self.players > 1:
+                if fresh:
+                    self.update_players(self.detection.result, pose_stamp)
+            elif eyes is not None:
+                # If a face is detected, with the position of the two eyes in pixels
+                right_eye_px, left_eye_px = self.preprocess.mirror_points(eyes)
                 # If we have a position for the two eyes
-                # compute the position between the two eyes (in pixels)
-                right_eye_px = _normalized_to_pixel_coordinates(
-                    right_eye.x, right_eye.y, self.frame_width, self.frame_height
-                )
-                left_eye_px = _normalized_to_pixel_coordinates(
-                    left_eye.x, left_eye.y, self.frame_width, self.frame_height
-                )
                 # compute the interpupillary distance (in pixels)
                 if right_eye_px and left_eye_px:
                     ipd_pixels = math.hypot(
@@ -229,57 +445,67 @@ class FaceTracking:
                     pos_x, pos_y, pos_z = self.compute3DPos(ibe_x, ibe_y, ipd_pixels)
                     #print(f"3D position: {pos_x:.2f} - {pos_y:.2f} - {pos_z:.2f}")
 
-                    # Head movements mapped to game controls
-                    if pos_x >10:  # Turn right
-                        if not previous_right:
-                            self.send_udp_command("P_LOOKBACK")  # Press right
-                            previous_right = True
-                        if previous_left:  # Release left if previously pressed
-                            self.send_udp_command("P_LOOKBACK")
-                            previous_left = False
-                    elif pos_x < -10:  # Turn left
-                        if not previous_left:
-                            self.send_udp_command("P_LOOKBACK")  # Press left
-                            previous_left = True
-                        if previous_right:  # Release right if previously pressed
-                            self.send_udp_command("P_LOOKBACK")
-                            previous_right = False
-                    else:  # Head is centered, release both left and right
-                        if previous_left:
-                            self.send_udp_command("R_LOOKBACK")
-                            previous_left = False
-                        if previous_right:
-                            self.send_udp_command("R_LOOKBACK")
-                            previous_right = False
-
-                    if pos_z < 30:  # Accelerate (close to the camera)
-                     if not previous_accelerate:
-                        self.send_udp_command("P_BRAKE")
-                        previous_brake = True
-                    else:  # Neither brake nor accelerate
-                     if previous_brake:
-                        self.send_udp_command("R_BRAKE")
-                        previous_brake = False
+                    # Head movements mapped to game controls: look back off the camera axis, brake when close
+                    if self.pose_filter is None:
+                        self.commands.update((pos_x, pos_y, pos_z), pose_stamp)
+                    else:
+                        self.pose_filter.measure(pose_stamp, (pos_x, pos_y, pos_z))
                 else:
                     print("Invalid interpupillary distance.")
-            else:
+            elif fresh:
                 print("No face detected.")
-
-            # Display the image with or without annotations
-            annotated_image = mp_image.numpy_view()
-            annotated_image = self.visualize(annotated_image, self.res.tracking_results)
-            bgr_annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR)
-            cv2.imshow('img', bgr_annotated_image)
-
-            # Wait for Esc key to stop
-            k = cv2.waitKey(30) & 0xFF
-            if k == 27:
+            start = self.timings.record('pose', start)
+
+            if self.preview == 'window' and self.roi_tracker is not None:
+                # The mirrored frame is not used anymore once the ROI and the grayscale frame are taken
+                cv2.imshow('img', draw_shapes(img_bgr, *self.roi_tracker.overlay()))
+            elif self.preview == 'window':
+                # Display the image with or without annotations, the mirrored frame being free once in img_rgb
+                annotated_image = self.visualize(img_rgb, self.detection.result, out=self.preprocess.display)
+                cv2.imshow('img', cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR, dst=img_bgr))
+            elif self.preview_process is not None and self.preview_process.due():
+                # Drawn by the preview process, at its rate
+                if self.roi_tracker is not None:
+                    self.preview_process.publish(img_bgr, *self.roi_tracker.overlay())
+                else:
+                    self.preview_process.publish(img_bgr, *self.detection_overlay(self.detection.result))
+            self.timings.record('display', start)
+
+            if time.monotonic() - last_report > REPORT_PERIOD:
+                last_report = time.monotonic()
+                self.print_stats()
+
+            if self.preview == 'window':
+                # Wait for Esc key to stop, 1 ms being enough to run the GUI events
+                k = cv2.waitKey(1) & 0xFF
+                if k == 27:
+                    break
+            elif self.preview_process is not None and self.preview_process.quit_requested():
                 break
 
-        # release the video stream from the camera
-        self.cap.release()
-        # close the associated window
-        cv2.destroyAllWindows()
+    def print_stats(self):
+        capture = self.capture.stats()
+        print(f"Frames captured: {capture['frames']}, dropped as stale: {capture['dropped']}, "
+              f"lost by the detector: {self.res.lost}")
+        results = self.res.stats()
+        print(f"Detection results: {results['results']}, used: {results['taken']}, dropped as stale: "
+              f"{results['stale']}, overwritten: {results['overwritten']}, capture to use p50/p99: "
+              f"{results['age_p50_us'] / 1000:.1f}/{results['age_p99_us'] / 1000:.1f} ms")
+        if self.roi_tracker is not None:
+            roi = self.roi_tracker.stats()
+            print(f"Full frame detections: {roi['full_detections']}, ROI detections: {roi['roi_detections']}, "
+                  f"optical flows: {roi['flows']}, faces lost: {roi['losses']}")
+        if self.pose_filter is not None:
+            pose = self.pose_filter.stats()
+            output = self.output_scheduler.stats()
+            print(f"Pose filter: {pose['filter']}, capture to pose latency: {pose['latency_ms']:.1f} ms, "
+                  f"output ticks: {output['ticks']} at {output['frequency']:.0f} Hz, missed: {output['missed']}")
+        if self.assigner is not None:
+            players = self.assigner.stats()
+            print(f"Players: {players['active']} active of {self.players}, joined: {players['joined']}, "
+                  f"released: {players['released']}, faces without player: {players['unassigned']}")
+        print(f"Commands sent: {sum(commands.sent for commands in self.player_commands)}")
+        self.timings.print_report()
 
 
 def _normalized_to_pixel_coordinates(
@@ -294,9 +520,65 @@ def _normalized_to_pixel_coordinates(
     return x_px, y_px
 
 
+class Detection:
+    """Result of the detector for one frame, with the capture time (monotonic ns) and the sequence of the frame."""
+    __slots__ = ('result', 'timestamp_ms', 'stamp', 'sequence')
+
+    def __init__(self):
+        self.result = None
+        self.timestamp_ms = None
+        self.stamp = 0
+        self.sequence = 0  # Capture sequence of the frame, 0 before the first result
+
+    def copy_from(self, other):
+        self.result = other.result
+        self.timestamp_ms = other.timestamp_ms
+        self.stamp = other.stamp
+        self.sequence = other.sequence
+
+
 # Create a new class for retrieving and storing the tracking results
 class TrackingResults:
-    tracking_results = None
+    """
+    Results of the detector, written by the MediaPipe thread. Keeps the frames given to detect_async whose result has
+    not arrived yet, to bound them (wait_slot) and to time the detection.
+
+    The results go through two Detection buffers: get_result fills the back one and swaps them under the lock, take
+    copies the front one into the Detection of the consumer. The callback never waits for the consumer to process a
+    result, and the consumer gets a result only once (by sequence) and only if it is not older than max_age.
+    """
+
+    def __init__(self, timings=None, max_in_flight=MAX_IN_FLIGHT):
+        self.timings = timings
+        self.max_in_flight = max_in_flight
+        self.condition = threading.Condition()
+        self.in_flight = {}  # timestamp_ms -> (monotonic time (ns) of the detect_async call, capture stamp, sequence)
+        self.buffers = [Detection(), Detection()]
+        self.front = 0  # Index of the buffer holding the newest result
+        self.lost = 0  # Frames without result after IN_FLIGHT_TIMEOUT
+        self.taken_sequence = 0  # Sequence of the last result taken (or rejected as stale)
+        self.results = 0
+        self.taken = 0
+        self.stale = 0  # Results rejected by take as too old
+        self.overwritten = 0  # Results replaced by a newer one before being taken
+        self.age = LatencyHistogram()  # Capture to take of the results taken, in microseconds
+
+    def wait_slot(self, timeout):
+        """Wait until less than max_in_flight frames are in the detector, False if the oldest ones were lost."""
+        with self.condition:
+            if self.condition.wait_for(lambda: len(self.in_flight) < self.max_in_flight, timeout):
+                return True
+            # MediaPipe drops frames without calling back when it is busy: forget the oldest ones
+            limit = time.monotonic_ns() - int(timeout * 1e9)
+            for timestamp_ms in [t for t, (submitted, _, _) in self.in_flight.items() if submitted <= limit]:
+                del self.in_flight[timestamp_ms]
+                self.lost += 1
+            return False
+
+    def submitted(self, timestamp_ms, stamp, sequence):
+        """Frame of capture stamp (monotonic ns) and sequence given to the detector as timestamp_ms."""
+        with self.condition:
+            self.in_flight[timestamp_ms] = (time.monotonic_ns(), stamp, sequence)
 
     def get_result(
         self,
@@ -305,8 +587,51 @@ class TrackingResults:
         timestamp_ms: int,
     ):
         # Callback function to store the face detection results
-        self.tracking_results = result
-
-
-
-
+        with self.condition:
+            submitted, stamp, sequence = self.in_flight.pop(timestamp_ms, (None, 0, 0))
+        if not sequence:
+            return  # Forgotten by wait_slot, an older frame than the newest result anyway
+        back = self.buffers[1 - self.front]  # Not read by take, which copies the front buffer under the lock
+        back.result = result
+        back.timestamp_ms = timestamp_ms
+        back.stamp = stamp
+        back.sequence = sequence
+        with self.condition:
+            if self.buffers[self.front].sequence > self.taken_sequence:
+                self.overwritten += 1
+            self.front = 1 - self.front
+            self.results += 1
+            self.condition.notify()
+        if self.timings is not None:
+            self.timings.record('detect', submitted)
+
+    def take(self, into, max_age=None, now=None):
+        """
+        Copy the newest result into the Detection into if it was not taken yet and its frame was captured less than
+        max_age seconds ago. Return True when into was updated.
+        """
+        now = time.monotonic_ns() if now is None else now
+        with self.condition:
+            front = self.buffers[self.front]
+            if front.sequence <= self.taken_sequence:
+                return False
+            self.taken_sequence = front.sequence
+            age = now - front.stamp
+            if max_age is not None and age > max_age * 1e9:
+                self.stale += 1
+                return False
+            into.copy_from(front)
+        self.taken += 1
+        self.age.record(age // 1000)
+        return True
+
+    def stats(self):
+        return {
+            'results': self.results,
+            'taken': self.taken,
+            'stale': self.stale,
+            'overwritten': self.overwritten,
+            'lost': self.lost,
+            'age_p50_us': self.age.quantile(0.5),
+            'age_p99_us': self.age.quantile(0.99),
+        }
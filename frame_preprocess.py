@@ -0,0 +1,61 @@
+"""
+Preprocessing of the camera frames into buffers allocated once, for the camera loops.
+
+Flipping, converting and annotating a 640x480 frame with the allocating cv2 calls creates a new 900 kB array per step
+and per frame. FramePreprocessor writes every step into a buffer made at the start and reused by every frame:
+    - bgr_frame(): the frame in the orientation of the pipeline. With mirror, it is flipped into self.bgr; without
+      mirror (nothing shown, so the orientation of the pixels doesn't matter), the camera frame itself is used and the
+      keypoints are mirrored instead by mirror_points(), which costs a subtraction per point instead of a pass on the
+      pixels,
+    - rgb_frame(): BGR to RGB conversion for the detector into self.rgb. mp.Image copies its data, so the buffer can
+      be rewritten by the next frame while the detection runs,
+    - gray_frame(): grayscale conversion into a ring of `grays` buffers, as the optical flow of face_roi keeps the
+      previous frame and the frames in the detector,
+    - self.display: RGB copy of the frame to annotate for the preview window.
+
+Flipping into self.bgr then converting into self.rgb (two cv2 passes, ~170 us) is faster than a single numpy copy of
+frame[:, ::-1, ::-1] (~380 us), whose reversed strides defeat the vectorized copy.
+
+    preprocess = FramePreprocessor(640, 480, mirror=False)
+    frame = preprocess.bgr_frame(camera_frame)
+    image = mp.Image(image_format=mp.ImageFormat.SRGB, data=preprocess.rgb_frame(frame))
+    eyes = preprocess.mirror_points(eyes)  # In the pixels of the mirrored frame
+"""
+import cv2
+import numpy as np
+
+
+class FramePreprocessor:
+
+    def __init__(self, width, height, mirror=True, grays=0):
+        """mirror: flip the pixels (for a preview), grays: number of grayscale buffers in the ring (0 for none)."""
+        self.width = width
+        self.height = height
+        self.mirror = mirror
+        shape = (height, width, 3)
+        self.bgr = np.empty(shape, np.uint8) if mirror else None  # Mirrored camera frame
+        self.rgb = np.empty(shape, np.uint8)  # Frame given to the detector
+        self.display = np.empty(shape, np.uint8) if mirror else None  # Annotated frame of the preview window
+        self.grays = [np.empty((height, width), np.uint8) for _ in range(grays)]
+        self.next_gray = 0
+
+    def bgr_frame(self, frame):
+        """Camera frame in the orientation of the pipeline."""
+        if not self.mirror:
+            return frame
+        return cv2.flip(frame, 1, dst=self.bgr)
+
+    def rgb_frame(self, bgr):
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self.rgb)
+
+    def gray_frame(self, bgr):
+        """Grayscale frame in the next buffer of the ring, valid until len(self.grays) other calls."""
+        gray = self.grays[self.next_gray]
+        self.next_gray = (self.next_gray + 1) % len(self.grays)
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    def mirror_points(self, points):
+        """(x, y) pixels of the frame of the pipeline in the mirrored frame, None points being kept as is."""
+        if self.mirror:
+            return points
+        return tuple((self.width - 1 - p[0], p[1]) if p is not None else None for p in points)
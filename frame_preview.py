@@ -0,0 +1,168 @@
+"""
+Preview of the camera pipelines in a separate process, at a capped rate.
+
+Drawing the detections and showing the frame with imshow/waitKey on every frame costs the detection loop several
+milliseconds per frame, for a window nobody watches during a game. The camera pipelines (FaceTracking, QRDetector) take
+a preview mode:
+    - 'window': the frame is annotated and shown by the loop itself, on every frame (the historical behaviour),
+    - 'process': a PreviewProcess shows the frame at PREVIEW_RATE frames per second at most. When a preview is due, the
+      loop copies the frame and the shapes to draw (polygons and points) into shared memory; the drawing and the GUI
+      run in the other process,
+    - None: headless, no annotation and no GUI at all.
+
+The shared memory holds a header, the shapes and the frame. The header is a seqlock: the writer makes the sequence odd
+while it writes and even once done, the reader keeps a copy only if the sequence was the same even number before and
+after copying. The reader never blocks the writer.
+
+    preview = PreviewProcess('Face tracking', (480, 640, 3)).start()
+    if preview.due():
+        preview.publish(frame_bgr, [(corners, (0, 0, 255))], points)
+    if preview.quit_requested():  # Esc or q in the window
+        ...
+    preview.close()
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+PREVIEW_MODES = ('window', 'process', None)
+PREVIEW_RATE = 10  # Frames per second at most
+MAX_POLYGONS = 16
+MAX_POINTS = 64
+
+# Header slots (int64)
+SEQUENCE, POLYGONS, POINTS, QUIT, STOP = range(5)
+HEADER_SIZE = 8 * 8
+
+
+def preview_layout(shape):
+    """Offsets and size of the shared memory of a frame of shape (height, width, 3)."""
+    polygons = HEADER_SIZE
+    colors = polygons + MAX_POLYGONS * 4 * 2 * 4  # 4 corners of int32 (x, y)
+    points = colors + MAX_POLYGONS * 3 * 4
+    frame = points + MAX_POINTS * 2 * 4
+    return polygons, colors, points, frame, frame + int(np.prod(shape))
+
+
+class SharedPreview:
+    """Numpy views on the shared memory of a preview."""
+
+    def __init__(self, shm, shape):
+        polygons, colors, points, frame, _ = preview_layout(shape)
+        self.shm = shm
+        self.header = np.ndarray((8,), np.int64, shm.buf, 0)
+        self.polygons = np.ndarray((MAX_POLYGONS, 4, 2), np.int32, shm.buf, polygons)
+        self.colors = np.ndarray((MAX_POLYGONS, 3), np.int32, shm.buf, colors)
+        self.points = np.ndarray((MAX_POINTS, 2), np.int32, shm.buf, points)
+        self.frame = np.ndarray(shape, np.uint8, shm.buf, frame)
+
+    def release(self):
+        # The views must be gone before the shared memory is closed
+        del self.header, self.polygons, self.colors, self.points, self.frame
+        self.shm.close()
+
+
+def draw_shapes(frame, polygons, points):
+    """Draw (corners, bgr color) polygons and (x, y) points on frame, return it."""
+    import cv2
+
+    for corners, color in polygons:
+        cv2.polylines(frame, [np.asarray(corners, np.int32)], True, tuple(int(c) for c in color), 3)
+    for point in points:
+        cv2.circle(frame, (int(point[0]), int(point[1])), 2, (0, 255, 0), 2)
+    return frame
+
+
+def run_preview(name, shape, window_name, rate):
+    """Body of the preview process."""
+    import cv2
+
+    shared = SharedPreview(shared_memory.SharedMemory(name=name), shape)
+    frame = np.empty(shape, np.uint8)
+    shown = 0
+    try:
+        while not shared.header[STOP]:
+            sequence = int(shared.header[SEQUENCE])
+            if sequence != shown and not sequence & 1:
+                np.copyto(frame, shared.frame)
+                polygons = shared.polygons[:shared.header[POLYGONS]].copy()
+                colors = shared.colors[:shared.header[POLYGONS]].copy()
+                points = shared.points[:shared.header[POINTS]].copy()
+                if shared.header[SEQUENCE] == sequence:
+                    shown = sequence
+                    cv2.imshow(window_name, draw_shapes(frame, zip(polygons, colors), points))
+            key = cv2.waitKey(max(1, int(1000 / rate))) & 0xFF
+            if key in (27, ord('q')):
+                shared.header[QUIT] = 1
+        cv2.destroyWindow(window_name)
+    finally:
+        shared.release()
+
+
+class PreviewProcess:
+
+    def __init__(self, window_name, shape, rate=PREVIEW_RATE):
+        """shape is the (height, width, 3) of the BGR frames."""
+        self.window_name = window_name
+        self.shape = tuple(shape)
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.published = 0
+        self.shm = shared_memory.SharedMemory(create=True, size=preview_layout(self.shape)[-1])
+        self.shared = SharedPreview(self.shm, self.shape)
+        self.shared.header[:] = 0
+        self.process = multiprocessing.Process(target=run_preview, name='preview',
+                                               args=(self.shm.name, self.shape, window_name, rate), daemon=True)
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def due(self, now=None):
+        """True when a frame should be published, to skip the preparation of the shapes otherwise."""
+        return (time.monotonic() if now is None else now) >= self.next_time
+
+    def publish(self, frame, polygons=(), points=()):
+        """
+        Copy a BGR frame and its shapes to the preview: polygons is a list of (corners, bgr color), corners being 4
+        (x, y) pixels, points a list of (x, y) pixels. Nothing is done when no preview is due.
+        """
+        now = time.monotonic()
+        if not self.due(now) or frame.shape != self.shape:
+            return False
+        self.next_time = now + self.interval
+        shared = self.shared
+        polygons = polygons[:MAX_POLYGONS]
+        points = points[:MAX_POINTS]
+        shared.header[SEQUENCE] += 1  # Odd: being written
+        np.copyto(shared.frame, frame)
+        for i, (corners, color) in enumerate(polygons):
+            shared.polygons[i] = corners
+            shared.colors[i] = color
+        if len(points):
+            shared.points[:len(points)] = points
+        shared.header[POLYGONS] = len(polygons)
+        shared.header[POINTS] = len(points)
+        shared.header[SEQUENCE] += 1
+        self.published += 1
+        return True
+
+    def quit_requested(self):
+        return bool(self.shared.header[QUIT])
+
+    def close(self):
+        self.shared.header[STOP] = 1
+        if self.process.is_alive():
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.shared.release()
+        self.shm.unlink()
+
+
+def box_corners(x, y, width, height):
+    """Corners of a box, for PreviewProcess.publish."""
+    return [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
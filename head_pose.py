@@ -0,0 +1,123 @@
+"""
+Head pose stage of FaceTracking: filtering, latency compensation and game commands.
+
+The 3D position computed from the eyes is noisy (a pixel of keypoint jitter is a few millimetres at 60 cm) and late:
+when it is known, the camera exposure, the capture and the detection are already tens of milliseconds old.
+
+HeadPoseFilter filters each axis with a constant velocity Kalman filter (or a One-Euro filter), on the capture times
+of the frames. predict(now) extrapolates the filtered position to now, plus `lead` seconds for the latency after the
+tracker, which hides the latency of the pipeline. FaceTracking runs the prediction at OUTPUT_RATE, faster than the
+detections, so the commands follow the head between two frames. The pose is considered lost MAX_PREDICTION seconds
+after the last frame with a face.
+
+HeadCommands turns the pose into commands, each threshold having a hysteresis band so that the noise around a
+threshold doesn't press and release the key on every frame:
+    - LOOKBACK while the head is more than LOOK_THRESHOLD cm left or right of the camera axis,
+    - BRAKE while the head is closer than BRAKE_DISTANCE cm to the camera.
+"""
+import threading
+import time
+
+from signal_filters import EmaFilter, Hysteresis, KalmanFilter, OneEuroFilter
+
+POSE_FILTERS = ('kalman', 'one_euro', None)
+OUTPUT_RATE = 60  # Hz
+MAX_PREDICTION = 0.25  # Seconds without face after which the pose is not predicted anymore
+KALMAN_ACCELERATION = 300.0  # cm/s^2, changes of speed of the head
+KALMAN_NOISE = (1.0, 1.0, 3.0)  # cm, noise of x, y and z (z comes from the distance between the eyes, the noisiest)
+ONE_EURO_MIN_CUTOFF = 1.0  # Hz
+ONE_EURO_BETA = 0.05
+
+LOOK_THRESHOLD = 10.0  # cm
+LOOK_BAND = 2.0  # cm, released below LOOK_THRESHOLD - LOOK_BAND
+BRAKE_DISTANCE = 30.0  # cm
+BRAKE_BAND = 3.0  # cm, released beyond BRAKE_DISTANCE + BRAKE_BAND
+
+
+class HeadPoseFilter:
+
+    def __init__(self, kind='kalman', lead=0.0, max_prediction=MAX_PREDICTION):
+        """kind: 'kalman' or 'one_euro', lead: seconds predicted beyond now."""
+        if kind == 'kalman':
+            self.filters = [KalmanFilter(KALMAN_ACCELERATION, noise) for noise in KALMAN_NOISE]
+        elif kind == 'one_euro':
+            self.filters = [OneEuroFilter(ONE_EURO_MIN_CUTOFF, ONE_EURO_BETA) for _ in range(3)]
+        else:
+            raise ValueError("Unknown pose filter " + str(kind))
+        self.kind = kind
+        self.lead = lead
+        self.max_prediction = int(max_prediction * 1e9)
+        self.lock = threading.Lock()
+        self.stamp = None  # Capture time (ns) of the last frame with a face
+        self.latency = EmaFilter(1.0)  # Seconds between the capture of a frame and its pose
+        self.measures = 0
+
+    def measure(self, stamp, position, now=None):
+        """Add the position (x, y, z) of the frame captured at stamp (monotonic ns)."""
+        now = time.monotonic_ns() if now is None else now
+        t = stamp / 1e9
+        with self.lock:
+            for f, value in zip(self.filters, position):
+                f.update(t, value)
+            self.stamp = stamp
+            self.latency.update(now / 1e9, (now - stamp) / 1e9)
+            self.measures += 1
+
+    def predict(self, now=None):
+        """Position predicted at now (monotonic ns) + lead, None when the face was lost."""
+        now = time.monotonic_ns() if now is None else now
+        with self.lock:
+            if self.stamp is None or now - self.stamp > self.max_prediction:
+                return None
+            t = now / 1e9 + self.lead
+            return tuple(f.predict(t) for f in self.filters)
+
+    def reset(self):
+        """Forget the pose, for a new face."""
+        with self.lock:
+            for f in self.filters:
+                f.reset()
+            self.stamp = None
+
+    def stats(self):
+        return {
+            'filter': self.kind,
+            'measures': self.measures,
+            'latency_ms': 1000 * self.latency.value if self.latency.value is not None else 0.0,
+        }
+
+
+class HeadCommands:
+
+    def __init__(self, send, look_threshold=LOOK_THRESHOLD, look_band=LOOK_BAND, brake_distance=BRAKE_DISTANCE,
+                 brake_band=BRAKE_BAND):
+        """send(command, stamp) sends a command, stamp being the capture time of the frame it comes from."""
+        self.send = send
+        self.look = Hysteresis(look_threshold, look_threshold - look_band)
+        self.brake = Hysteresis(brake_distance, brake_distance + brake_band)
+        self.looking = False
+        self.braking = False
+        self.sent = 0
+
+    def update(self, position, stamp=None):
+        x, y, z = position
+        t = stamp / 1e9 if stamp is not None else 0.0
+        looking = self.look.update(t, abs(x))
+        if looking != self.looking:
+            self.looking = looking
+            self.sent += 1
+            self.send("P_LOOKBACK" if looking else "R_LOOKBACK", stamp)
+        braking = self.brake.update(t, z)
+        if braking != self.braking:
+            self.braking = braking
+            self.sent += 1
+            self.send("P_BRAKE" if braking else "R_BRAKE", stamp)
+
+    def release(self, stamp=None):
+        """Release the held commands."""
+        if self.looking:
+            self.looking = self.look.state = False
+            self.send("R_LOOKBACK", stamp)
+        if self.braking:
+            self.braking = self.brake.state = False
+            self.send("R_BRAKE", stamp)
@@ -0,0 +1,99 @@
+"""
+Key state arbitration for the STK_input_server.
+
+Several producers can drive the same key (P_NITRO comes from the OSC pad and from the QR codes, P_DOWN and P_BRAKE
+are both mapped on 'down'...). The table keeps, for each key, the set of holders currently pressing it, a holder being
+a (source id, opcode) pair. Only the real transitions reach the OS: the key is pressed when its first holder arrives and
+released when its last holder leaves. Duplicate presses, releases of a key held by someone else and taps on a held key
+are counted and dropped, as the commands with unknown flags.
+"""
+import threading
+
+from stk_protocol import PRESS, RELEASE, TAP
+
+
+class KeyCounters:
+    __slots__ = ('presses', 'releases', 'taps', 'os_presses', 'os_releases', 'os_taps', 'suppressed', 'invalid')
+
+    def __init__(self):
+        self.presses = 0  # Press commands received
+        self.releases = 0  # Release commands received
+        self.taps = 0  # Press and release commands received
+        self.os_presses = 0  # Presses forwarded to the OS
+        self.os_releases = 0  # Releases forwarded to the OS
+        self.os_taps = 0  # Taps forwarded to the OS
+        self.suppressed = 0  # Commands that didn't change the key state
+        self.invalid = 0  # Commands with unknown flags, dropped
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class KeyStateTable:
+
+    def __init__(self, backend):
+        """backend is an output_backends.OutputBackend (press(key), release(key) and press_and_release(key))."""
+        self.backend = backend
+        self.holders = {}  # key -> set of holders pressing it
+        self.counters = {}  # key -> KeyCounters
+        self.lock = threading.Lock()
+
+    def _counters(self, key):
+        counters = self.counters.get(key)
+        if counters is None:
+            counters = self.counters[key] = KeyCounters()
+        return counters
+
+    def apply(self, key, flags, holder):
+        """Apply a command on a key, return True if it was forwarded to the OS."""
+        with self.lock:
+            counters = self._counters(key)
+            holders = self.holders.get(key)
+
+            if flags == PRESS:
+                counters.presses += 1
+                if holders is None:
+                    self.holders[key] = {holder}
+                    counters.os_presses += 1
+                    self.backend.press(key)
+                    return True
+                holders.add(holder)
+
+            elif flags == RELEASE:
+                counters.releases += 1
+                if holders is not None and holder in holders:
+                    holders.discard(holder)
+                    if not holders:
+                        del self.holders[key]
+                        counters.os_releases += 1
+                        self.backend.release(key)
+                        return True
+
+            elif flags == TAP:
+                counters.taps += 1
+                if holders is None:
+                    counters.os_taps += 1
+                    self.backend.press_and_release(key)
+                    return True
+
+            else:
+                counters.invalid += 1
+                return False
+
+            counters.suppressed += 1
+            return False
+
+    def is_pressed(self, key):
+        return key in self.holders
+
+    def release_all(self):
+        """Release every key still held, used when the server stops."""
+        with self.lock:
+            for key in list(self.holders):
+                del self.holders[key]
+                self._counters(key).os_releases += 1
+                self.backend.release(key)
+
+    def stats(self):
+        with self.lock:
+            return {key: counters.as_dict() for key, counters in self.counters.items()}
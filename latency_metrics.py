@@ -0,0 +1,244 @@
+"""
+Latency and traffic metrics of the input pipeline, served in the Prometheus text format.
+
+Producers stamp every command with the monotonic time of the sensor sample it comes from (camera frame, OSC message,
+serial line, audio block). The consumer (STK_input_server or GamepadController) records, once the key or gamepad event
+is done, the elapsed time in a histogram per (source, command). time.monotonic_ns() is a system wide clock, so the
+stamps of the producers running in other processes of the same host can be compared with it.
+
+    registry = MetricsRegistry()
+    MetricsServer(registry, 9108).start()
+    ...
+    registry.record_latency('osc', 'P_LEFT', stamp)
+
+curl http://127.0.0.1:9108/metrics then gives the p50/p90/p99/p999 of each modality.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram in the spirit of HdrHistogram: values (in microseconds) below 128 have their own bucket,
+    above that every power of two is split in 64 buckets, so the relative error stays below 1.6% whatever the value.
+    Recording is O(1) and does not allocate.
+    """
+    SUB_BITS = 7
+    HALF = 1 << (SUB_BITS - 1)
+    MAX_VALUE = 60 * 1000 * 1000  # 60 s, bigger values are clamped
+
+    def __init__(self):
+        self.counts = [0] * (self.index_of(self.MAX_VALUE) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def index_of(cls, value):
+        shift = value.bit_length() - cls.SUB_BITS
+        if shift <= 0:
+            return value
+        return (shift << (cls.SUB_BITS - 1)) + (value >> shift)
+
+    @classmethod
+    def value_of(cls, index):
+        """Highest value stored in a bucket."""
+        if index < 2 * cls.HALF:
+            return index
+        shift = (index >> (cls.SUB_BITS - 1)) - 1
+        return ((index - (shift << (cls.SUB_BITS - 1)) + 1) << shift) - 1
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        elif value > self.MAX_VALUE:
+            value = self.MAX_VALUE
+        self.counts[self.index_of(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.value_of(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class RateMeter:
+    """Events per second over the last complete second."""
+
+    def __init__(self):
+        self.total = 0
+        self.second = int(time.monotonic())
+        self.current = 0
+        self.last = 0
+
+    def tick(self, now=None):
+        second = int(time.monotonic() if now is None else now)
+        if second != self.second:
+            self.last = self.current if second == self.second + 1 else 0
+            self.current = 0
+            self.second = second
+        self.current += 1
+        self.total += 1
+
+    def rate(self, now=None):
+        second = int(time.monotonic() if now is None else now)
+        if second == self.second:
+            return self.last
+        if second == self.second + 1:
+            return self.current
+        return 0
+
+
+def read_udp_drops(ports, files=('/proc/net/udp', '/proc/net/udp6')):
+    """Return {port: (drops, rx_queue bytes)} for the local UDP ports, empty when /proc/net/udp does not exist."""
+    result = {}
+    for path in files:
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 13:
+                continue
+            port = int(fields[1].rsplit(':', 1)[1], 16)
+            if port not in ports:
+                continue
+            rx_queue = int(fields[4].split(':')[1], 16)
+            drops = int(fields[12])
+            old_drops, old_queue = result.get(port, (0, 0))
+            result[port] = (old_drops + drops, old_queue + rx_queue)
+    return result
+
+
+def _labels(**labels):
+    return '{' + ','.join(name + '="' + str(value).replace('"', '\\"') + '"'
+                          for name, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix='stk'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.latencies = {}  # (source, command) -> LatencyHistogram
+        self.packets = {}  # source -> RateMeter
+        self.udp_ports = set()
+        self.collectors = []
+
+    def count_packet(self, source):
+        with self.lock:
+            meter = self.packets.get(source)
+            if meter is None:
+                meter = self.packets[source] = RateMeter()
+            meter.tick()
+
+    def record_latency(self, source, command, stamp_ns, now_ns=None):
+        """Record the time elapsed since the capture stamp of a command."""
+        if not stamp_ns:
+            return
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        with self.lock:
+            histogram = self.latencies.get((source, command))
+            if histogram is None:
+                histogram = self.latencies[(source, command)] = LatencyHistogram()
+            histogram.record((now_ns - stamp_ns) // 1000)
+
+    def watch_udp_ports(self, ports):
+        self.udp_ports.update(ports)
+
+    def add_collector(self, collector):
+        """collector() returns extra lines in the Prometheus text format."""
+        self.collectors.append(collector)
+
+    def render(self):
+        p = self.prefix
+        lines = []
+        with self.lock:
+            lines.append('# HELP ' + p + '_latency_seconds Time from the sensor sample to the input event.')
+            lines.append('# TYPE ' + p + '_latency_seconds summary')
+            for (source, command), h in sorted(self.latencies.items()):
+                for q in QUANTILES:
+                    lines.append(p + '_latency_seconds' + _labels(source=source, command=command, quantile=q) + ' '
+                                 + repr(h.quantile(q) / 1e6))
+                labels = _labels(source=source, command=command)
+                lines.append(p + '_latency_seconds_sum' + labels + ' ' + repr(h.total / 1e6))
+                lines.append(p + '_latency_seconds_count' + labels + ' ' + str(h.count))
+
+            lines.append('# HELP ' + p + '_packets_total Datagrams received.')
+            lines.append('# TYPE ' + p + '_packets_total counter')
+            for source, meter in sorted(self.packets.items()):
+                lines.append(p + '_packets_total' + _labels(source=source) + ' ' + str(meter.total))
+            lines.append('# HELP ' + p + '_packets_per_second Datagrams received during the last second.')
+            lines.append('# TYPE ' + p + '_packets_per_second gauge')
+            for source, meter in sorted(self.packets.items()):
+                lines.append(p + '_packets_per_second' + _labels(source=source) + ' ' + str(meter.rate()))
+
+        if self.udp_ports:
+            drops = read_udp_drops(self.udp_ports)
+            lines.append('# HELP ' + p + '_udp_drops_total Datagrams dropped by the kernel on a socket.')
+            lines.append('# TYPE ' + p + '_udp_drops_total counter')
+            for port, (dropped, _) in sorted(drops.items()):
+                lines.append(p + '_udp_drops_total' + _labels(port=port) + ' ' + str(dropped))
+            lines.append('# HELP ' + p + '_udp_rx_queue_bytes Bytes waiting in the receive buffer of a socket.')
+            lines.append('# TYPE ' + p + '_udp_rx_queue_bytes gauge')
+            for port, (_, queued) in sorted(drops.items()):
+                lines.append(p + '_udp_rx_queue_bytes' + _labels(port=port) + ' ' + str(queued))
+
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves the registry on http://address:port/metrics from a background thread."""
+
+    def __init__(self, registry, port=9108, address='127.0.0.1'):
+        self.registry = registry
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((address, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        print("Metrics available on http://" + self.httpd.server_address[0] + ":"
+              + str(self.httpd.server_address[1]) + "/metrics")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,4 +1,7 @@
+import sys
 from arduino_ultrasound_reader import ArduinoUltrasoundReader
+import STK_input_server
+from stk_protocol import SOURCE_ARDUINO
 
 
 def main_arduino():
@@ -6,10 +9,21 @@ def main_arduino():
     server_address = 'localhost'  # TODO change this when running on different machines
     arduino_port = 6009
 
-    arduino_ultrasound_reader = ArduinoUltrasoundReader(server_address, arduino_port)
+    # -local: the STK_input_server runs in this process too and the commands skip the localhost UDP hop, unless
+    # another launcher already runs it
+    input_server = None
+    arduino_sender = None
+    if '-local' in sys.argv:
+        input_server, (arduino_sender,) = STK_input_server.start_local(SOURCE_ARDUINO)
+
+    arduino_ultrasound_reader = ArduinoUltrasoundReader(server_address, arduino_port, sender=arduino_sender)
 
     port = "COM3"
-    arduino_ultrasound_reader.read_ultrasound_data(port)
+    try:
+        arduino_ultrasound_reader.read_ultrasound_data(port)
+    finally:
+        if input_server is not None:
+            STK_input_server.stop_in_process(input_server)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,21 @@
+import sys
 from osc_server import OSCServer
 from time import sleep
 from face_tracking import FaceTracking
+import STK_input_server
+from stk_protocol import SOURCE_OSC, SOURCE_FACE
 
 """
 This file will be launched by the same Computer that will run the game and the STK_input_server.
 He runs the OSCServer and the FaceTracking.
+With -local, the STK_input_server runs in this process too and the commands skip the localhost UDP hop. Only the
+first launcher started with -local runs it, the others send their commands over UDP to that one.
+With -pwm, the steering and acceleration angles are played as pulse width modulated keys instead of thresholds.
+With -headless, the face tracking shows no window; with -preview, it is shown by another process at a low rate.
+With -roi, the face is detected on a region around the last face and followed by optical flow in between.
+With -predict, the head pose is filtered by a Kalman filter and predicted at 60 Hz to hide the tracking latency.
+With -video, the faces are detected synchronously (MediaPipe VIDEO mode) instead of asynchronously, for comparison.
+With -players N, N faces are followed, each one driving its own player of the multiplayer_server (face ports).
 """
 
 
@@ -24,10 +35,22 @@ def main_osc_face():
     # Validate and convert input to a boolean
     is_collab = user_input == "c"
 
-    osc_server = OSCServer(is_collab, server_address, osc_port)
+    input_server = None
+    osc_sender = face_sender = None
+    if '-local' in sys.argv:
+        input_server, (osc_sender, face_sender) = STK_input_server.start_local(SOURCE_OSC, SOURCE_FACE)
+
+    control = 'pwm' if '-pwm' in sys.argv else 'threshold'
+    osc_server = OSCServer(is_collab, server_address, osc_port, sender=osc_sender, control=control)
 
     if is_collab:
-        tracker = FaceTracking(server_address, face_port)
+        preview = None if '-headless' in sys.argv else 'process' if '-preview' in sys.argv else 'window'
+        tracking = 'roi' if '-roi' in sys.argv else 'full'
+        pose_filter = 'kalman' if '-predict' in sys.argv else None
+        detection = 'video' if '-video' in sys.argv else 'live'
+        players = int(sys.argv[sys.argv.index('-players') + 1]) if '-players' in sys.argv else 1
+        tracker = FaceTracking(server_address, face_port, sender=face_sender, preview=preview, tracking=tracking,
+                               pose_filter=pose_filter, detection=detection, players=players)
         tracker.runtracking()
         print("Tracker launched")
 
@@ -37,6 +60,8 @@ def main_osc_face():
         pass
     finally:
         osc_server.stop()
+        if input_server is not None:
+            STK_input_server.stop_in_process(input_server)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
+import sys
 from QRCodeDetection import QRDetector
+import STK_input_server
+from stk_protocol import SOURCE_QR
 #from voiceAction import AudioProcessor
 
 
@@ -12,8 +15,21 @@ def main_voice_qr():
     #audio_processor = AudioProcessor(model_path, server_address, voice_port)
     #audio_processor.run()
 
-    qr_detector = QRDetector(server_address, qr_port)
-    qr_detector.run()
+    # -local: the STK_input_server runs in this process too and the commands skip the localhost UDP hop, unless
+    # another launcher already runs it
+    input_server = None
+    qr_sender = None
+    if '-local' in sys.argv:
+        input_server, (qr_sender,) = STK_input_server.start_local(SOURCE_QR)
+
+    # -headless: no window, -preview: the window is shown by another process at a low rate
+    preview = None if '-headless' in sys.argv else 'process' if '-preview' in sys.argv else 'window'
+    qr_detector = QRDetector(server_address, qr_port, sender=qr_sender, preview=preview)
+    try:
+        qr_detector.run()
+    finally:
+        if input_server is not None:
+            STK_input_server.stop_in_process(input_server)
 
 
 if __name__ == "__main__":
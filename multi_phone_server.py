@@ -0,0 +1,235 @@
+"""
+OSC server for several phones on one host, each phone driving its own player.
+
+A single OSCServer keeps one set of sensor state (filters, held keys, nitro, shake detector...), so two phones sending
+to it mix their values. MultiPhoneServer reads the port with an osc_frames.OSCFrameServer, whose frames carry the
+address of their sender, and keeps a PhoneState per sender (ip, port): an OSCServer without socket whose callbacks get
+the frames of that phone only. The first frame of a new phone claims the first free player, and its commands are sent
+to the OSC port of that player in the multiplayer_server layout (multiplayer_server.player_address). A phone silent for
+idle_timeout seconds has its keys released and its player freed.
+
+One process reads the datagrams of every phone and runs their callbacks under the same GIL. With workers > 1, the
+workers are separate processes listening on the same port with SO_REUSEPORT (Linux, BSD, macOS): the kernel hashes the
+address of the sender to pick a socket, so a phone always reaches the same worker and its state is never shared. The
+players are claimed in an array shared by the workers.
+
+Run from the root of the project, with multiplayer_server.py serving the players:
+    python multi_phone_server.py -players 4
+    python multi_phone_server.py -players 8 -workers 4 -p -pwm
+"""
+import argparse
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+
+import stk_protocol
+from multiplayer_server import BASE_PORT, player_address
+from osc_frames import OSCFrameServer
+from osc_server import OSCServer, COLLAB_ADDRESSES, PERF_ADDRESSES, CONTROL_MODE
+
+OSC_PORT = 8000
+IDLE_TIMEOUT = 10.0  # Seconds without message before a phone frees its player
+SWEEP_PERIOD = 1.0  # Seconds between two checks of the idle phones
+
+
+def sender_key(sender):
+    """(ip, port) as an integer, the same in every process (unlike hash())."""
+    ip, port = sender[:2]
+    return int.from_bytes(socket.inet_aton(ip), 'big') << 16 | port
+
+
+class PlayerAllocator:
+    """Players claimed by the phones, slots being a multiprocessing.Array('q') to share them between processes."""
+
+    def __init__(self, players=4, slots=None):
+        self.slots = multiprocessing.Array('q', players) if slots is None else slots  # Key of the phone, 0 if free
+
+    def claim(self, key):
+        """Player of the phone key, None when all the players are taken."""
+        with self.slots.get_lock():
+            free = None
+            for player, owner in enumerate(self.slots):
+                if owner == key:
+                    return player
+                if owner == 0 and free is None:
+                    free = player
+            if free is not None:
+                self.slots[free] = key
+            return free
+
+    def release(self, player, key):
+        with self.slots.get_lock():
+            if self.slots[player] == key:
+                self.slots[player] = 0
+
+
+class PhoneState:
+    """Sensor state and outputs of one phone."""
+
+    def __init__(self, sender, player, server):
+        self.sender = sender
+        self.key = sender_key(sender)
+        self.player = player
+        self.server = server  # OSCServer without socket
+        self.last_seen = time.monotonic()
+        self.frames = 0
+
+
+class MultiPhoneServer:
+
+    def __init__(self, is_collab, players=4, address='0.0.0.0', port=OSC_PORT, base_port=BASE_PORT,
+                 output_host='127.0.0.1', control=CONTROL_MODE, idle_timeout=IDLE_TIMEOUT, reuse_port=False,
+                 allocator=None):
+        """
+        base_port and output_host give the STK_input_server ports of the players (multiplayer_server layout).
+        allocator is the PlayerAllocator shared by the workers, a new one of players players by default.
+        """
+        self.is_collab = is_collab
+        self.base_port = base_port
+        self.output_host = output_host
+        self.control = control
+        self.idle_timeout = idle_timeout
+        self.allocator = PlayerAllocator(players) if allocator is None else allocator
+        self.phones = {}  # sender -> PhoneState
+        self.lock = threading.Lock()
+        self.rejected = 0  # Frames of the phones without free player
+        self.stop_event = threading.Event()
+
+        self.osc = OSCFrameServer(self.handle_frame, address, port, reuse_port=reuse_port)
+        for osc_address in COLLAB_ADDRESSES if is_collab else PERF_ADDRESSES:
+            self.osc.subscribe(osc_address)
+
+    def connect(self, sender):
+        """PhoneState of a new phone, None when all the players are taken."""
+        key = sender_key(sender)
+        player = self.allocator.claim(key)
+        if player is None:
+            return None
+        output = player_address(player, stk_protocol.SOURCE_OSC, self.base_port, self.output_host)
+        server = OSCServer(self.is_collab, output[0], output[1], receiver=None, control=self.control)
+        phone = self.phones[sender] = PhoneState(sender, player, server)
+        print('Phone ' + sender[0] + ':' + str(sender[1]) + ' is player ' + str(player))
+        return phone
+
+    def disconnect(self, phone):
+        del self.phones[phone.sender]
+        phone.server.stop()
+        self.allocator.release(phone.player, phone.key)
+        print('Phone ' + phone.sender[0] + ':' + str(phone.sender[1]) + ' left player ' + str(phone.player))
+
+    def handle_frame(self, frame):
+        with self.lock:
+            phone = self.phones.get(frame.sender)
+            if phone is None:
+                phone = self.connect(frame.sender)
+                if phone is None:
+                    self.rejected += 1
+                    return
+            phone.last_seen = time.monotonic()
+            phone.frames += 1
+            phone.server.handle_frame(frame)
+
+    def sweep(self, now=None):
+        """Disconnect the phones silent for idle_timeout seconds."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for phone in [p for p in self.phones.values() if now - p.last_seen > self.idle_timeout]:
+                self.disconnect(phone)
+
+    def serve_forever(self, stop=None):
+        """Sweep the idle phones until stop() is called or stop(), a callable, returns True."""
+        while not self.stop_event.wait(SWEEP_PERIOD):
+            self.sweep()
+            if stop is not None and stop():
+                break
+
+    def stop(self):
+        self.stop_event.set()
+        self.osc.stop()
+        with self.lock:
+            for phone in list(self.phones.values()):
+                self.disconnect(phone)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'phones': {phone.sender[0] + ':' + str(phone.sender[1]): {'player': phone.player,
+                                                                            'frames': phone.frames}
+                           for phone in self.phones.values()},
+                'rejected': self.rejected,
+                'dropped': self.osc.dropped,
+            }
+
+
+def run_worker(worker, conn, slots, options):
+    """Body of a worker process, serving the phones the kernel gives to its socket until the parent writes on conn."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = MultiPhoneServer(reuse_port=True, allocator=PlayerAllocator(slots=slots), **options)
+    print('Worker ' + str(worker) + ' listening')
+    try:
+        server.serve_forever(conn.poll)
+    finally:
+        server.stop()
+
+
+def start_workers(workers, players=4, **options):
+    """Start workers processes sharing the OSC port, return their (process, conn)."""
+    slots = multiprocessing.Array('q', players)
+    started = []
+    for worker in range(workers):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_worker, name='osc-worker-' + str(worker),
+                                          args=(worker, child_conn, slots, options), daemon=True)
+        process.start()
+        child_conn.close()
+        started.append((process, conn))
+    return started
+
+
+def stop_workers(started, timeout=5.0):
+    for process, conn in started:
+        try:
+            conn.send('stop')
+        except OSError:
+            pass  # The worker is already gone
+    for process, conn in started:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OSC server for several phones, one player per phone")
+    parser.add_argument('-players', type=int, default=4)
+    parser.add_argument('-workers', type=int, default=1, help="processes sharing the port with SO_REUSEPORT")
+    parser.add_argument('-port', type=int, default=OSC_PORT, help="OSC port the phones send to")
+    parser.add_argument('-base', type=int, default=BASE_PORT, help="first port of player 0 (multiplayer_server)")
+    parser.add_argument('-output', default='127.0.0.1', help="host of the multiplayer_server")
+    parser.add_argument('-p', dest='perf', action='store_true', help="performance mode (collaboration by default)")
+    parser.add_argument('-pwm', action='store_true', help="pulse width modulated steering and acceleration")
+    parser.add_argument('-idle', type=float, default=IDLE_TIMEOUT, help="seconds before a silent phone is dropped")
+    args = parser.parse_args()
+
+    options = {'is_collab': not args.perf, 'port': args.port, 'base_port': args.base, 'output_host': args.output,
+               'control': 'pwm' if args.pwm else 'threshold', 'idle_timeout': args.idle}
+    if args.workers > 1:
+        workers = start_workers(args.workers, args.players, **options)
+        try:
+            while any(process.is_alive() for process, _ in workers):
+                time.sleep(SWEEP_PERIOD)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop_workers(workers)
+    else:
+        server = MultiPhoneServer(players=args.players, **options)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+    print('Multi-phone OSC server stopped')
@@ -0,0 +1,214 @@
+"""
+Multi-player mode of the STK_input_server: one set of producer ports and one output device per player.
+
+Player i listens on base_port + i * PORT_STRIDE + k, k being the offset of the producer in PLAYER_SOURCES:
+
+    player 0: 6100 OSC, 6101 QR code, 6102 voice, 6103 arduino, 6104 face tracking
+    player 1: 6110 OSC, 6111 QR code, ...
+
+and drives its own output backend, a separate virtual gamepad by default (one GamepadController, so one vgamepad
+device, per player). The players are sharded across worker processes, one player per shard by default, so the burst of
+a player is handled by another interpreter and can't add latency to the others. Each shard runs one STKInputServer per
+player in its own thread.
+
+The ShardSupervisor starts the shards, watches them and restarts a shard that died (crash, output device lost...) after
+restart_delay seconds, at most max_restarts times. A shard whose players all received STOPSERVEUR exits normally and is
+not restarted.
+
+Run from the root of the project:
+    python multiplayer_server.py -players 4
+    python multiplayer_server.py -players 4 -shards 2 -backend null -d
+"""
+import argparse
+import multiprocessing
+import signal
+import threading
+import time
+
+import STK_input_server
+import stk_protocol
+from latency_metrics import MetricsRegistry, MetricsServer
+from output_backends import BACKENDS, create_backend
+from rate_limit import CommandScheduler
+
+BASE_PORT = 6100
+PORT_STRIDE = 10  # Ports reserved for each player
+PLAYER_SOURCES = (stk_protocol.SOURCE_OSC, stk_protocol.SOURCE_QR, stk_protocol.SOURCE_VOICE,
+                  stk_protocol.SOURCE_ARDUINO, stk_protocol.SOURCE_FACE)
+MONITOR_PERIOD = 0.5  # Seconds between two checks of the shards
+
+
+def player_addresses(player, base_port=BASE_PORT, host='0.0.0.0'):
+    """Addresses of the producer ports of a player, in the order of PLAYER_SOURCES."""
+    first = base_port + player * PORT_STRIDE
+    return [(host, first + offset) for offset in range(len(PLAYER_SOURCES))]
+
+
+def player_address(player, source, base_port=BASE_PORT, host='127.0.0.1'):
+    """Address a producer of a player sends its commands to."""
+    return host, base_port + player * PORT_STRIDE + PLAYER_SOURCES.index(source)
+
+
+def split_players(players, shards):
+    """Players served by each shard, spread round robin."""
+    return [list(range(players))[shard::shards] for shard in range(shards)]
+
+
+def run_shard(shard, players, conn, base_port=BASE_PORT, host='0.0.0.0', backend='gamepad', metrics_port=0,
+              rate=STK_input_server.RATE_LIMIT, burst=STK_input_server.RATE_BURST, debug=False):
+    """Body of a shard process: serve the players until the supervisor writes on conn or all of them are stopped."""
+    # Ctrl+C is handled by the supervisor, which stops the shards through their pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    STK_input_server.DEBUG = debug
+
+    servers = []
+    metrics_servers = []
+    try:
+        for player in players:
+            metrics = MetricsRegistry() if metrics_port else None
+            scheduler = CommandScheduler(rate, burst, keys=STK_input_server.key_table) if rate else None
+            server = STK_input_server.STKInputServer(player_addresses(player, base_port, host),
+                                                     _sources=list(PLAYER_SOURCES),
+                                                     key_backend=create_backend(backend), metrics=metrics,
+                                                     scheduler=scheduler)
+            servers.append(server)
+            if metrics_port:
+                metrics_servers.append(MetricsServer(metrics, metrics_port + player).start())
+
+        threads = [threading.Thread(target=server.serve_forever, name='player-' + str(player))
+                   for player, server in zip(players, servers)]
+        for thread in threads:
+            thread.start()
+        print('Shard ' + str(shard) + ' serving players ' + ', '.join(str(p) for p in players))
+
+        while not conn.poll(MONITOR_PERIOD):
+            if not any(thread.is_alive() for thread in threads):
+                break
+
+        for server in servers:
+            server.stop()
+        for thread in threads:
+            thread.join()
+    finally:
+        for server in servers:
+            server.close()
+        for metrics_server in metrics_servers:
+            metrics_server.stop()
+
+
+class ShardSupervisor:
+
+    def __init__(self, players=4, shards=None, base_port=BASE_PORT, host='0.0.0.0', backend='gamepad',
+                 metrics_port=0, rate=STK_input_server.RATE_LIMIT, burst=STK_input_server.RATE_BURST, debug=False,
+                 restart_delay=1.0, max_restarts=5):
+        """shards defaults to one shard per player. metrics_port + player is the metrics port of each player."""
+        self.assignments = split_players(players, min(shards or players, players))
+        self.options = {'base_port': base_port, 'host': host, 'backend': backend, 'metrics_port': metrics_port,
+                        'rate': rate, 'burst': burst, 'debug': debug}
+        self.restart_delay = restart_delay
+        self.max_restarts = max_restarts
+        self.stop_event = threading.Event()
+        self.processes = [None] * len(self.assignments)
+        self.conns = [None] * len(self.assignments)
+        self.restarts = [0] * len(self.assignments)
+        self.restart_at = [None] * len(self.assignments)
+
+    def start_shard(self, shard):
+        # A pipe per shard rather than a multiprocessing.Event: a shard killed while waiting on the event would
+        # deadlock the supervisor setting it
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_shard, name='stk-shard-' + str(shard),
+                                          args=(shard, self.assignments[shard], child_conn),
+                                          kwargs=self.options, daemon=True)
+        process.start()
+        child_conn.close()
+        if self.conns[shard] is not None:
+            self.conns[shard].close()
+        self.processes[shard] = process
+        self.conns[shard] = conn
+        self.restart_at[shard] = None
+
+    def start(self):
+        for shard in range(len(self.assignments)):
+            self.start_shard(shard)
+        return self
+
+    def check(self, now=None):
+        """Restart the shards that died, return the number of shards still running or waiting for a restart."""
+        now = time.monotonic() if now is None else now
+        running = 0
+        for shard, process in enumerate(self.processes):
+            if process is None:
+                continue
+            if process.is_alive():
+                running += 1
+                continue
+
+            if process.exitcode == 0 or self.stop_event.is_set():
+                # All the players of the shard were stopped
+                self.processes[shard] = None
+                continue
+            if self.restarts[shard] >= self.max_restarts:
+                print(STK_input_server.RED + 'Shard ' + str(shard) + ' died (exit code ' + str(process.exitcode)
+                      + '), too many restarts' + STK_input_server.WHITE)
+                self.processes[shard] = None
+                continue
+
+            running += 1
+            if self.restart_at[shard] is None:
+                print(STK_input_server.YELLOW + 'Shard ' + str(shard) + ' died (exit code ' + str(process.exitcode)
+                      + '), restarting it' + STK_input_server.WHITE)
+                self.restart_at[shard] = now + self.restart_delay
+            elif now >= self.restart_at[shard]:
+                self.restarts[shard] += 1
+                self.start_shard(shard)
+        return running
+
+    def monitor(self):
+        """Watch the shards until all of them are stopped or stop() is called."""
+        while not self.stop_event.wait(MONITOR_PERIOD):
+            if not self.check():
+                break
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        for process, conn in zip(self.processes, self.conns):
+            if process is None:
+                continue
+            try:
+                conn.send('stop')
+            except OSError:
+                pass  # The shard is already gone
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Multi-player STK input server, one output device per player")
+    parser.add_argument('-players', type=int, default=4)
+    parser.add_argument('-shards', type=int, default=None, help="worker processes (one per player by default)")
+    parser.add_argument('-base', type=int, default=BASE_PORT, help="first port of player 0")
+    parser.add_argument('-host', default='0.0.0.0')
+    parser.add_argument('-backend', default='gamepad', choices=BACKENDS)
+    parser.add_argument('-metrics', type=int, default=0, help="metrics port of player 0, the next players follow")
+    parser.add_argument('-rate', type=float, default=STK_input_server.RATE_LIMIT)
+    parser.add_argument('-burst', type=int, default=STK_input_server.RATE_BURST)
+    parser.add_argument('-d', dest='debug', action='store_true')
+    args = parser.parse_args()
+
+    supervisor = ShardSupervisor(args.players, args.shards, args.base, args.host, args.backend, args.metrics,
+                                 args.rate, args.burst, args.debug)
+    for player in range(args.players):
+        ports = [address[1] for address in player_addresses(player, args.base)]
+        print('Player ' + str(player) + ': ports ' + str(ports[0]) + '-' + str(ports[-1]))
+
+    supervisor.start()
+    try:
+        supervisor.monitor()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+    print('STK multi-player server stopped')
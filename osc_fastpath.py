@@ -0,0 +1,175 @@
+"""
+OSC receiver with a fast path for the few float addresses the servers listen to.
+
+oscpy parses every datagram into Python objects (address, type tags, list of values) before looking for a callback.
+FastPathServer receives into a preallocated buffer and compares it, in place, with a precompiled table: for each bound
+address, the encoded address and type tag string (',f', ',ff'...) with their padding. On a match the arguments are read
+with a precompiled struct straight from the buffer and handed to the callback as floats. Anything else (other tags,
+unbound addresses) goes through the generic oscpy parser, then to the callback of its address or to the default
+handler; without default handler the unbound addresses are dropped before being parsed. Bundles are walked element by
+element, each one taking the same fast or generic path. As in OSCThreadServer, an exception raised by a callback is
+counted and printed, and the server keeps receiving.
+
+    server = FastPathServer(port=8000, default_handler=dump)
+    server.bind(b'/multisense/orientation/yaw', callback)  # callback(yaw, stamp=...)
+    ...
+    server.stop()
+
+See benchmarks/bench_osc_decoder.py for the comparison with OSCThreadServer.
+"""
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from oscpy.parser import read_message
+
+BUNDLE = b'#bundle\0'
+BUNDLE_HEADER = 16  # '#bundle\0' and the timetag
+SIZE = struct.Struct('>i')
+MAX_PACKET = 65536
+POLL_TIMEOUT = 0.5  # Seconds between two checks of the stop flag when idle
+
+
+def padded(data):
+    """OSC string: null terminated, padded with nulls to a multiple of 4 bytes."""
+    return data + b'\0' * (4 - len(data) % 4)
+
+
+class FastPathEntry:
+    __slots__ = ('address', 'prefix', 'size', 'arguments', 'callback', 'hits')
+
+    def __init__(self, address, tags, callback):
+        self.address = address
+        self.prefix = padded(address) + padded(b',' + tags)
+        self.arguments = struct.Struct('>' + tags.decode('ascii'))
+        self.size = len(self.prefix) + self.arguments.size  # Size of the whole message
+        self.callback = callback
+        self.hits = 0
+
+
+class FastPathServer:
+
+    def __init__(self, address='0.0.0.0', port=8000, default_handler=None):
+        """default_handler(address, *values) gets the unbound addresses, dropped unparsed when it is None."""
+        self.default_handler = default_handler
+        self.entries = []  # FastPathEntry, most used first
+        self.callbacks = {}  # address -> callback, for the generic path
+        self.packets = 0
+        self.fast = 0  # Messages decoded by the fast path
+        self.generic = 0  # Messages decoded by oscpy
+        self.errors = 0  # Malformed packets
+        self.dropped = 0  # Messages of unbound addresses, without default handler
+        self.callback_errors = 0  # Exceptions raised by the callbacks
+        self.buffer = bytearray(MAX_PACKET)
+        self.view = memoryview(self.buffer)
+        self.stop_event = threading.Event()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((address, port))
+        self.sock.setblocking(False)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def bind(self, address, callback, tags=b'f'):
+        """
+        Call callback(*values, stamp=...) for the messages of address. tags gives the float arguments decoded by the
+        fast path ('f' for one float, 'fff' for three); the messages with other arguments take the generic path.
+        """
+        self.callbacks[address] = callback
+        self.entries = [e for e in self.entries if e.address != address] + [FastPathEntry(address, tags, callback)]
+
+    def stop(self):
+        self.stop_event.set()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+        self.sock.close()
+
+    close = stop
+
+    def serve_forever(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        try:
+            while not self.stop_event.is_set():
+                if not selector.select(POLL_TIMEOUT):
+                    # Idle: move the most used addresses first
+                    self.entries.sort(key=lambda e: -e.hits)
+                    continue
+                while True:
+                    try:
+                        size = self.sock.recv_into(self.buffer)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        # Windows reports ICMP port unreachable on UDP sockets, or the socket was closed by stop()
+                        if self.stop_event.is_set():
+                            return
+                        continue
+                    self.packets += 1
+                    self.handle_packet(self.buffer, 0, size, time.monotonic_ns())
+        finally:
+            selector.close()
+
+    def handle_packet(self, buffer, start, end, stamp):
+        """Decode the packet in buffer[start:end] and run its callbacks."""
+        if buffer.startswith(BUNDLE, start):
+            offset = start + BUNDLE_HEADER
+            while offset + SIZE.size <= end:
+                size = SIZE.unpack_from(buffer, offset)[0]
+                offset += SIZE.size
+                if size <= 0 or offset + size > end:
+                    self.errors += 1
+                    return
+                self.handle_packet(buffer, offset, offset + size, stamp)
+                offset += size
+            return
+
+        size = end - start
+        for entry in self.entries:
+            if entry.size == size and buffer.startswith(entry.prefix, start):
+                entry.hits += 1
+                self.fast += 1
+                try:
+                    entry.callback(*entry.arguments.unpack_from(buffer, start + len(entry.prefix)), stamp=stamp)
+                except Exception as e:
+                    self.callback_failed(entry.address, e)
+                return
+
+        if self.default_handler is None:
+            # Nobody wants the unbound addresses: check the address before parsing the arguments
+            null = buffer.find(b'\0', start, end)
+            if null < 0 or bytes(self.view[start:null]) not in self.callbacks:
+                self.dropped += 1
+                return
+
+        try:
+            address, _, values, _ = read_message(bytes(self.view[start:end]))
+        except (ValueError, IndexError, struct.error):
+            self.errors += 1
+            return
+        self.generic += 1
+        callback = self.callbacks.get(address)
+        try:
+            if callback is not None:
+                callback(*values, stamp=stamp)
+            elif self.default_handler is not None:
+                self.default_handler(address, *values)
+        except Exception as e:
+            self.callback_failed(address, e)
+
+    def callback_failed(self, address, error):
+        self.callback_errors += 1
+        print("OSC callback of " + address.decode('utf-8', 'replace') + " failed: " + repr(error))
+
+    def stats(self):
+        return {
+            'packets': self.packets,
+            'fast': self.fast,
+            'generic': self.generic,
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'callback_errors': self.callback_errors,
+            'hits': {entry.address.decode('utf-8', 'replace'): entry.hits for entry in self.entries},
+        }
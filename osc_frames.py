@@ -0,0 +1,210 @@
+"""
+OSC receiver grouping the sensor messages of the phone into frames.
+
+The phone sends orientation, accelerometer and pad values as separate /multisense/... messages, in OSC bundles or not.
+OSCFrameServer reads every datagram waiting on its socket in one wakeup and groups the messages:
+    - the messages of a bundle make one frame per (sender, timetag),
+    - the loose messages of a sender read in the same wakeup make one frame, a new one being started when an address
+      comes back, so that no sample is lost.
+The addresses nobody subscribed to are skipped on their address string, before their arguments are parsed and before
+any callback runs. The frame is then handed to the handler in one call (OSCServer.handle_frame runs the sensor
+callbacks of a frame and sends their commands together). As in OSCThreadServer, an exception raised by the handler or
+by a callback is counted and printed, and the server keeps receiving.
+
+When the sender gives real timetags, the frame stamp is the timetag moved to the local monotonic clock by a
+ClockMapper: the capture clock of the phone without the network and scheduling jitter, which matters for the gestures
+based on derivatives (shake). Otherwise the stamp is the arrival time of the datagram.
+
+    server = OSCFrameServer(port=8000)
+    server.bind(b'/multisense/orientation/yaw', callback)  # callback(*values, stamp=...) once per frame
+    ...
+    server.stop()
+"""
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from oscpy.parser import read_message
+
+BUNDLE = b'#bundle\0'
+TIME_TAG = struct.Struct('>II')
+SIZE = struct.Struct('>i')
+NTP_DELTA = 2208988800  # Seconds between 1900 (NTP) and 1970 (unix)
+IMMEDIATELY = (0, 1)
+
+RECV_BATCH = 64  # Max datagrams read per wakeup
+POLL_TIMEOUT = 0.5  # Seconds between two checks of the stop flag when idle
+
+
+class SensorFrame:
+    """Values of the subscribed addresses sent together by a sender, values being {address: [arguments]}."""
+    __slots__ = ('sender', 'timetag', 'stamp', 'values')
+
+    def __init__(self, sender, timetag, stamp):
+        self.sender = sender  # (ip, port)
+        self.timetag = timetag  # Unix time given by the sender, None for the loose messages
+        self.stamp = stamp  # Monotonic time (ns) of the capture, see ClockMapper
+        self.values = {}
+
+    def get(self, address, default=None):
+        values = self.values.get(address)
+        return values[0] if values else default
+
+
+class ClockMapper:
+    """
+    Maps the timetags of a sender to the local monotonic clock. The offset between the two clocks is the smallest
+    (arrival - timetag) seen, the sample with the least network delay, and slowly follows the drift between the clocks.
+    """
+
+    def __init__(self, drift=0.001):
+        self.drift = drift
+        self.offset = None  # ns
+
+    def to_monotonic_ns(self, timetag, arrival_ns):
+        capture = int(timetag * 1e9)
+        offset = arrival_ns - capture
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+        else:
+            self.offset += int((offset - self.offset) * self.drift)
+        return min(capture + self.offset, arrival_ns)
+
+
+def message_address(data, offset=0):
+    """Address of the message at offset, without parsing its arguments."""
+    end = data.index(b'\0', offset)
+    return bytes(data[offset:end])
+
+
+class OSCFrameServer:
+
+    def __init__(self, handler=None, address='0.0.0.0', port=8000, recv_batch=RECV_BATCH, reuse_port=False):
+        """
+        handler(frame) gets every frame, by default the frame is dispatched to the callbacks given to bind().
+        reuse_port sets SO_REUSEPORT, for several processes listening on the same port, the kernel sending all the
+        datagrams of a sender to the same socket.
+        """
+        self.handler = self.dispatch if handler is None else handler
+        self.recv_batch = recv_batch
+        self.callbacks = {}  # address -> callback(*values, stamp=...)
+        self.subscriptions = set()
+        self.clocks = {}  # sender -> ClockMapper
+        self.packets = 0
+        self.messages = 0
+        self.dropped = 0  # Messages of unsubscribed addresses
+        self.frames = 0
+        self.callback_errors = 0  # Exceptions raised by the handler and the callbacks
+        self.stop_event = threading.Event()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                self.sock.close()
+                raise OSError("SO_REUSEPORT is not available on this platform")
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((address, port))
+        self.sock.setblocking(False)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def subscribe(self, address):
+        self.subscriptions.add(address)
+
+    def bind(self, address, callback):
+        self.callbacks[address] = callback
+        self.subscribe(address)
+
+    def dispatch(self, frame):
+        for address, values in frame.values.items():
+            callback = self.callbacks.get(address)
+            if callback is not None:
+                try:
+                    callback(*values, stamp=frame.stamp)
+                except Exception as e:
+                    self.callback_failed(address.decode('utf-8', 'replace'), e)
+
+    def callback_failed(self, name, error):
+        self.callback_errors += 1
+        print("OSC callback of " + name + " failed: " + repr(error))
+
+    def stop(self):
+        self.stop_event.set()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+        self.sock.close()
+
+    close = stop
+
+    def serve_forever(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        try:
+            while not self.stop_event.is_set():
+                if selector.select(POLL_TIMEOUT):
+                    for frame in self.read_frames():
+                        self.frames += 1
+                        try:
+                            self.handler(frame)
+                        except Exception as e:
+                            self.callback_failed('frame', e)
+        finally:
+            selector.close()
+
+    def read_frames(self):
+        """Read the datagrams waiting on the socket, return their frames in arrival order."""
+        frames = []
+        open_frames = {}  # (sender, timetag) -> frame still accepting messages
+        for _ in range(self.recv_batch):
+            try:
+                data, sender = self.sock.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # Windows reports ICMP port unreachable on UDP sockets, or the socket was closed by stop()
+                if self.stop_event.is_set():
+                    break
+                continue
+            self.packets += 1
+            try:
+                self.read_packet(data, sender, time.monotonic_ns(), frames, open_frames)
+            except (ValueError, IndexError, struct.error):
+                continue  # Malformed packet
+        return frames
+
+    def read_packet(self, data, sender, arrival, frames, open_frames, timetag=None):
+        if data.startswith(BUNDLE):
+            tag = TIME_TAG.unpack_from(data, len(BUNDLE))
+            if tag != IMMEDIATELY:
+                timetag = tag[0] + tag[1] / 2. ** 32 - NTP_DELTA
+            offset = len(BUNDLE) + TIME_TAG.size
+            view = memoryview(data)
+            while offset < len(data):
+                size = SIZE.unpack_from(data, offset)[0]
+                offset += SIZE.size
+                self.read_packet(view[offset:offset + size].tobytes(), sender, arrival, frames, open_frames, timetag)
+                offset += size
+            return
+
+        self.messages += 1
+        address = message_address(data)
+        if address not in self.subscriptions:
+            self.dropped += 1
+            return
+        _, _, values, _ = read_message(data)
+
+        key = (sender, timetag)
+        frame = open_frames.get(key)
+        if frame is None or address in frame.values:
+            if timetag is None:
+                stamp = arrival
+            else:
+                clock = self.clocks.get(sender)
+                if clock is None:
+                    clock = self.clocks[sender] = ClockMapper()
+                stamp = clock.to_monotonic_ns(timetag, arrival)
+            frame = open_frames[key] = SensorFrame(sender, timetag, stamp)
+            frames.append(frame)
+        frame.values[address] = values
@@ -1,7 +1,12 @@
 from oscpy.server import OSCThreadServer
-import socket
+from osc_frames import OSCFrameServer
+from osc_fastpath import FastPathServer
 import threading
 from steering_acceleration import STEER, ACCEL
+from stk_protocol import CommandSender, SOURCE_OSC
+from pwm_modulator import PwmModulator, MODE_THRESHOLD
+from timer_service import default_service
+from signal_filters import OneEuroFilter, ShakeDetector
 import time
 import math
 
@@ -17,14 +22,76 @@ STEER_ANGLE_THRES = 20
 
 ACCEL_ANGLE_THRES = 10
 
+# One-Euro filter of the orientation angles (degrees)
+ANGLE_MIN_CUTOFF = 1.0  # Hz, smoothing at rest
+ANGLE_BETA = 0.05  # Cutoff increase per degree per second, to follow the fast turns
 
-class OSCServer:
+# shake (rescue)
+DERIVATIVE_THRESHOLD = 3  # The amount of acceleration change required to detect a shake
+SHAKE_DURATION = 1.0  # Time window to detect shakes
+SHAKE_MIN_SAMPLES = 50  # Samples needed in the window
+LAST_RESCUE_TIME = 1.0  # Minimum time between rescue commands
+
+# analog controls
+CONTROL_MODE = MODE_THRESHOLD  # 'threshold': key held past the angle thresholds, 'pwm': pulse width modulated keys
+STEER_FULL_ANGLE = 2 * STEER_ANGLE_THRES  # Angle of a full steering, the threshold mode presses at half of it
+ACCEL_FULL_ANGLE = 2 * ACCEL_ANGLE_THRES
+PWM_PERIOD = 0.1  # Seconds
+PWM_MIN_PULSE = 1 / 60  # Seconds, one frame of the game
+
+# Addresses listened to in each mode
+COLLAB_ADDRESSES = (b'/multisense/orientation/roll', b'/multisense/orientation/pitch')
+PERF_ADDRESSES = (b'/multisense/orientation/yaw', b'/multisense/pad/x', b'/multisense/pad/touchUP',
+                  b'/multisense/accelerometer/y')
+
+
+class CallbackTable:
+    """Receiver without socket of an OSCServer whose messages are read by another receiver (multi_phone_server)."""
+    sock = None
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def bind(self, address, callback):
+        self.callbacks[address] = callback
 
-    def __init__(self, is_collab, _server_address='localhost', _server_port=6006):
+    def dispatch(self, address, values, stamp=None):
+        callback = self.callbacks.get(address)
+        if callback is not None:
+            callback(*values, stamp=stamp)
 
-        self.osc = OSCThreadServer(default_handler=self.dump)
-        self.sock = self.osc.listen(address='0.0.0.0', port=8000,
-                                    default=True)  # c'est le server where the phone need to send its information on
+    def stop(self):
+        pass
+
+
+class OSCServer:
+
+    def __init__(self, is_collab, _server_address='localhost', _server_port=6006, receiver='oscpy', sender=None,
+                 control=CONTROL_MODE):
+        """
+        receiver: 'oscpy' (OSCThreadServer), 'frames' (osc_frames.OSCFrameServer, bundles grouped in sensor frames with
+        the phone timetags, handled by handle_frame), 'fastpath' (osc_fastpath.FastPathServer, in place decoding of the float addresses) or
+        None (CallbackTable, no socket: the frames of one phone are given to handle_frame)
+        sender: command_bus.BusSender when running in the process of the STK_input_server, UDP by default
+        control: 'threshold' or 'pwm', how the steering and acceleration angles are played on the keys (pwm_modulator)
+        """
+        self._sender = sender
+        self.control = control
+        self.frame_batch = threading.local()  # Commands of the sensor frame handled by the thread, see handle_frame
+
+        if receiver is None:
+            self.osc = CallbackTable()
+            self.sock = None
+        elif receiver == 'frames':
+            self.osc = OSCFrameServer(self.handle_frame, port=8000)
+            self.sock = self.osc.sock
+        elif receiver == 'fastpath':
+            self.osc = FastPathServer(port=8000)
+            self.sock = self.osc.sock
+        else:
+            self.osc = OSCThreadServer(default_handler=self.dump)
+            self.sock = self.osc.listen(address='0.0.0.0', port=8000,
+                                        default=True)  # c'est le server where the phone need to send its information on
         self.server_address = (_server_address, _server_port)  # STK_input_server
 
         self.variable_initialization()
@@ -36,14 +103,16 @@ class OSCServer:
             self.bind_callbacks_perf()
 
     def bind_callbacks_collab(self):
-        self.osc.bind(b'/multisense/orientation/roll', self.callback_roll_right_left)
-        self.osc.bind(b'/multisense/orientation/pitch', self.callback_pitch_acc)
+        roll, pitch = COLLAB_ADDRESSES
+        self.osc.bind(roll, self.callback_roll_right_left)
+        self.osc.bind(pitch, self.callback_pitch_acc)
 
     def bind_callbacks_perf(self):
-        self.osc.bind(b'/multisense/orientation/yaw', self.callback_yaw_right_left)
-        self.osc.bind(b'/multisense/pad/x', self.callback_x_touchpad)
-        self.osc.bind(b'/multisense/pad/touchUP', self.callback_touchup)
-        self.osc.bind(b'/multisense/accelerometer/y', self.callback_acceleration_shaker_rescue)
+        yaw, pad_x, touch_up, accelerometer_y = PERF_ADDRESSES
+        self.osc.bind(yaw, self.callback_yaw_right_left)
+        self.osc.bind(pad_x, self.callback_x_touchpad)
+        self.osc.bind(touch_up, self.callback_touchup)
+        self.osc.bind(accelerometer_y, self.callback_acceleration_shaker_rescue)
 
     def dump(self, address, *values):
         """Default handler for unbound OSC messages."""
@@ -57,17 +126,35 @@ class OSCServer:
             )
         ))"""
 
+    def handle_frame(self, frame):
+        """
+        Handle an osc_frames.SensorFrame: the callbacks of its addresses run once for the frame and the commands they
+        send are published together, in one stk_protocol frame stamped with the capture time of the sensor frame.
+        """
+        commands = self.frame_batch.commands = []
+        try:
+            for address, values in frame.values.items():
+                callback = self.osc.callbacks.get(address)
+                if callback is None:
+                    continue
+                try:
+                    callback(*values, stamp=frame.stamp)
+                except Exception as e:
+                    print("OSC callback of " + address.decode('utf-8', 'replace') + " failed: " + repr(e))
+        finally:
+            self.frame_batch.commands = None
+            if commands:
+                self.sender.send(*commands, stamp=frame.stamp)
+
     def stop(self):
         self.osc.stop()
-        """Stop the control loop and close the socket."""
-        self.loop_running = False
-        self.control_thread.join()
-        self.client_socket.close()
+        """Stop the modulator, releasing the held keys, and close the socket."""
+        self.modulator.stop()
+        self.sender.close()
 
     def variable_initialization(self):
-        self.current_steering = STEER.NEUTRAL
-        self.current_accel = ACCEL.NEUTRAL
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender = CommandSender(self.server_address, SOURCE_OSC) if self._sender is None else self._sender
+        self.timers = default_service()  # Delayed releases of the instant commands
         self.last_tap_time = 0
         self.tap_count = 0
         self.shake_threshold = 10  # Adjust this value as needed
@@ -83,110 +170,85 @@ class OSCServer:
         self.accel_value = 0.0  # Continuous value between 0 and 1 for acceleration
         self.accel_direction = ACCEL.NEUTRAL  # Current acceleration direction
 
-        # Control loop variables
-        self.loop_running = True
-        self.control_thread = threading.Thread(target=self.control_loop)
-        self.control_thread.start()
+        # Keys of the analog controls
+        self.modulator = PwmModulator(self.send_data, self.control, PWM_PERIOD, PWM_MIN_PULSE)
+        self.modulator.add_channel('steering', {STEER.LEFT: (b'P_LEFT', b'R_LEFT'),
+                                                STEER.RIGHT: (b'P_RIGHT', b'R_RIGHT')})
+        self.modulator.add_channel('accel', {ACCEL.UP: (b'P_UP', b'R_UP'), ACCEL.DOWN: (b'P_DOWN', b'R_DOWN')})
+        self.modulator.start()
 
         # Shake detection variables
-        self.accel_buffer = []  # Buffer to store acceleration values for shake detection
-        self.previous_y_accel = None  # To compute the derivative
-        self.last_rescue_time = 0  # Last time the rescue command was sent
+        self.shake_detector = ShakeDetector(DERIVATIVE_THRESHOLD, SHAKE_DURATION, SHAKE_MIN_SAMPLES, LAST_RESCUE_TIME)
+
+        # Filters of the orientation angles
+        self.roll_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
+        self.pitch_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
+        self.yaw_filter = OneEuroFilter(ANGLE_MIN_CUTOFF, ANGLE_BETA)
 
         # Fire detection
         self.last_fire_time = 0
 
         self.is_nitroing = False
 
-    def send_data(self, data):
-        if len(data) > 0:
-            self.client_socket.sendto(data, self.server_address)
-
-    def process_steering(self, steering):
-        data = b''
-        # print("steering : ",steering)
-
-        if self.current_steering != STEER.NEUTRAL and steering == STEER.NEUTRAL:
-            if self.current_steering == STEER.LEFT:
-                data = b'R_LEFT'
-            elif self.current_steering == STEER.RIGHT:
-                data = b'R_RIGHT'
-
-        if self.current_steering == STEER.NEUTRAL and steering != STEER.NEUTRAL:
-            if steering == STEER.LEFT:
-                data = b'P_LEFT'
-            elif steering == STEER.RIGHT:
-                data = b'P_RIGHT'
-
-        if len(data) > 0:
-            self.send_data(data)
-
-        self.current_steering = steering
-
-    def process_acceleration(self, acceleration):
-        data = b''
-        if self.current_accel != ACCEL.NEUTRAL and acceleration == ACCEL.NEUTRAL:
-            if self.current_accel == ACCEL.UP:
-                data = b'R_UP'
-            elif self.current_accel == ACCEL.DOWN:
-                data = b'R_DOWN'
-
-        if self.current_accel == ACCEL.NEUTRAL and acceleration != ACCEL.NEUTRAL:
-            if acceleration == ACCEL.UP:
-                data = b'P_UP'
-            elif acceleration == ACCEL.DOWN:
-                data = b'P_DOWN'
-
+    def send_data(self, data, stamp=None):
+        """
+        Send a command, stamp being the monotonic capture time (ns) of the OSC message it comes from. During
+        handle_frame, the commands of its thread are kept to be sent with the frame.
+        """
         if len(data) > 0:
-            self.send_data(data)
+            commands = getattr(self.frame_batch, 'commands', None)
+            if commands is not None:
+                commands.append(data)
+            else:
+                self.sender.send(data, stamp=stamp)
+
+    def process_steering(self, angle, stamp=None):
+        """Steering of a filtered angle, positive to the left, STEER_FULL_ANGLE giving a full turn."""
+        self.steering_value = min(abs(angle) / STEER_FULL_ANGLE, 1.0)
+        if angle < 0:
+            self.steering_direction = STEER.RIGHT
+        elif angle > 0:
+            self.steering_direction = STEER.LEFT
+        else:
+            self.steering_direction = STEER.NEUTRAL
+        self.modulator.set('steering', self.steering_value, self.steering_direction, stamp)
 
-        self.current_accel = acceleration
+    def process_acceleration(self, angle, stamp=None):
+        """Acceleration of a filtered pitch angle, only forward (negative angle), full at ACCEL_FULL_ANGLE."""
+        if angle < 0:
+            self.accel_value = min(-angle / ACCEL_FULL_ANGLE, 1.0)
+            self.accel_direction = ACCEL.UP
+        else:
+            self.accel_value = 0.0
+            self.accel_direction = ACCEL.NEUTRAL
+        self.modulator.set('accel', self.accel_value, self.accel_direction, stamp)
 
     # coolab:
 
-    def callback_roll_right_left(self, *values):
-        steering = STEER.NEUTRAL
-
-        angle = values[0]
-
-        if angle < - STEER_ANGLE_THRES:
-            steering = STEER.RIGHT
-        elif angle > STEER_ANGLE_THRES:
-            steering = STEER.LEFT
-
-        self.process_steering(steering)
+    def callback_roll_right_left(self, *values, stamp=None):
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        angle = self.roll_filter.update(stamp / 1e9, values[0])
+        self.process_steering(angle, stamp)
 
-    def callback_pitch_acc(self, *values):
-        angle = values[0]
-
-        acceleration = ACCEL.NEUTRAL
-        if angle < - ACCEL_ANGLE_THRES:
-            acceleration = ACCEL.UP
-        elif angle > ACCEL_ANGLE_THRES:
-            acceleration = ACCEL.NEUTRAL
-
-        self.process_acceleration(acceleration)
+    def callback_pitch_acc(self, *values, stamp=None):
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        angle = self.pitch_filter.update(stamp / 1e9, values[0])
+        self.process_acceleration(angle, stamp)
 
     # perfo:
 
-    def callback_yaw_right_left(self, *values):
+    def callback_yaw_right_left(self, *values, stamp=None):
         # print("Received yaw values: {}".format(values))
-        steering = STEER.NEUTRAL
-
-        angle = values[0]
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        angle = self.yaw_filter.update(stamp / 1e9, values[0])
+        self.process_steering(angle, stamp)
 
-        if angle < - STEER_ANGLE_THRES:
-            steering = STEER.RIGHT
-        elif angle > STEER_ANGLE_THRES:
-            steering = STEER.LEFT
-
-        self.process_steering(steering)
-
-    def callback_x_touchpad(self, *values):
+    def callback_x_touchpad(self, *values, stamp=None):
         """Handle pad x-axis input for steering."""
 
         FIRE_WAITING_TIME = 0.5  # Time in seconds to wait before firing again
 
+        stamp = time.monotonic_ns() if stamp is None else stamp
         x = values[0]
 
         # If x is negative, we pressed right, if positive we pressed left
@@ -197,175 +259,46 @@ class OSCServer:
             # We nitro while pad is pressed
             if not self.is_nitroing:
                 self.is_nitroing = True
-                self.send_data(b'P_NITRO')
+                self.send_data(b'P_NITRO', stamp)
 
         elif x > 0:
             # We fire
             if time.time() - self.last_fire_time > FIRE_WAITING_TIME:
                 self.last_fire_time = time.time()
-                self.send_instant_commande("P_FIRE")
+                self.send_instant_commande("P_FIRE", stamp)
 
-    def callback_touchup(self, *values):
+    def callback_touchup(self, *values, stamp=None):
         if self.is_nitroing:
             self.is_nitroing = False
-            self.send_data(b'R_NITRO')
+            self.send_data(b'R_NITRO', time.monotonic_ns() if stamp is None else stamp)
 
-    def callback_acceleration_shaker_rescue(self, *values):
+    def callback_acceleration_shaker_rescue(self, *values, stamp=None):
         """Handle acceleration from the smartphone to detect shakes and send rescue command."""
-        DERIVATIVE_THRESHOLD = 3  # The amount of acceleration change required to detect a shake
-        SHAKE_DURATION = 1.0  # Time window to detect shakes
-
-        LAST_RESCUE_TIME = 1.0  # Minimum time between rescue commands
-
-        y_accel = values[0]
-
-        if self.previous_y_accel is not None:
-            # Calculate the change (derivative) in acceleration
-            accel_derivative = abs(y_accel - self.previous_y_accel)
-        else:
-            accel_derivative = 0.0
-
-        self.previous_y_accel = y_accel
-
-        current_time = time.time()
-
-        # Add current derivative and timestamp to the buffer
-        self.accel_buffer.append((current_time, accel_derivative))
-
-        # Remove old values beyond the shake duration
-        self.accel_buffer = [(t, d) for t, d in self.accel_buffer if t >= current_time - SHAKE_DURATION]
-
-        # print("Accel : ",str(len(self.accel_buffer))," ",str([round(a,3) for _, a in self.accel_buffer]))
-        # Check for consistent shaking (mean value above the threshold)
-
-        mean_derivative = sum(a for _, a in self.accel_buffer) / len(self.accel_buffer)
-
-        if len(self.accel_buffer) >= 50 and mean_derivative > DERIVATIVE_THRESHOLD:
-            # Check if last rescue command was sent more than LAST_RESCUE_TIME
-            if current_time - self.last_rescue_time > LAST_RESCUE_TIME:
-                self.last_rescue_time = current_time
-                print("Shake detected!")
-                self.send_instant_commande("P_RESCUE")
-
-    def control_loop(self):
-        """Infinite loop running at a target frequency to manage pressed and released commands."""
-        target_frequency = 60  # Loop frequency in Hz (60Hz or adjust to 120Hz if needed)
-        dt = 1.0 / target_frequency  # Time per loop iteration
-        total_cycle_time = dt  # Total time for one cycle (pressed + released)
-
-        while self.loop_running:
-            # Update steering control
-            self.update_control('steering', self.steering_value, total_cycle_time)
-            # Update acceleration control
-            self.update_control('accel', self.accel_value, total_cycle_time)
-            time.sleep(dt)
-
-    def update_control(self, control_type, current_value, total_cycle_time):
-        """Update control states and send commands based on continuous input values."""
-        # Determine the state variables based on control type
-        if control_type == 'steering':
-            direction = self.steering_direction
-            state_attr = 'steering_state'
-            timer_attr = 'steering_timer'
-        elif control_type == 'accel':
-            direction = self.accel_direction
-            state_attr = 'accel_state'
-            timer_attr = 'accel_timer'
-        else:
-            return
-
-        # Initialize state and timer attributes if they don't exist
-        if not hasattr(self, state_attr):
-            setattr(self, state_attr, 'released')
-        if not hasattr(self, timer_attr):
-            setattr(self, timer_attr, 0.0)
-
-        state = getattr(self, state_attr)
-        timer = getattr(self, timer_attr)
-
-        # Calculate t1 and t2 based on current_value
-        t1 = current_value * total_cycle_time
-        t2 = (1 - current_value) * total_cycle_time
-
-        timer -= total_cycle_time  # Decrement timer
-
-        if current_value == 0.0 or direction == STEER.NEUTRAL or direction == ACCEL.NEUTRAL:
-            # Ensure the control is released
-            if state == 'pressed':
-                self.release_command(control_type, direction)
-                state = 'released'
-                timer = 0.0
-        else:
-            if timer <= 0:
-                if state == 'pressed':
-                    self.release_command(control_type, direction)
-                    state = 'released'
-                    timer = t2
-                else:
-                    self.press_command(control_type, direction)
-                    state = 'pressed'
-                    timer = t1
-
-        # Update state and timer attributes
-        setattr(self, state_attr, state)
-        setattr(self, timer_attr, timer)
-
-    def press_command(self, control_type, direction):
-        """Send the 'pressed' command for the given control and direction."""
-        if control_type == 'steering':
-            if direction == STEER.LEFT:
-                self.send_data(b'P_LEFT')
-            elif direction == STEER.RIGHT:
-                self.send_data(b'P_RIGHT')
-        elif control_type == 'accel':
-            if direction == ACCEL.UP:
-                self.send_data(b'P_UP')
-            elif direction == ACCEL.DOWN:
-                self.send_data(b'P_DOWN')
-
-    def release_command(self, control_type, direction):
-        """Send the 'released' command for the given control and direction."""
-        if control_type == 'steering':
-            if direction == STEER.LEFT:
-                self.send_data(b'R_LEFT')
-            elif direction == STEER.RIGHT:
-                self.send_data(b'R_RIGHT')
-            # Reset steering direction if released
-            self.steering_direction = STEER.NEUTRAL
-        elif control_type == 'accel':
-            if direction == ACCEL.UP:
-                self.send_data(b'R_UP')
-            elif direction == ACCEL.DOWN:
-                self.send_data(b'R_DOWN')
-            # Reset acceleration direction if released
-            self.accel_direction = ACCEL.NEUTRAL
+        stamp = time.monotonic_ns() if stamp is None else stamp
+        if self.shake_detector.update(stamp / 1e9, values[0]):
+            print("Shake detected!")
+            self.send_instant_commande("P_RESCUE", stamp)
 
-    def send_instant_commande(self, command):
+    def send_instant_commande(self, command, stamp=None):
         """Used to send an action command (fire, rescue etc) to the server by first pressing the key then releasing
         it"""
 
         delay = 0.2  # Delay in seconds before sending the release command
 
         if command == "P_RESCUE":
-            data = b'P_RESCUE'
-            self.client_socket.sendto(data, self.server_address)
+            self.send_data(b'P_RESCUE', stamp)
             # Programme un envoie de la commande R_RESCUE dans delay
-            timer = threading.Timer(delay, self.send_instant_commande, ["R_RESCUE"])
-            timer.start()
+            self.timers.schedule(delay, self.send_instant_commande, "R_RESCUE")
 
         elif command == "P_FIRE":
-            data = b'P_FIRE'
-            self.client_socket.sendto(data, self.server_address)
+            self.send_data(b'P_FIRE', stamp)
             # Programme un envoie de la commande R_FIRE dans delay
-            timer = threading.Timer(delay, self.send_instant_commande, ["R_FIRE"])
-            timer.start()
+            self.timers.schedule(delay, self.send_instant_commande, "R_FIRE")
 
         elif command == "R_RESCUE":
-            data = b'R_RESCUE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'R_RESCUE')
             has_rescued = False
 
         elif command == "R_FIRE":
-            data = b'R_FIRE'
-            self.client_socket.sendto(data, self.server_address)
+            self.sender.send(b'R_FIRE')
             has_fired = False
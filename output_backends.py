@@ -0,0 +1,212 @@
+"""
+Output backends of the STK_input_server: what a key event turns into on the game machine.
+
+Every backend offers press(key), release(key) and press_and_release(key), with the keyboard key names of the server
+bindings, plus:
+    - pending(): True when some changes were buffered and wait for flush(),
+    - flush(): apply the buffered changes as one batch.
+The server calls flush() at the end of its flush window, so all the commands received in the window cost a single
+update of the device.
+
+    KeyboardBackend : keyboard module, one OS call per event (nothing to batch)
+    GamepadBackend  : virtual Xbox 360 gamepad (Reworked.GamepadController), one vg.update() per batch
+    NullBackend     : no output, counts and timestamps the events (benchmarks)
+    RecordingBackend: NullBackend keeping the list of the events (replays, debugging)
+"""
+import itertools
+import threading
+import time
+
+from timer_service import default_service
+
+BACKENDS = ('keyboard', 'gamepad', 'null')
+
+
+class OutputBackend:
+
+    def press(self, key):
+        raise NotImplementedError
+
+    def release(self, key):
+        raise NotImplementedError
+
+    def press_and_release(self, key):
+        self.press(key)
+        self.release(key)
+
+    def pending(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class KeyboardBackend(OutputBackend):
+
+    def __init__(self):
+        import keyboard
+        self.keyboard = keyboard
+
+    def press(self, key):
+        self.keyboard.press(key)
+
+    def release(self, key):
+        self.keyboard.release(key)
+
+    def press_and_release(self, key):
+        self.keyboard.press_and_release(key)
+
+
+class GamepadBackend(OutputBackend):
+    """
+    Drives a virtual gamepad with the keyboard key names of the server. The button changes are buffered and sent with
+    a single vg.update() per flush. left/right move the left joystick. A tap keeps the button pressed tap_duration
+    seconds, like GamepadController.send_instant_command, so that the game has the time to see it. The releases of the
+    taps are scheduled on the timer_service, and cancelled by a press or a release of the same key in the meantime: the
+    key then belongs to the holder that pressed it.
+    """
+
+    # Same mapping as GamepadController.send_command
+    BUTTONS = {
+        'up': 'Y',
+        'down': 'X',
+        'v': 'RB',
+        'b': 'A',
+        'n': 'LB',
+        'space': 'B',
+        'backspace': 'BACK',
+        'escape': 'START',
+    }
+    AXIS = {'left': -1.0, 'right': 1.0}
+
+    def __init__(self, gamepad_controller=None, tap_duration=0.2, timers=None):
+        if gamepad_controller is None:
+            from Reworked.GamepadController import GamepadController
+            gamepad_controller = GamepadController()
+        self.gc = gamepad_controller
+        self.tap_duration = tap_duration
+        self.timers = default_service() if timers is None else timers
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.steering = []  # Steering keys held, the last one wins
+        self.taps = {}  # key -> (tap number, TimerHandle) of the pending tap releases
+        self.tap_numbers = itertools.count()
+        self.updates = 0
+        self.ignored = 0
+
+    def _set(self, key, pressed):
+        if key in self.AXIS:
+            if key in self.steering:
+                self.steering.remove(key)
+            if pressed:
+                self.steering.append(key)
+            self.gc.vg.left_joystick_float(self.AXIS[self.steering[-1]] if self.steering else 0.0, 0.0)
+        else:
+            button = self.BUTTONS.get(key)
+            if button is None:
+                self.ignored += 1
+                return
+            if pressed:
+                self.gc.press_button(button, False)
+            else:
+                self.gc.release_button(button, False)
+        self.dirty = True
+
+    def _cancel_tap(self, key):
+        tap = self.taps.pop(key, None)
+        if tap is not None:
+            tap[1].cancel()
+
+    def press(self, key):
+        with self.lock:
+            self._cancel_tap(key)
+            self._set(key, True)
+
+    def release(self, key):
+        with self.lock:
+            self._cancel_tap(key)
+            self._set(key, False)
+
+    def press_and_release(self, key):
+        with self.lock:
+            self._cancel_tap(key)
+            self._set(key, True)
+            number = next(self.tap_numbers)
+            self.taps[key] = (number, self.timers.schedule(self.tap_duration, self._release_tap, key, number))
+
+    def _release_tap(self, key, number):
+        with self.lock:
+            tap = self.taps.get(key)
+            if tap is None or tap[0] != number:
+                return  # Cancelled by a later command of the key while firing
+            del self.taps[key]
+            self._set(key, False)
+        self.flush()
+
+    def pending(self):
+        return self.dirty
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.updates += 1
+            self.gc.vg.update()
+
+
+class NullBackend(OutputBackend):
+    """No output: only the number of events and the monotonic time (ns) of the first and last ones."""
+
+    def __init__(self):
+        self.events = 0
+        self.flushes = 0
+        self.first = None
+        self.last = None
+
+    def _event(self, action, key):
+        now = time.monotonic_ns()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.events += 1
+
+    def press(self, key):
+        self._event('press', key)
+
+    def release(self, key):
+        self._event('release', key)
+
+    def press_and_release(self, key):
+        self._event('tap', key)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class RecordingBackend(NullBackend):
+    """NullBackend keeping every (time ns, action, key, batch number) event."""
+
+    def __init__(self):
+        super().__init__()
+        self.events_log = []
+
+    def _event(self, action, key):
+        super()._event(action, key)
+        self.events_log.append((self.last, action, key, self.flushes))
+
+    def pending(self):
+        return bool(self.events_log) and self.events_log[-1][3] == self.flushes
+
+
+def create_backend(name):
+    if name == 'keyboard':
+        return KeyboardBackend()
+    if name == 'gamepad':
+        return GamepadBackend()
+    if name == 'null':
+        return NullBackend()
+    raise ValueError("Unknown output backend " + str(name) + ", expected one of " + ', '.join(BACKENDS))
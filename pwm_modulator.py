@@ -0,0 +1,225 @@
+"""
+Analog values (steering, throttle) played on the digital keys of the game.
+
+The phone gives continuous angles but STK only reads pressed or released keys. In 'pwm' mode a value between 0 and 1
+holds the key of its direction value * period of every period: the modulator computes the exact monotonic deadline of
+the next press or release edge of every channel and its thread sleeps until the earliest one, instead of polling at a
+fixed rate. The duty cycle is not quantized on ticks, and the time a late wake up adds to or removes from a pulse is
+carried over to the next pulse, so the game sees the value on average.
+
+A pulse shorter than min_pulse (about one frame of the game) could be missed, so for the values close to 0 or 1 the
+period is stretched, up to max_period, to keep both the pulse and the gap at least min_pulse long. A value within
+deadzone of 0 releases the key and a value within deadzone of 1 holds it: no edge is scheduled and the thread sleeps
+until the next change. A period whose pulse comes out at 0 (a late release carried over) sends no press, and a period
+without gap keeps the key held into the next one, so the game never gets a press and a release back to back.
+
+'threshold' mode is the binary mapping: the key is held while the value is above the threshold of the channel, the
+edges are sent by set() itself and the thread is not started.
+
+    modulator = PwmModulator(sender.send, mode='pwm').start()
+    modulator.add_channel('steering', {STEER.LEFT: (b'P_LEFT', b'R_LEFT'), STEER.RIGHT: (b'P_RIGHT', b'R_RIGHT')})
+    modulator.set('steering', 0.3, STEER.LEFT, stamp)  # From the sensor callbacks, any thread
+    modulator.stop()  # Releases the held keys
+"""
+import threading
+import time
+
+from latency_metrics import LatencyHistogram
+
+MODE_PWM = 'pwm'
+MODE_THRESHOLD = 'threshold'
+MODES = (MODE_PWM, MODE_THRESHOLD)
+
+PERIOD = 0.1  # Seconds, PWM period of the values away from 0 and 1
+MIN_PULSE = 1 / 60  # Seconds, shortest press or release the game is sure to see (one frame)
+MAX_PERIOD = 0.5  # Seconds, longest stretched period
+DEADZONE = 0.02
+THRESHOLD = 0.5
+
+
+class PwmChannel:
+    """State of one analog control, its keys being commands = {direction: (press command, release command)}."""
+    __slots__ = ('name', 'commands', 'threshold', 'value', 'direction', 'wanted', 'held', 'period_start', 'on',
+                 'period', 'carry', 'pressed_at', 'next_edge', 'pulses')
+
+    def __init__(self, name, commands, threshold):
+        self.name = name
+        self.commands = commands
+        self.threshold = threshold
+        self.value = 0.0
+        self.direction = None
+        self.wanted = None  # Commands of the direction being modulated
+        self.held = None  # Commands of the key currently pressed
+        self.period_start = 0  # ns
+        self.on = 0  # Pulse length of the current period, ns
+        self.period = 0  # ns
+        self.carry = 0  # Intended minus realized pulse length, added to the next pulse (ns)
+        self.pressed_at = 0  # ns
+        self.next_edge = None  # Monotonic deadline (ns) of the next edge, None when idle
+        self.pulses = 0
+
+
+class PwmModulator:
+
+    def __init__(self, send, mode=MODE_PWM, period=PERIOD, min_pulse=MIN_PULSE, max_period=MAX_PERIOD,
+                 deadzone=DEADZONE, clock=time.monotonic_ns, name='pwm-modulator'):
+        """send(command, stamp) sends a press or release command, stamp being None for the edges of the thread."""
+        if mode not in MODES:
+            raise ValueError("Unknown PWM mode " + str(mode) + ", expected one of " + ", ".join(MODES))
+        self.send = send
+        self.mode = mode
+        self.period = int(period * 1e9)
+        self.min_pulse = int(min_pulse * 1e9)
+        self.max_period = int(max_period * 1e9)
+        self.deadzone = deadzone
+        self.clock = clock
+        self.name = name
+        self.channels = {}
+        self.condition = threading.Condition()
+        self.edges = 0  # Edges sent by the thread
+        self.lateness = LatencyHistogram()  # Edge time - deadline, in microseconds
+        self.running = False
+        self.thread = None
+
+    def add_channel(self, name, commands, threshold=THRESHOLD):
+        """threshold is the value above which the key is held in 'threshold' mode."""
+        with self.condition:
+            channel = self.channels[name] = PwmChannel(name, commands, threshold)
+        return channel
+
+    def start(self):
+        if self.mode == MODE_THRESHOLD:
+            return self
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and release the held keys."""
+        with self.condition:
+            self.running = False
+            for channel in self.channels.values():
+                channel.next_edge = None
+                self._switch(channel, None, None)
+            self.condition.notify()
+        if self.thread is not None and threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def set(self, name, value, direction, stamp=None):
+        """Set the value (0 to 1) and direction of a channel, the edges due now are sent with stamp."""
+        with self.condition:
+            channel = self.channels[name]
+            channel.value = value
+            channel.direction = direction
+            wanted = channel.commands.get(direction)
+            if self.mode == MODE_THRESHOLD:
+                self._switch(channel, wanted if value > channel.threshold else None, stamp)
+                return
+
+            now = self.clock()
+            if wanted is None or value <= self.deadzone or value >= 1.0 - self.deadzone:
+                # Released or fully held, nothing to modulate
+                channel.wanted = None
+                channel.next_edge = None
+                self._switch(channel, wanted if value > self.deadzone else None, stamp)
+                return
+
+            if channel.wanted is not wanted or channel.next_edge is None:
+                # New direction or start of the modulation: restart the period now
+                channel.wanted = wanted
+                channel.carry = 0
+                channel.period_start = now
+                self._plan(channel, value)
+                self._switch(channel, wanted if channel.on else None, stamp)
+                channel.pressed_at = now
+            else:
+                self._plan(channel, value)
+            previous = channel.next_edge
+            self._advance(channel, now, stamp)
+            if previous is None or channel.next_edge < previous:
+                self.condition.notify()
+
+    def _plan(self, channel, value):
+        """Pulse and period lengths of value, the period being stretched to keep the pulse and the gap visible."""
+        period = self.period
+        if self.min_pulse:
+            period = min(self.max_period, max(period, int(self.min_pulse / value), int(self.min_pulse / (1.0 - value))))
+        channel.period = period
+        channel.on = min(period, max(0, int(value * period) + channel.carry))
+
+    def _advance(self, channel, now, stamp=None):
+        """Send the edges of channel due at now and compute its next deadline."""
+        while True:
+            if channel.held is not None:
+                edge = channel.period_start + channel.on
+            else:
+                edge = channel.period_start + channel.period
+            if edge > now:
+                channel.next_edge = edge
+                return
+            if channel.held is not None:
+                # Carry the lateness of the edges over to the next pulse
+                channel.carry = channel.on - (now - channel.pressed_at)
+                if channel.on < channel.period:
+                    self._switch(channel, None, stamp)
+                    continue
+                # No gap in this period: the key stays held into the next one
+            # Skip the whole periods missed instead of sending their pulses back to back
+            channel.period_start = edge if now - edge < channel.period else now
+            self._plan(channel, channel.value)
+            if channel.on:
+                channel.pulses += 1
+                self._switch(channel, channel.wanted, stamp)
+                channel.pressed_at = now
+            else:
+                # No pulse in this period, its intended length is carried over to the next one
+                channel.carry += int(channel.value * channel.period)
+                self._switch(channel, None, stamp)
+
+    def _switch(self, channel, wanted, stamp):
+        """Press the key of wanted (None to release), releasing the other one first."""
+        if wanted is channel.held:
+            return
+        if channel.held is not None:
+            self.send(channel.held[1], stamp)
+        if wanted is not None:
+            self.send(wanted[0], stamp)
+        channel.held = wanted
+
+    def _run(self):
+        with self.condition:
+            while self.running:
+                deadline = None
+                for channel in self.channels.values():
+                    if channel.next_edge is not None and (deadline is None or channel.next_edge < deadline):
+                        deadline = channel.next_edge
+                if deadline is None:
+                    self.condition.wait()  # Idle until set() gives a value to modulate
+                    continue
+                now = self.clock()
+                if deadline > now:
+                    self.condition.wait((deadline - now) / 1e9)
+                    continue
+                for channel in self.channels.values():
+                    if channel.next_edge is not None and channel.next_edge <= now:
+                        self.edges += 1
+                        self.lateness.record((now - channel.next_edge) // 1000)
+                        self._advance(channel, now)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'mode': self.mode,
+                'edges': self.edges,
+                'lateness_p50_us': self.lateness.quantile(0.5),
+                'lateness_p99_us': self.lateness.quantile(0.99),
+                'lateness_max_us': self.lateness.max,
+                'channels': {name: {'value': channel.value, 'held': channel.held is not None,
+                                    'modulating': channel.next_edge is not None, 'pulses': channel.pulses,
+                                    'period_ms': channel.period / 1e6}
+                             for name, channel in self.channels.items()},
+            }
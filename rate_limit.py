@@ -0,0 +1,164 @@
+"""
+Per-source rate limiting and priority scheduling of the commands received by the STK_input_server.
+
+Every source (producer port) has a token bucket. The commands decoded during one wakeup of the server are queued in
+priority classes and dispatched class by class, so the releases of the pedals and of the steering always go before the
+bulk traffic of the same wakeup. The commands of one key keep their arrival order: a command never goes before an
+earlier command of the same OS key (several opcodes share a key, UP and ACCELERATE both drive 'up'), so a press then a
+release of a key in one wakeup don't leave the key held. Such a command takes the class of the earlier one when it is
+lower.
+
+When the bucket of a source is empty the command is counted as an overflow. Releases are still dispatched (dropping one
+would leave a key stuck), the other commands are shed.
+"""
+import threading
+import time
+
+import stk_protocol
+
+CRITICAL = 0  # Releases of the pedals and of the steering
+RELEASE = 1  # Other releases
+PRESS = 2  # Presses
+BULK = 3  # Taps (press and release)
+PRIORITY_NAMES = ('critical', 'release', 'press', 'bulk')
+
+CRITICAL_ACTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT', 'ACCELERATE', 'BRAKE')
+
+
+def build_priority_table():
+    """Priority class of every (opcode, flags) pair, indexed by opcode << 2 | flags."""
+    table = [BULK] * (len(stk_protocol.ACTIONS) << 2)
+    for opcode, action in enumerate(stk_protocol.ACTIONS):
+        table[opcode << 2 | stk_protocol.PRESS] = PRESS
+        table[opcode << 2 | stk_protocol.RELEASE] = CRITICAL if action in CRITICAL_ACTIONS else RELEASE
+    return table
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens per second
+        self.burst = burst  # Bucket size
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.updated = now
+        if tokens >= 1.0:
+            self.tokens = min(tokens, self.burst) - 1.0
+            return True
+        self.tokens = tokens
+        return False
+
+
+class SourceCounters:
+    __slots__ = ('accepted', 'overflow', 'shed')
+
+    def __init__(self):
+        self.accepted = 0  # Commands queued for dispatch
+        self.overflow = 0  # Commands received while the bucket was empty
+        self.shed = 0  # Commands dropped because of an overflow
+
+
+class CommandScheduler:
+
+    def __init__(self, rate=400.0, burst=100, rates=None, keys=None):
+        """
+        rate and burst apply to every source, rates gives {source id: (rate, burst)} for specific ones. keys gives the
+        OS key of every (opcode, flags) pair, indexed by opcode << 2 | flags (STK_input_server.key_table), each opcode
+        being its own key by default.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.keys = keys
+        self.buckets = {}
+        self.counters = {}
+        self.priorities = build_priority_table()
+        self.queue = []  # (priority, opcode, flags, source, stamp) in arrival order
+        self.lock = threading.Lock()
+
+    def _bucket(self, source):
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            rate, burst = self.rates.get(source, (self.rate, self.burst))
+            bucket = self.buckets[source] = TokenBucket(rate, burst)
+            self.counters[source] = SourceCounters()
+        return bucket
+
+    def submit(self, opcode, flags, source, stamp=0):
+        """Queue a command, return False if it was shed."""
+        index = opcode << 2 | flags
+        priority = self.priorities[index] if index < len(self.priorities) else BULK
+        with self.lock:
+            bucket = self._bucket(source)
+            counters = self.counters[source]
+            if not bucket.take(time.monotonic()):
+                counters.overflow += 1
+                if priority > RELEASE:
+                    counters.shed += 1
+                    return False
+            counters.accepted += 1
+            self.queue.append((priority, opcode, flags, source, stamp))
+            return True
+
+    def drain(self):
+        """
+        Return the queued (opcode, flags, source, stamp) commands, by priority class then by arrival order, without
+        moving a command before an earlier one of the same key.
+        """
+        with self.lock:
+            queue = self.queue
+            self.queue = []
+        classes = [[] for _ in PRIORITY_NAMES]
+        keys = self.keys
+        last = {}  # Class of the last command of each key
+        for priority, opcode, flags, source, stamp in queue:
+            key = opcode if keys is None else keys[opcode << 2 | flags] or opcode
+            priority = max(priority, last.get(key, priority))
+            last[key] = priority
+            classes[priority].append((opcode, flags, source, stamp))
+        commands = []
+        for commands_of_class in classes:
+            commands.extend(commands_of_class)
+        return commands
+
+    def stats(self):
+        with self.lock:
+            return {source: {'accepted': c.accepted, 'overflow': c.overflow, 'shed': c.shed}
+                    for source, c in self.counters.items()}
+
+
+if __name__ == '__main__':
+    # Regression check: a press and a release of a key in one wakeup are dispatched in that order
+    LEFT = stk_protocol.OPCODES['LEFT']
+    UP = stk_protocol.OPCODES['UP']
+    scheduler = CommandScheduler()
+    scheduler.submit(LEFT, stk_protocol.PRESS, stk_protocol.SOURCE_OSC)
+    scheduler.submit(UP, stk_protocol.PRESS, stk_protocol.SOURCE_OSC)
+    scheduler.submit(LEFT, stk_protocol.RELEASE, stk_protocol.SOURCE_OSC)
+    scheduler.submit(UP, stk_protocol.RELEASE, stk_protocol.SOURCE_QR)
+    scheduler.submit(LEFT, stk_protocol.PRESS, stk_protocol.SOURCE_QR)
+    order = [(opcode, flags) for opcode, flags, _, _ in scheduler.drain()]
+    assert order == [(LEFT, stk_protocol.PRESS), (UP, stk_protocol.PRESS), (LEFT, stk_protocol.RELEASE),
+                     (UP, stk_protocol.RELEASE), (LEFT, stk_protocol.PRESS)], order
+    # A release without earlier command of its key still goes before the presses
+    scheduler.submit(LEFT, stk_protocol.PRESS, stk_protocol.SOURCE_OSC)
+    scheduler.submit(UP, stk_protocol.RELEASE, stk_protocol.SOURCE_OSC)
+    order = [(opcode, flags) for opcode, flags, _, _ in scheduler.drain()]
+    assert order == [(UP, stk_protocol.RELEASE), (LEFT, stk_protocol.PRESS)], order
+    # UP and ACCELERATE both drive 'up': a press of one then a release of the other keep their order
+    ACCELERATE = stk_protocol.OPCODES['ACCELERATE']
+    keys = [None] * (len(stk_protocol.ACTIONS) << 2)
+    for opcode, key in ((UP, 'up'), (ACCELERATE, 'up'), (LEFT, 'left')):
+        for flags in stk_protocol.FLAGS:
+            keys[opcode << 2 | flags] = key
+    scheduler = CommandScheduler(keys=keys)
+    scheduler.submit(UP, stk_protocol.PRESS, stk_protocol.SOURCE_OSC)
+    scheduler.submit(ACCELERATE, stk_protocol.RELEASE, stk_protocol.SOURCE_OSC)
+    scheduler.submit(LEFT, stk_protocol.RELEASE, stk_protocol.SOURCE_OSC)
+    order = [(opcode, flags) for opcode, flags, _, _ in scheduler.drain()]
+    assert order == [(LEFT, stk_protocol.RELEASE), (UP, stk_protocol.PRESS), (ACCELERATE, stk_protocol.RELEASE)], order
+    print("CommandScheduler keeps the order of the commands of each key")
@@ -0,0 +1,319 @@
+"""
+Streaming filters for the sensor callbacks (OSC orientation and accelerometer, ...).
+
+Every filter is updated with one (time, value) sample at a time, time being in seconds on the monotonic clock
+(stamp / 1e9 for the stamps of stk_protocol), and costs O(1) per sample, without allocation:
+
+    TimeWindow   : samples of the last `window` seconds in a NumPy ring buffer, with running mean and variance
+    EmaFilter    : exponential moving average with a time constant, so it doesn't depend on the sample rate
+    Derivative   : rate of change per second, optionally smoothed by an EmaFilter
+    MedianFilter : median of the last `size` samples, removes the spikes
+    OneEuroFilter: adaptive low pass filter (Casiez et al., CHI 2012), smooth at rest and reactive when moving
+    KalmanFilter : constant velocity Kalman filter, estimates the value and its speed to predict the value ahead
+    ShakeDetector: mean absolute change between two samples over a time window, with a cooldown
+    Hysteresis   : threshold with a band, the state changes only once the value crossed the whole band
+
+See benchmarks/bench_signal_filters.py for the cost per sample.
+"""
+import bisect
+import math
+
+import numpy as np
+
+
+class TimeWindow:
+    """
+    Samples of the last `window` seconds. The arrays grow (doubling) when the window holds more samples than their
+    capacity, so the cost per sample stays O(1) amortized: each sample is written and evicted once.
+    """
+
+    def __init__(self, window, capacity=128):
+        self.window = window
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.start = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of the squared differences to the mean (Welford)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        capacity = len(self.times)
+        order = (np.arange(self.count) + self.start) % capacity
+        times = np.zeros(capacity * 2)
+        values = np.zeros(capacity * 2)
+        times[:self.count] = self.times[order]
+        values[:self.count] = self.values[order]
+        self.times, self.values, self.start = times, values, 0
+
+    def push(self, t, value):
+        """Add a sample and evict the ones older than t - window."""
+        self.evict(t - self.window)
+        if self.count == len(self.times):
+            self._grow()
+        index = (self.start + self.count) % len(self.times)
+        self.times[index] = t
+        self.values[index] = value
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def evict(self, oldest):
+        """Remove the samples taken before oldest."""
+        times = self.times
+        capacity = len(times)
+        while self.count and times[self.start] < oldest:
+            value = float(self.values[self.start])
+            self.start = (self.start + 1) % capacity
+            self.count -= 1
+            if self.count == 0:
+                self.mean = 0.0
+                self.m2 = 0.0
+            else:
+                delta = value - self.mean
+                self.mean -= delta / self.count
+                self.m2 = max(0.0, self.m2 - delta * (value - self.mean))
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def duration(self):
+        """Time between the oldest and the newest sample."""
+        if not self.count:
+            return 0.0
+        return float(self.times[(self.start + self.count - 1) % len(self.times)] - self.times[self.start])
+
+    def samples(self):
+        """Copy of the values, oldest first (O(n), for debugging and plots)."""
+        order = (np.arange(self.count) + self.start) % len(self.values)
+        return self.values[order]
+
+
+class EmaFilter:
+
+    def __init__(self, tau):
+        """tau: time constant in seconds, the weight of a sample is divided by e every tau seconds."""
+        self.tau = tau
+        self.value = None
+        self.last = None
+
+    def update(self, t, value):
+        if self.value is None:
+            self.value = value
+        else:
+            alpha = 1.0 - math.exp(-max(t - self.last, 0.0) / self.tau) if self.tau > 0 else 1.0
+            self.value += alpha * (value - self.value)
+        self.last = t
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.last = None
+
+
+class Derivative:
+
+    def __init__(self, tau=0.0):
+        """tau: time constant of the EMA smoothing the derivative, 0 for the raw one."""
+        self.previous = None
+        self.last = None
+        self.delta = 0.0  # Change between the last two samples
+        self.value = 0.0  # Change per second
+        self.smoothing = EmaFilter(tau) if tau > 0 else None
+
+    def update(self, t, value):
+        if self.previous is not None:
+            self.delta = value - self.previous
+            dt = t - self.last
+            rate = self.delta / dt if dt > 0 else self.value
+            self.value = self.smoothing.update(t, rate) if self.smoothing is not None else rate
+        self.previous = value
+        self.last = t
+        return self.value
+
+
+class MedianFilter:
+    """Median of the last `size` samples, kept sorted with bisect (O(size) memmove, size being a small constant)."""
+
+    def __init__(self, size=5):
+        self.ring = [0.0] * size
+        self.sorted = []
+        self.index = 0
+
+    def update(self, t, value):
+        if len(self.sorted) == len(self.ring):
+            del self.sorted[bisect.bisect_left(self.sorted, self.ring[self.index])]
+        self.ring[self.index] = value
+        self.index = (self.index + 1) % len(self.ring)
+        bisect.insort(self.sorted, value)
+        count = len(self.sorted)
+        middle = count // 2
+        if count % 2:
+            return self.sorted[middle]
+        return (self.sorted[middle - 1] + self.sorted[middle]) / 2
+
+
+class OneEuroFilter:
+    """
+    Low pass filter whose cutoff frequency grows with the speed of the signal: min_cutoff (Hz) removes the jitter at
+    rest, beta makes the filter follow the fast movements without lag, d_cutoff (Hz) smooths the speed estimate.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = None
+        self.speed = 0.0
+        self.last = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        r = 2 * math.pi * cutoff * dt
+        return r / (r + 1)
+
+    def update(self, t, value):
+        if self.value is None or t <= self.last:
+            if self.value is None:
+                self.value = value
+            self.last = t
+            return self.value
+        dt = t - self.last
+        self.last = t
+        speed = (value - self.value) / dt
+        self.speed += self._alpha(self.d_cutoff, dt) * (speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * abs(self.speed)
+        self.value += self._alpha(cutoff, dt) * (value - self.value)
+        return self.value
+
+    def predict(self, t):
+        """Value extrapolated at t with the filtered speed."""
+        if self.value is None:
+            return None
+        return self.value + self.speed * (t - self.last)
+
+    def reset(self):
+        self.value = None
+        self.speed = 0.0
+        self.last = None
+
+
+class KalmanFilter:
+    """
+    Constant velocity Kalman filter of one value: the state is the value and its speed, the speed changing by a white
+    noise acceleration of standard deviation `acceleration` (units/s^2), the samples having a noise of standard
+    deviation `noise`. A low acceleration smooths more, a high one follows the changes of speed faster.
+    """
+
+    def __init__(self, acceleration=1.0, noise=1.0):
+        self.q = acceleration * acceleration
+        self.r = noise * noise
+        self.value = None
+        self.speed = 0.0
+        self.last = None
+        self.p00 = self.p01 = self.p11 = 0.0  # Covariance of (value, speed)
+
+    def update(self, t, value):
+        if self.value is None:
+            self.value = value
+            self.speed = 0.0
+            self.last = t
+            self.p00 = self.r
+            self.p01 = 0.0
+            self.p11 = 1e3 * self.r  # Unknown speed
+            return self.value
+        dt = t - self.last
+        if dt > 0:
+            # Prediction: the value moves at the speed, the covariance grows with the process noise
+            self.last = t
+            self.value += self.speed * dt
+            q = self.q
+            self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+            self.p01 += dt * self.p11 + q * dt ** 2 / 2
+            self.p11 += q * dt
+        # Correction by the sample
+        innovation = value - self.value
+        s = self.p00 + self.r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        self.value += k0 * innovation
+        self.speed += k1 * innovation
+        self.p11 -= k1 * self.p01
+        self.p01 *= 1 - k0
+        self.p00 *= 1 - k0
+        return self.value
+
+    def predict(self, t):
+        """Value extrapolated at t with the estimated speed."""
+        if self.value is None:
+            return None
+        return self.value + self.speed * (t - self.last)
+
+    def reset(self):
+        self.value = None
+        self.speed = 0.0
+        self.last = None
+
+
+class ShakeDetector:
+    """
+    Detects a shake of the phone: the mean absolute change of the signal between two samples, over the last `window`
+    seconds, goes above threshold while the window holds at least min_samples samples. Two detections are at least
+    `cooldown` seconds apart.
+    """
+
+    def __init__(self, threshold=3.0, window=1.0, min_samples=50, cooldown=1.0):
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.changes = TimeWindow(window)
+        self.derivative = Derivative()
+        self.last_shake = -math.inf
+
+    def update(self, t, value):
+        """Return True when a shake is detected."""
+        self.derivative.update(t, value)
+        self.changes.push(t, abs(self.derivative.delta))
+        if len(self.changes) >= self.min_samples and self.changes.mean > self.threshold \
+                and t - self.last_shake > self.cooldown:
+            self.last_shake = t
+            return True
+        return False
+
+
+class Hysteresis:
+    """
+    Boolean state of a value against a threshold, with a band: the state turns on when the value goes above `on` and
+    off only when it goes back below `off` (off < on), so the noise around the threshold doesn't make it chatter. For
+    a state on below a threshold, give on < off: it turns on below `on` and off above `off`.
+    """
+
+    def __init__(self, on, off):
+        self.on = on
+        self.off = off
+        self.state = False
+
+    def update(self, t, value):
+        if self.on >= self.off:
+            if value > self.on:
+                self.state = True
+            elif value < self.off:
+                self.state = False
+        else:
+            if value < self.on:
+                self.state = True
+            elif value > self.off:
+                self.state = False
+        return self.state
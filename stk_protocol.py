@@ -0,0 +1,186 @@
+"""
+Binary command protocol shared by every producer and the STK_input_server.
+
+A datagram is one frame: a fixed header followed by one or more command records, so several commands sent together
+are applied atomically by the server.
+
+    header : magic (u8) | version (u8) | source id (u8) | record count (u8) | sequence number (u32)
+    record : opcode (u8) | flags (u8) | capture time in ns, time.monotonic_ns() clock (u64)
+
+The opcode is the index of the action in ACTIONS and the flags tell if the key is pressed, released or both (tap).
+The legacy text commands ('P_NITRO', 'R_NITRO', 'NITRO', ...) map to the same (opcode, flags) pairs, and the magic
+byte is never a printable character, so the server can accept both formats on the same port.
+"""
+import itertools
+import socket
+import struct
+import time
+
+PRESS = 1
+RELEASE = 2
+TAP = PRESS | RELEASE
+FLAGS = (PRESS, RELEASE, TAP)
+
+# The opcode of an action is its index in this tuple: only append new actions at the end
+ACTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT', 'SELECT', 'CANCEL', 'BACK', 'FIRE', 'NITRO', 'SKIDDING', 'LOOKBACK',
+           'RESCUE', 'PAUSE', 'ACCELERATE', 'BRAKE')
+OPCODES = {action: opcode for opcode, action in enumerate(ACTIONS)}
+
+# Producers, one per port of the STK_input_server
+SOURCE_UNKNOWN = 0
+SOURCE_OSC = 1
+SOURCE_QR = 2
+SOURCE_VOICE = 3
+SOURCE_ARDUINO = 4
+SOURCE_FACE = 5
+
+SOURCE_NAMES = {
+    SOURCE_UNKNOWN: 'unknown',
+    SOURCE_OSC: 'osc',
+    SOURCE_QR: 'qr',
+    SOURCE_VOICE: 'voice',
+    SOURCE_ARDUINO: 'arduino',
+    SOURCE_FACE: 'face',
+}
+
+MAGIC = 0xB5
+VERSION = 1
+HEADER = struct.Struct('<BBBBI')
+RECORD = struct.Struct('<BBQ')
+MAX_RECORDS = 255
+
+_PREFIX_FLAGS = {'P_': PRESS, 'R_': RELEASE}
+
+
+def parse_command(command):
+    """Return the (opcode, flags) pair of a legacy text command (str or bytes), or None if it is unknown."""
+    if isinstance(command, bytes):
+        command = command.decode('utf-8', 'replace')
+    flags = _PREFIX_FLAGS.get(command[:2], TAP)
+    action = command[2:] if flags != TAP else command
+    opcode = OPCODES.get(action)
+    if opcode is None:
+        return None
+    return opcode, flags
+
+
+def is_valid(opcode, flags):
+    """True if (opcode, flags) is a command of this protocol version, records from the network must be checked."""
+    return opcode < len(ACTIONS) and flags in FLAGS
+
+
+def command_name(opcode, flags):
+    """Legacy text name of an (opcode, flags) pair, used for debug output."""
+    if opcode >= len(ACTIONS):
+        return 'OPCODE_' + str(opcode)
+    if flags == PRESS:
+        return 'P_' + ACTIONS[opcode]
+    if flags == RELEASE:
+        return 'R_' + ACTIONS[opcode]
+    if flags == TAP:
+        return ACTIONS[opcode]
+    return ACTIONS[opcode] + '_FLAGS_' + str(flags)
+
+
+def legacy_table():
+    """Every legacy text command (as bytes) mapped to its (opcode, flags) pair."""
+    table = {}
+    for opcode, action in enumerate(ACTIONS):
+        table[action.encode()] = (opcode, TAP)
+        table[b'P_' + action.encode()] = (opcode, PRESS)
+        table[b'R_' + action.encode()] = (opcode, RELEASE)
+    return table
+
+
+def is_frame(data):
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+
+def encode(records, source, sequence):
+    """Build a frame from (opcode, flags, stamp_ns) records."""
+    count = len(records)
+    if not 0 < count <= MAX_RECORDS:
+        raise ValueError("A frame carries between 1 and " + str(MAX_RECORDS) + " records, got " + str(count))
+    frame = bytearray(HEADER.size + count * RECORD.size)
+    HEADER.pack_into(frame, 0, MAGIC, VERSION, source, count, sequence & 0xFFFFFFFF)
+    offset = HEADER.size
+    for opcode, flags, stamp in records:
+        RECORD.pack_into(frame, offset, opcode, flags, stamp)
+        offset += RECORD.size
+    return bytes(frame)
+
+
+def decode(data):
+    """
+    Return (source, sequence, records) from a frame, records being (opcode, flags, stamp_ns) tuples. The records are
+    not validated, see is_valid.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Frame too short")
+    magic, version, source, count, sequence = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version " + str(VERSION) + " command frame")
+    end = HEADER.size + count * RECORD.size
+    if len(data) != end:
+        raise ValueError("Frame announces " + str(count) + " records but has " + str(len(data)) + " bytes")
+    return source, sequence, list(RECORD.iter_unpack(memoryview(data)[HEADER.size:end]))
+
+
+def restamp(data, delta_ns):
+    """Copy of a frame with every capture stamp moved by delta_ns, used to replay recorded frames."""
+    frame = bytearray(data)
+    count = frame[3]
+    if len(frame) != HEADER.size + count * RECORD.size:
+        raise ValueError("Frame announces " + str(count) + " records but has " + str(len(frame)) + " bytes")
+    offset = HEADER.size
+    for _ in range(count):
+        opcode, flags, stamp = RECORD.unpack_from(frame, offset)
+        if stamp:
+            RECORD.pack_into(frame, offset, opcode, flags, max(0, stamp + delta_ns))
+        offset += RECORD.size
+    return bytes(frame)
+
+
+class CommandSender:
+    """
+    Sends commands to the STK_input_server for one producer.
+
+    send() takes the legacy command names (b'P_NITRO', 'R_FIRE', ...). All the commands given to one call are packed
+    in a single frame. With binary=False the legacy text format is used instead, one datagram per command.
+    """
+
+    def __init__(self, server_address, source, binary=True, sock=None):
+        self.server_address = server_address
+        self.source = source
+        self.binary = binary
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if sock is None else sock
+        self.sequence = itertools.count()
+        self._opcodes = {}
+
+    def _lookup(self, command):
+        code = self._opcodes.get(command)
+        if code is None:
+            code = parse_command(command)
+            if code is None:
+                raise ValueError("Command " + str(command) + " not recognized")
+            self._opcodes[command] = code
+        return code
+
+    def send(self, *commands, stamp=None):
+        """Send the commands together, stamp being the monotonic capture time in ns (now by default)."""
+        commands = [c for c in commands if c]
+        if not commands:
+            return
+
+        if not self.binary:
+            for command in commands:
+                self.sock.sendto(command if isinstance(command, bytes) else command.encode(), self.server_address)
+            return
+
+        if stamp is None:
+            stamp = time.monotonic_ns()
+        records = [self._lookup(command) + (stamp,) for command in commands]
+        self.sock.sendto(encode(records, self.source, next(self.sequence)), self.server_address)
+
+    def close(self):
+        self.sock.close()
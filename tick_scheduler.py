@@ -0,0 +1,90 @@
+"""
+Fixed rate loop on absolute monotonic deadlines.
+
+Tick k is due at start + k * period, whatever the time taken by the work of the previous ticks, so the period doesn't
+drift. The thread sleeps until `spin` seconds before the deadline and busy waits the rest, to get below the sleep
+granularity of the OS (about 1 ms on Linux, up to 15.6 ms on Windows). When the work overruns one or more deadlines,
+the missed ticks are skipped instead of being run back to back: the callback gets the index of the tick, so it can see
+the gap.
+
+    scheduler = TickScheduler(60, spin=0.001)
+    scheduler.run(lambda tick, deadline: ..., lambda: running)
+    scheduler.stats()  # ticks, missed ticks, wake up jitter p50/p99/max in microseconds
+"""
+import threading
+import time
+
+from latency_metrics import LatencyHistogram
+
+
+class TickScheduler:
+
+    def __init__(self, frequency, spin=0.0, clock=time.monotonic_ns):
+        """frequency in Hz, spin is the busy waited tail (seconds) of each wait, 0 to only sleep."""
+        self.period = int(1e9 / frequency)  # ns
+        self.spin = int(spin * 1e9)
+        self.clock = clock
+        self.start = None
+        self.tick = 0
+        self.ticks = 0  # Ticks run
+        self.missed = 0  # Ticks skipped because the work overran their deadline
+        self.jitter = LatencyHistogram()  # Wake up time - deadline, in microseconds
+        self.stop_event = threading.Event()
+
+    @property
+    def frequency(self):
+        return 1e9 / self.period
+
+    def stop(self):
+        self.stop_event.set()
+
+    def deadline(self, tick):
+        return self.start + tick * self.period
+
+    def wait_next(self):
+        """Wait for the next tick, return (tick index, deadline in ns). The first call starts the schedule."""
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+            self.ticks += 1
+            self.jitter.record(0)
+            return 0, now
+
+        tick = self.tick + 1
+        if now > self.deadline(tick):
+            # Skip the ticks whose deadline is already gone, the next one is the first one in the future
+            late = (now - self.start) // self.period + 1
+            self.missed += late - tick
+            tick = late
+        deadline = self.deadline(tick)
+
+        remaining = deadline - now - self.spin
+        if remaining > 0:
+            if self.stop_event.wait(remaining / 1e9):
+                return tick, deadline
+        now = self.clock()
+        while now < deadline:
+            now = self.clock()
+
+        self.tick = tick
+        self.ticks += 1
+        self.jitter.record((now - deadline) // 1000)
+        return tick, deadline
+
+    def run(self, callback, running=None):
+        """Call callback(tick, deadline) on every tick until stop() is called or running() returns False."""
+        while not self.stop_event.is_set() and (running is None or running()):
+            tick, deadline = self.wait_next()
+            if self.stop_event.is_set():
+                break
+            callback(tick, deadline)
+
+    def stats(self):
+        return {
+            'frequency': self.frequency,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'jitter_p50_us': self.jitter.quantile(0.5),
+            'jitter_p99_us': self.jitter.quantile(0.99),
+            'jitter_max_us': self.jitter.max,
+        }
@@ -0,0 +1,160 @@
+"""
+Delayed calls on a single thread, instead of one threading.Timer (so one OS thread) per call.
+
+The instant commands (fire, rescue...) press a key and release it a fraction of a second later. The releases are
+scheduled on a TimerService: a heap of deadlines on the monotonic clock served by one thread, so rapid fire doesn't
+create and tear down a thread per command. The callbacks run on that thread and must return quickly; a long running
+task should start its own thread from the callback.
+
+    timers = default_service()
+    handle = timers.schedule(0.2, sender.send, b'R_FIRE')
+    timers.reschedule(handle, 0.2)  # Push the release back
+    handle.cancel()
+    timers.pending()
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from latency_metrics import LatencyHistogram
+
+
+class TimerHandle:
+    __slots__ = ('service', 'callback', 'args', 'deadline', 'sequence', 'active')
+
+    def __init__(self, service, callback, args):
+        self.service = service
+        self.callback = callback
+        self.args = args
+        self.deadline = 0  # Monotonic time (ns) of the call
+        self.sequence = 0  # Heap entry currently valid for this handle
+        self.active = False  # Waiting to be called
+
+    def cancel(self):
+        return self.service.cancel(self)
+
+    def reschedule(self, delay):
+        return self.service.reschedule(self, delay)
+
+
+class TimerService:
+
+    def __init__(self, name='timer-service'):
+        self.name = name
+        self.heap = []  # (deadline, sequence, handle), entries of cancelled or rescheduled handles are skipped
+        self.sequence = itertools.count(1)
+        self.condition = threading.Condition()
+        self.count = 0  # Active timers
+        self.fired = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.lateness = LatencyHistogram()  # Call time - deadline, in microseconds
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread, the pending timers are dropped."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None and threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _push(self, handle, delay):
+        handle.deadline = time.monotonic_ns() + int(delay * 1e9)
+        handle.sequence = next(self.sequence)
+        if not handle.active:
+            handle.active = True
+            self.count += 1
+        heapq.heappush(self.heap, (handle.deadline, handle.sequence, handle))
+        if self.heap[0][2] is handle:
+            self.condition.notify()
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) in delay seconds, return a TimerHandle."""
+        handle = TimerHandle(self, callback, args)
+        with self.condition:
+            self._push(handle, delay)
+        return handle
+
+    def reschedule(self, handle, delay):
+        """Move the call delay seconds from now, the handle is armed again if it already fired or was cancelled."""
+        with self.condition:
+            self._push(handle, delay)
+        return handle
+
+    def cancel(self, handle):
+        """Return True if the call was pending."""
+        with self.condition:
+            if not handle.active:
+                return False
+            handle.active = False
+            self.count -= 1
+            self.cancelled += 1
+            return True
+
+    def pending(self):
+        return self.count
+
+    def _run(self):
+        while True:
+            with self.condition:
+                handle = None
+                while self.running and handle is None:
+                    heap = self.heap
+                    while heap and (not heap[0][2].active or heap[0][2].sequence != heap[0][1]):
+                        heapq.heappop(heap)
+                    if not heap:
+                        self.condition.wait()
+                        continue
+                    wait = heap[0][0] - time.monotonic_ns()
+                    if wait > 0:
+                        self.condition.wait(wait / 1e9)
+                        continue
+                    handle = heapq.heappop(heap)[2]
+                    handle.active = False
+                    self.count -= 1
+                    self.fired += 1
+                    self.lateness.record((time.monotonic_ns() - handle.deadline) // 1000)
+                if not self.running:
+                    return
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                self.errors += 1
+                print("Timer callback " + getattr(handle.callback, '__name__', str(handle.callback)) + " failed: "
+                      + repr(e))
+
+    def stats(self):
+        return {
+            'pending': self.count,
+            'fired': self.fired,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+            'lateness_p50_us': self.lateness.quantile(0.5),
+            'lateness_p99_us': self.lateness.quantile(0.99),
+            'lateness_max_us': self.lateness.max,
+        }
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def default_service():
+    """TimerService shared by the whole process, started on first use."""
+    global _default_service
+    with _default_lock:
+        if _default_service is None:
+            _default_service = TimerService().start()
+        return _default_service
@@ -2,13 +2,14 @@ import sounddevice as sd
 import queue
 import sys
 import json
-import socket
 import time
 from vosk import Model, KaldiRecognizer
 
+from stk_protocol import CommandSender, SOURCE_VOICE
+
 
 class AudioProcessor:
-    def __init__(self, model_path, target_word="fire", _server_address='localhost', _server_port=6008):
+    def __init__(self, model_path, target_word="fire", _server_address='localhost', _server_port=6008, sender=None):
         self.model_path = model_path
         self.target_word = target_word.lower()
         self.audio_queue = queue.Queue()
@@ -24,27 +25,28 @@ class AudioProcessor:
         except Exception as e:
             raise Exception(f"Failed to load model: {str(e)}")
 
-        # Setup socket for sending commands
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Setup sender for the commands (UDP by default, command_bus.BusSender when running with the server)
+        self.sender = CommandSender(self.server_address, SOURCE_VOICE) if sender is None else sender
 
     def audio_callback(self, indata, frames, time_info, status):
         """Callback function for audio stream"""
         if status:
             print(f"Audio stream error: {status}", file=sys.stderr)
-        self.audio_queue.put(bytes(indata))
+        # Keep the time at which the block was captured to stamp the commands it triggers
+        self.audio_queue.put((time.monotonic_ns(), bytes(indata)))
 
     def process_audio(self):
         """Process audio data from the queue"""
         try:
-            data = self.audio_queue.get(timeout=1)
+            stamp, data = self.audio_queue.get(timeout=1)
             if self.recognizer.AcceptWaveform(data):
                 result = json.loads(self.recognizer.Result())
                 if 'text' in result and result['text']:
-                    self.check_for_target_word(result['text'], is_partial=False)
+                    self.check_for_target_word(result['text'], is_partial=False, stamp=stamp)
             else:
                 partial = json.loads(self.recognizer.PartialResult())
                 if 'partial' in partial and partial['partial']:
-                    self.check_for_target_word(partial['partial'], is_partial=True)
+                    self.check_for_target_word(partial['partial'], is_partial=True, stamp=stamp)
         except queue.Empty:
             pass
         except json.JSONDecodeError:
@@ -52,7 +54,7 @@ class AudioProcessor:
         except Exception as e:
             print(f"Error processing audio: {str(e)}", file=sys.stderr)
 
-    def check_for_target_word(self, text, is_partial):
+    def check_for_target_word(self, text, is_partial, stamp=None):
         """Check if target word is in the recognized text"""
         current_time = time.time()
         if self.target_word in text.lower():
@@ -62,17 +64,17 @@ class AudioProcessor:
                 print(f"Recognized text: {text}")
 
                 # Send command to server immediately
-                self.send_fire_command()
+                self.send_fire_command(stamp)
                 self.last_detection_time = current_time
 
-    def send_fire_command(self):
+    def send_fire_command(self, stamp=None):
         """Send the 'FIRE' command to the server"""
         try:
-            self.sock.sendto(b"P_FIRE", self.server_address)
+            self.sender.send(b"P_FIRE", stamp=stamp)
 
             print("Command 'FIRE' sent to server.")
             time.sleep(1)
-            self.sock.sendto(b"R_FIRE", self.server_address)
+            self.sender.send(b"R_FIRE")
         except Exception as e:
             print(f"Failed to send command: {str(e)}", file=sys.stderr)
 
@@ -102,7 +104,7 @@ class AudioProcessor:
         finally:
             if 'stream' in locals():
                 stream.close()
-            self.sock.close()
+            self.sender.close()
 
 
 def main():